@@ -0,0 +1,199 @@
+"""按筛选条件批量生成销售汇总报告的命令行工具，不需要打开仪表盘。
+
+读取一个目录（或通配符）下的所有工作簿，按筛选条件在进程池中并行生成与仪表盘
+"下载Excel分析报告"相同的区域销售汇总和产品销售汇总，每组筛选条件写出一个工作簿，
+并在输出目录中写出汇总清单 summary.json。适合定时任务，例如每晚按区域生成报告：
+
+    python batch_report.py ./data --split-by 所属区域 --output ./reports
+
+筛选条件文件为JSON列表，每一项是一组筛选条件，name为报告名称，其余键为筛选维度：
+
+    [{"name": "华南重点客户", "所属区域": ["南"], "客户简称": ["广州佳成行"]}]
+
+同时指定 --filters 和 --split-by 时，每组筛选条件再按该维度的每个取值分别生成报告。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sales_analytics import (
+    PARQUET_AVAILABLE, DEFAULT_NEW_PRODUCT_COHORTS, FILTER_COLUMNS,
+    DatasetStore, FilterIndex, SalesCube, ingest_workbook, read_cached_frame, concat_frames,
+    normalize_cohorts, cohort_registry_key, compute_row_cohorts, new_product_view, generate_excel_report
+)
+
+DEFAULT_CONFIG_PATH = "./.streamlit/dashboard_config.json"
+
+# 工作进程中的数据集、立方体和筛选索引，由进程初始化函数加载
+_worker_state = {}
+
+
+def notify(message):
+    print(message, file=sys.stderr)
+
+
+def load_config(path):
+    """读取仪表盘配置（缓存容量、流式加载阈值和新品批次），文件不存在时使用默认值"""
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def build_report_specs(filters_path, split_by, cube):
+    """展开筛选条件：读取筛选条件文件，再按split_by维度的每个取值拆分"""
+    if filters_path:
+        with open(filters_path, 'r', encoding='utf-8') as f:
+            specs = json.load(f)
+        if not isinstance(specs, list):
+            raise ValueError("筛选条件文件应为JSON列表")
+    else:
+        specs = [{'name': '全部'}]
+
+    for i, spec in enumerate(specs):
+        unknown = [key for key in spec if key != 'name' and key not in FILTER_COLUMNS]
+        if unknown:
+            raise ValueError(f"第 {i + 1} 组筛选条件包含未知的维度: {', '.join(unknown)}")
+        spec.setdefault('name', f"报告{i + 1}")
+
+    if split_by is None:
+        return specs
+    values = cube.values(split_by)
+    return [
+        dict(spec, **{split_by: [value]},
+             name=str(value) if len(specs) == 1 and spec['name'] == '全部' else f"{spec['name']}_{value}")
+        for spec in specs for value in values
+    ]
+
+
+def report_file_name(name):
+    # 去掉文件名中不允许的字符
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_') or 'report'
+
+
+def _init_worker(file_hashes, frame, cube, cohorts):
+    """工作进程初始化。
+
+    只生成汇总时直接使用传入的立方体，不读取逐行数据；需要明细时从列式缓存读取数据集
+    （没有pyarrow时使用传入的数据），并建立立方体。
+    """
+    if cube is None:
+        if frame is None:
+            frame = concat_frames([read_cached_frame(file_hash) for file_hash in file_hashes])
+        cube = SalesCube(frame)
+    _worker_state['frame'] = frame
+    _worker_state['cube'] = cube
+    _worker_state['cohorts'] = cohorts
+    _worker_state['filter_index'] = None
+
+
+def _run_report(spec, output_dir, include_data):
+    """生成一组筛选条件的报告，返回写入清单的结果"""
+    start = time.perf_counter()
+    frame = _worker_state['frame']
+    cube = _worker_state['cube']
+    selections = {dim: [str(value) for value in spec[dim]] for dim in FILTER_COLUMNS if spec.get(dim)}
+
+    # 与仪表盘一致：使结果为空的筛选维度会被跳过，跳过的维度记录在清单中
+    mask, applied = cube.select(selections) if selections else (None, {})
+    region_summary = cube.region_summary(mask)
+    product_summary = cube.product_summary(mask)
+
+    if include_data:
+        if _worker_state['filter_index'] is None:
+            _worker_state['filter_index'] = FilterIndex(frame)
+        rows, _ = _worker_state['filter_index'].filter_rows(selections)
+        data = frame if rows is None else frame.take(rows)
+        cohorts = _worker_state['cohorts']
+        row_cohorts = compute_row_cohorts(data, cohort_registry_key(cohorts))
+        new_rows = (row_cohorts >= 0).nonzero()[0]
+        new_products_df = new_product_view(data, new_rows, row_cohorts, [cohort['name'] for cohort in cohorts])
+        report = generate_excel_report(data, new_products_df, region_summary, product_summary)
+    else:
+        report = generate_excel_report(None, None, region_summary, product_summary)
+
+    path = os.path.join(output_dir, f"{report_file_name(spec['name'])}.xlsx")
+    with open(path, 'wb') as f:
+        f.write(report)
+    return {
+        'name': spec['name'],
+        'path': path,
+        'filters': selections,
+        'skipped_filters': [dim for dim in selections if dim not in applied],
+        'sales': float(region_summary['销售额'].sum()),
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按筛选条件批量生成销售汇总报告")
+    parser.add_argument('source', help="工作簿目录或通配符，例如 ./data 或 ./data/销售_*.xlsx")
+    parser.add_argument('--filters', help="筛选条件JSON文件，默认只生成全部数据的报告")
+    parser.add_argument('--split-by', choices=FILTER_COLUMNS, help="按该维度的每个取值分别生成报告")
+    parser.add_argument('--output', default='./reports', help="报告输出目录（默认 ./reports）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行的进程数")
+    parser.add_argument('--include-data', action='store_true',
+                        help="报告中同时写出筛选后的明细数据和新品数据，与仪表盘下载的报告相同")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help="读取新品批次和缓存设置的仪表盘配置文件")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    cohorts = normalize_cohorts(config.get('new_product_cohorts', DEFAULT_NEW_PRODUCT_COHORTS))
+
+    # 与仪表盘共用列式缓存和登记表，已解析过的工作簿不会重新解析；
+    # 只生成汇总时不保留逐行数据，各文件按批汇总为立方体，超过内存的工作簿也能处理
+    store = DatasetStore(args.source, keep_frame=args.include_data)
+    store.refresh(ingest=lambda path, file_hash: ingest_workbook(path, file_hash, config, notify=notify,
+                                                                  cube_only=not args.include_data),
+                  notify=notify)
+    specs = build_report_specs(args.filters, args.split_by, store.cube)
+    os.makedirs(args.output, exist_ok=True)
+
+    # 只生成汇总时把立方体传给各进程；需要明细时工作进程从列式缓存读取数据集，
+    # 只有没有pyarrow时才把数据传给各进程
+    if args.include_data:
+        initargs = (list(store.file_hashes.values()), None if PARQUET_AVAILABLE else store.frame, None, cohorts)
+    else:
+        initargs = ([], None, store.cube, cohorts)
+    results, failures = [], []
+    start = time.perf_counter()
+    if args.workers <= 1:
+        _init_worker(*initargs)
+        for spec in specs:
+            try:
+                results.append(_run_report(spec, args.output, args.include_data))
+            except Exception as e:
+                failures.append({'name': spec['name'], 'error': str(e)})
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(_run_report, spec, args.output, args.include_data): spec for spec in specs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    failures.append({'name': futures[future]['name'], 'error': str(e)})
+
+    for result in sorted(results, key=lambda result: result['name']):
+        skipped = f"（跳过无匹配数据的筛选: {', '.join(result['skipped_filters'])}）" if result['skipped_filters'] else ""
+        print(f"{result['name']}: 销售额 {result['sales']:,.2f} 元 -> {result['path']}{skipped}")
+    for failure in failures:
+        notify(f"{failure['name']}: 生成报告失败: {failure['error']}")
+
+    with open(os.path.join(args.output, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'source': args.source,
+            'files': len(store.file_hashes),
+            'rows': store.rows,
+            'seconds': round(time.perf_counter() - start, 3),
+            'reports': sorted(results, key=lambda result: result['name']),
+            'failures': failures
+        }, f, ensure_ascii=False, indent=4)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""销售分析各阶段的性能基准测试，结果写出为JSON，便于比较不同版本的耗时。
+
+用synthetic_data生成指定行数的模拟数据，依次计时：工作簿解析（整表读取和流式读取）、
+列式缓存读写、产品名称简化、筛选、立方体构建及各项分组汇总、图表构建和报告导出。
+每项重复执行多次，记录最短耗时和每次耗时。
+
+    python benchmark.py --sizes 10000 100000 1000000 --output ./benchmarks/v2.json
+    python benchmark.py --sizes 100000 --compare ./benchmarks/v1.json
+
+超过Excel单表行数上限的规模跳过工作簿解析和Excel明细报告，其余阶段照常计时，
+列式缓存按解析后的数据直接写出。指定 --compare 时按相同阶段和行数对比两次结果，
+耗时增加超过 --threshold 的阶段视为回归，命令以退出码1结束。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import sales_analytics
+from sales_analytics import (
+    SCIPY_AVAILABLE, PARQUET_AVAILABLE,
+    read_cached_frame, write_cached_frame, ingest_workbook, simplify_product_names, add_product_attributes, ProductDimension, optimize_dtypes,
+    FilterIndex, SalesCube, SalesTimeSeries, segment_customers, ProductAffinity, PenetrationIndex,
+    normalize_cohorts, cohort_registry_key, compute_row_cohorts, new_product_view, compare_cohorts,
+    build_region_summary, build_product_summary, generate_excel_report, export_parquet, export_csv_gz
+)
+from synthetic_data import EXCEL_MAX_ROWS, generate_sales_data, write_workbook
+
+try:
+    import plotly.express as px
+    PLOTLY_AVAILABLE = True
+except ImportError:
+    # 没有plotly时跳过图表构建
+    PLOTLY_AVAILABLE = False
+
+DEFAULT_SIZES = [10000, 100000]
+STAGES = ['ingest', 'simplify', 'filter', 'groupby', 'figure', 'report']
+PACKAGES = ['pandas', 'numpy', 'pyarrow', 'scipy', 'plotly', 'openpyxl', 'xlsxwriter', 'streamlit']
+
+
+class BenchmarkRun:
+    """一个数据规模下的计时结果"""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.timings = {}
+        self.skipped = {}
+
+    def time(self, name, func, repeat=None):
+        """重复执行func并记录每次耗时，返回最后一次的结果"""
+        runs = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            # 先释放上一次的结果，大数据量时内存中不会同时存在两份
+            result = None
+            start = time.perf_counter()
+            result = func()
+            runs.append(time.perf_counter() - start)
+        self.timings[name] = {
+            'best': round(min(runs), 6),
+            'mean': round(sum(runs) / len(runs), 6),
+            'runs': [round(run, 6) for run in runs]
+        }
+        print(f"  {name:<32} {min(runs):>10.4f} s", flush=True)
+        return result
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+        print(f"  {name:<32} 跳过：{reason}", flush=True)
+
+
+def prepare_frame(df):
+    """在生成的数据上就地补齐预处理得到的列，作为不经过工作簿解析时的数据准备（不计时）。
+
+    产品属性由分类列的编码建立产品维度表后按键取出，5000万行时也不需要逐行处理字符串。
+    """
+    df['销售额'] = df['单价（箱）'] * df['数量（箱）']
+    add_product_attributes(df)
+    return optimize_dtypes(df)
+
+
+def typical_selections(df):
+    """与侧边栏常见操作相近的筛选：两个区域下销售额前20的产品"""
+    regions = df['所属区域'].cat.categories[:2].tolist()
+    top_products = df['产品代码'].value_counts().index[:20].tolist()
+    return {'所属区域': regions, '产品代码': [str(code) for code in top_products]}
+
+
+def synthetic_cohorts(df):
+    """把最晚出现的若干产品登记为新品批次，上市日期为各产品首次发运的月份"""
+    first_months = df.groupby('产品代码', observed=True)['发运月份'].min().sort_values()
+    late = first_months.iloc[-10:]
+    launch_date = late.min().strftime('%Y-%m-%d')
+    return normalize_cohorts([{'name': '模拟新品', 'launch_date': launch_date,
+                               'products': [str(code) for code in late.index]}])
+
+
+def bench_ingest(run, state, workdir):
+    """工作簿解析和列式缓存读写，state中生成的数据替换为从列式缓存读回的数据"""
+    config = {'parquet_cache_max_mb': 1 << 20}
+    raw = state.pop('frame')
+    if len(raw) > EXCEL_MAX_ROWS:
+        for name in ['ingest.read_excel', 'ingest.stream_excel']:
+            run.skip(name, f"超过Excel单表 {EXCEL_MAX_ROWS:,} 行上限")
+        df = prepare_frame(raw)
+    else:
+        path = os.path.join(workdir, 'benchmark.xlsx')
+        write_workbook(raw, path)
+        df = run.time('ingest.read_excel', lambda: ingest_workbook(
+            path, 'benchmark_read', dict(config, streaming_threshold_mb=1 << 20)))
+        run.time('ingest.stream_excel', lambda: ingest_workbook(
+            path, 'benchmark_stream', dict(config, streaming_threshold_mb=0)))
+    del raw
+
+    if not PARQUET_AVAILABLE:
+        run.skip('ingest.write_cache', "未安装pyarrow")
+        run.skip('ingest.read_cache', "未安装pyarrow")
+        state['frame'] = df
+        return
+    run.time('ingest.write_cache', lambda: write_cached_frame(df, 'benchmark_cache', config['parquet_cache_max_mb']))
+    # DataFrame内部有循环引用，主动回收后再读取，5000万行时内存中只保留一份数据
+    del df
+    gc.collect()
+    state['frame'] = run.time('ingest.read_cache', lambda: read_cached_frame('benchmark_cache'))
+
+
+def bench_simplify(run, raw):
+    # 解析Excel得到的名称列为字符串对象；超过Excel行数上限的数据只会经由流式读取或列式缓存得到分类列
+    if len(raw) > EXCEL_MAX_ROWS:
+        run.skip('simplify.product_names', f"超过Excel单表 {EXCEL_MAX_ROWS:,} 行上限，只计时分类列")
+    else:
+        codes = raw['产品代码'].astype(object)
+        names = raw['产品名称'].astype(object)
+        run.time('simplify.product_names', lambda: simplify_product_names(codes, names))
+    run.time('simplify.product_names_categorical',
+             lambda: simplify_product_names(raw['产品代码'], raw['产品名称']))
+    run.time('simplify.product_dimension', lambda: ProductDimension.from_frame(raw))
+
+
+def bench_filter(run, df, selections):
+    index = run.time('filter.build_index', lambda: FilterIndex(df))
+    rows = run.time('filter.filter_rows', lambda: index.filter_rows(selections)[0])
+    run.time('filter.take_rows', lambda: df.take(rows))
+
+
+def bench_groupby(run, state, selections, cohorts):
+    df = state['frame']
+    cube = run.time('groupby.build_cube', lambda: SalesCube(df))
+    mask, _ = cube.select(selections)
+    state['cube'], state['mask'] = cube, mask
+
+    run.time('groupby.region_summary', lambda: cube.region_summary(mask))
+    run.time('groupby.product_summary', lambda: cube.product_summary(mask))
+    run.time('groupby.applicant', lambda: cube.rollup(['申请人'], mask, distinct=['客户简称']))
+    run.time('groupby.packaging', lambda: cube.rollup(['包装类型'], mask))
+    run.time('groupby.time_series', lambda: SalesTimeSeries._resample(cube, '所属区域', 'M', mask))
+    run.time('groupby.rfm_segments', lambda: segment_customers(cube, mask))
+    if SCIPY_AVAILABLE:
+        run.time('groupby.product_affinity', lambda: ProductAffinity(cube, mask).top_pairs())
+    else:
+        run.skip('groupby.product_affinity', "未安装scipy")
+    new_products = [code for cohort in cohorts for code in cohort['products']]
+    run.time('groupby.penetration', lambda: PenetrationIndex(cube, None, new_products).region_product_rates())
+    run.time('groupby.cohorts', lambda: compare_cohorts(cube, None, cohorts))
+    # 报告中的汇总表直接在明细数据上分组
+    run.time('groupby.pandas_region_summary', lambda: build_region_summary(df))
+    run.time('groupby.pandas_product_summary', lambda: build_product_summary(df))
+
+
+def bench_figure(run, cube, mask):
+    if not PLOTLY_AVAILABLE:
+        for name in ['figure.region_bar', 'figure.product_bar', 'figure.trend_line']:
+            run.skip(name, "未安装plotly")
+        return
+    region_summary = cube.region_summary(mask)
+    product_summary = cube.product_summary(mask).head(20)
+    trend = SalesTimeSeries._resample(cube, '所属区域', 'M', mask)
+    trend.index = trend.index.to_timestamp()
+    trend = trend.reset_index().melt(id_vars='发运月份', var_name='所属区域', value_name='销售额')
+
+    # 与图表缓存一致，计入构建和序列化为JSON的耗时
+    run.time('figure.region_bar', lambda: px.bar(
+        region_summary, x='区域', y='销售额', color='区域', text='销售额').to_json())
+    run.time('figure.product_bar', lambda: px.bar(
+        product_summary, x='产品名称', y='销售额', color='产品名称').to_json())
+    run.time('figure.trend_line', lambda: px.line(
+        trend, x='发运月份', y='销售额', color='所属区域', markers=True).to_json())
+
+
+def bench_report(run, df, cube, cohorts):
+    region_summary = cube.region_summary()
+    product_summary = cube.product_summary()
+    if len(df) > EXCEL_MAX_ROWS:
+        run.skip('report.excel', f"超过Excel单表 {EXCEL_MAX_ROWS:,} 行上限")
+        run.time('report.excel_summary', lambda: generate_excel_report(None, None, region_summary, product_summary))
+    else:
+        row_cohorts = compute_row_cohorts(df, cohort_registry_key(cohorts))
+        new_rows = np.flatnonzero(row_cohorts >= 0)
+        new_products_df = new_product_view(df, new_rows, row_cohorts, [cohort['name'] for cohort in cohorts])
+        run.time('report.excel', lambda: generate_excel_report(df, new_products_df, region_summary, product_summary))
+    if PARQUET_AVAILABLE:
+        run.time('report.parquet', lambda: export_parquet(df))
+    else:
+        run.skip('report.parquet', "未安装pyarrow")
+    run.time('report.csv_gz', lambda: export_csv_gz(df))
+
+
+def run_size(n_rows, seed, repeat, stages, workdir):
+    print(f"{n_rows:,} 行", flush=True)
+    run = BenchmarkRun(repeat)
+    # 各阶段之间传递的数据放在state中，由列式缓存读回时可以先释放生成的那一份
+    state = {'frame': run.time('generate', lambda: generate_sales_data(n_rows, seed=seed), repeat=1)}
+    cardinalities = {col: int(len(state['frame'][col].cat.categories)) for col in ['客户简称', '申请人', '产品代码']}
+
+    if 'simplify' in stages:
+        bench_simplify(run, state['frame'])
+    if 'ingest' in stages:
+        bench_ingest(run, state, workdir)
+    else:
+        prepare_frame(state['frame'])
+    df = state['frame']
+
+    selections = typical_selections(df)
+    cohorts = synthetic_cohorts(df)
+    if 'filter' in stages:
+        bench_filter(run, df, selections)
+        gc.collect()
+
+    if 'groupby' in stages:
+        bench_groupby(run, state, selections, cohorts)
+    else:
+        state['cube'] = SalesCube(df)
+        state['mask'] = state['cube'].select(selections)[0]
+    if 'figure' in stages:
+        bench_figure(run, state['cube'], state['mask'])
+    if 'report' in stages:
+        bench_report(run, df, state['cube'], cohorts)
+
+    return {
+        'rows': n_rows,
+        'cardinalities': cardinalities,
+        'timings': run.timings,
+        'skipped': run.skipped
+    }
+
+
+def package_versions():
+    versions = {}
+    for name in PACKAGES:
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current, baseline, threshold, min_delta):
+    """按(行数, 阶段)对比最短耗时，返回耗时增加超过threshold且超过min_delta秒的阶段"""
+    previous = {(size['rows'], name): timing['best']
+                for size in baseline['sizes'] for name, timing in size['timings'].items()}
+    regressions = []
+    print(f"\n对比 {baseline.get('revision') or '基线'} -> {current.get('revision') or '当前'}")
+    for size in current['sizes']:
+        for name, timing in size['timings'].items():
+            old = previous.get((size['rows'], name))
+            if old is None or name == 'generate':
+                continue
+            ratio = timing['best'] / old if old > 0 else float('inf')
+            flag = ''
+            if ratio > 1 + threshold and timing['best'] - old > min_delta:
+                flag = '  回归'
+                regressions.append({'rows': size['rows'], 'stage': name, 'baseline': old,
+                                    'current': timing['best'], 'ratio': round(ratio, 3)})
+            print(f"  {size['rows']:>11,} {name:<32} {old:>10.4f} -> {timing['best']:>10.4f} s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="销售分析性能基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="模拟数据的行数，可指定多个（1万到5000万）")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复执行的次数，取最短耗时")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help="只运行指定的阶段")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="结果JSON文件，默认写到 ./benchmarks/<版本>_<时间>.json")
+    parser.add_argument('--compare', help="与之前的结果JSON对比")
+    parser.add_argument('--threshold', type=float, default=0.2, help="耗时增加超过该比例视为回归（默认0.2）")
+    parser.add_argument('--min-delta', type=float, default=0.01,
+                        help="耗时增加不足该秒数时不视为回归，避免毫秒级阶段的计时波动（默认0.01）")
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    started = datetime.now()
+    results = {
+        'revision': revision,
+        'started': started.isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': package_versions(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'sizes': []
+    }
+
+    output = args.output or os.path.join(
+        'benchmarks', f"{revision or 'local'}_{started.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+
+    # 列式缓存写到临时目录，不影响仪表盘的缓存
+    with tempfile.TemporaryDirectory(prefix='sales_benchmark_') as workdir:
+        sales_analytics.CACHE_DIR = os.path.join(workdir, 'parquet_cache')
+        for n_rows in args.sizes:
+            results['sizes'].append(run_size(n_rows, args.seed, args.repeat, args.stages, workdir))
+            # 每个规模完成后即写出，大规模因内存不足中断时保留已完成的结果
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"\n结果已写入 {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} 项耗时增加超过 {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
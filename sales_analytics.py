@@ -0,0 +1,2262 @@
+"""销售数据分析的计算部分：工作簿解析与列式缓存、紧凑数据模型、筛选索引、
+预聚合立方体，以及趋势、客户细分、产品组合、渗透率和报告导出。
+
+本模块不依赖streamlit和绘图库，仪表盘和批量报告命令行工具（batch_report.py）
+都从这里导入；需要在页面上显示的提示和进度通过notify、progress回调传入。
+"""
+import os
+import re
+import json
+import sys
+import hashlib
+import threading
+import copy
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    # 用于Parquet列式缓存和流式写入
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.csv as pcsv
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+try:
+    # 用于产品组合分析的稀疏矩阵
+    import scipy.sparse as sp
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+try:
+    # 用于读取进程常驻内存，没有时在Linux上读取/proc
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# 多文件数据集的登记表（记录各源文件的修改时间、大小和内容哈希）
+REGISTRY_PATH = "./.streamlit/dataset_registry.json"
+# 定义列式缓存目录及默认容量上限
+CACHE_DIR = "./.streamlit/parquet_cache"
+DEFAULT_CACHE_MAX_MB = 2048
+# 超过该大小（MB）的xlsx文件使用流式加载，每批读取的行数
+DEFAULT_STREAMING_THRESHOLD_MB = 100
+STREAMING_CHUNK_ROWS = 50000
+# 逐批建立立方体时每累积该数量的分块立方体合并一次
+CUBE_MERGE_CHUNKS = 4
+# 聚合结果缓存的默认内存上限
+DEFAULT_AGGREGATE_CACHE_MAX_MB = 256
+# 报告中超过该行数的工作表使用xlsxwriter的constant_memory模式逐行写出
+EXCEL_CONSTANT_MEMORY_ROWS = 100000
+# 散点图超过该行数时改为按网格分箱聚合后再绘制，每个坐标轴的分箱数
+SCATTER_BINNING_ROWS = 20000
+SCATTER_GRID_BINS = 60
+# 预处理逻辑变化时递增，使旧版本缓存失效
+CACHE_VERSION = 3
+# 配置文件中没有新品批次登记时使用的默认批次
+DEFAULT_NEW_PRODUCT_COHORTS = [
+    {"name": "2025新品", "launch_date": "2025-01-01",
+     "products": ['F0110C', 'F0183F', 'F01K8A', 'F0183K', 'F0101P']}
+]
+# 性能剖析日志超过该大小时轮换为 .1 文件
+DEFAULT_PROFILE_LOG_MAX_MB = 50
+# 维度列，加载时转换为分类类型（整数编码+共享字典）
+DIMENSION_COLUMNS = ['所属区域', '客户简称', '申请人', '产品代码', '产品名称', '订单类型', '简化产品名称', '包装类型', '规格']
+
+
+# ---- 列式缓存函数 ----
+def compute_file_hash(file_path):
+    """计算源文件内容的SHA-256哈希，作为列式缓存的键"""
+    hasher = hashlib.sha256()
+    if hasattr(file_path, 'read'):
+        # 上传的文件对象，读取后需复位以便后续解析
+        file_path.seek(0)
+        for chunk in iter(lambda: file_path.read(1 << 20), b''):
+            hasher.update(chunk)
+        file_path.seek(0)
+    else:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_cache_path(file_hash):
+    return os.path.join(CACHE_DIR, f"{file_hash}_v{CACHE_VERSION}.parquet")
+
+
+def read_cached_frame(file_hash):
+    """读取已预处理的列式缓存，未命中或缓存损坏时返回None"""
+    if not PARQUET_AVAILABLE:
+        return None
+    cache_path = get_cache_path(file_hash)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        # 更新修改时间，作为LRU淘汰依据
+        os.utime(cache_path)
+        # 维度列直接按字典编码读取为分类类型，避免逐行生成字符串
+        columns = pq.read_schema(cache_path).names
+        table = pq.read_table(cache_path, memory_map=True,
+                              read_dictionary=[col for col in DIMENSION_COLUMNS if col in columns])
+        # 逐列转换并释放Arrow缓冲区，峰值内存不再是Arrow表与DataFrame之和
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
+        return optimize_dtypes(df)
+    except Exception:
+        # 缓存文件损坏，删除后重新解析Excel
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+        return None
+
+
+def iter_cached_chunks(file_hash, chunk_rows=STREAMING_CHUNK_ROWS):
+    """按批读取列式缓存，维度列为分类类型，不把整个文件读入内存"""
+    cache_path = get_cache_path(file_hash)
+    os.utime(cache_path)
+    columns = pq.read_schema(cache_path).names
+    parquet_file = pq.ParquetFile(cache_path, read_dictionary=[col for col in DIMENSION_COLUMNS if col in columns])
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        yield optimize_dtypes(batch.to_pandas())
+
+
+def write_cached_frame(df, file_hash, max_mb=DEFAULT_CACHE_MAX_MB, notify=None):
+    """将预处理后的数据写入列式缓存，并按容量上限淘汰最久未使用的版本"""
+    if not PARQUET_AVAILABLE:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cache_path = get_cache_path(file_hash)
+        # 先写临时文件再替换，避免并发读取到不完整的缓存
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path, engine='pyarrow', index=False)
+        os.replace(tmp_path, cache_path)
+        evict_cache(max_mb * 1024 * 1024, keep=cache_path)
+    except Exception as e:
+        if notify is not None:
+            notify(f"写入列式缓存时出错，下次加载将重新解析Excel。原因：{str(e)}")
+
+
+# ---- 数据集登记表 ----
+def load_registry():
+    try:
+        if os.path.exists(REGISTRY_PATH):
+            with open(REGISTRY_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception:
+        pass
+    return {}
+
+
+def save_registry(registry, notify=None):
+    try:
+        os.makedirs(os.path.dirname(REGISTRY_PATH), exist_ok=True)
+        with open(REGISTRY_PATH, 'w', encoding='utf-8') as f:
+            json.dump(registry, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        if notify is not None:
+            notify(f"保存数据集登记表时出错: {str(e)}")
+
+
+def resolve_dataset_files(source):
+    """将目录或通配符解析为按名称排序的工作簿路径列表"""
+    source = source.strip()
+    if os.path.isdir(source):
+        paths = [str(path) for pattern in ('*.xlsx', '*.xls') for path in Path(source).glob(pattern)]
+    else:
+        paths = [str(path) for path in Path(os.path.dirname(source) or '.').glob(os.path.basename(source))]
+    # 排除Excel打开文件时产生的临时文件
+    return sorted(os.path.abspath(path) for path in paths
+                  if os.path.isfile(path) and not os.path.basename(path).startswith('~$'))
+
+
+# ---- 流式加载函数 ----
+def get_file_size(file_path):
+    if hasattr(file_path, 'size'):
+        return file_path.size
+    if hasattr(file_path, 'getbuffer'):
+        return file_path.getbuffer().nbytes
+    return os.path.getsize(file_path)
+
+
+def should_stream(file_path, threshold_mb=DEFAULT_STREAMING_THRESHOLD_MB):
+    """超大的xlsx文件改用流式加载（需要pyarrow，xls格式不支持）"""
+    file_name = file_path.name if hasattr(file_path, 'read') else str(file_path)
+    if not PARQUET_AVAILABLE or not file_name.lower().endswith('.xlsx'):
+        return False
+    return get_file_size(file_path) >= threshold_mb * 1024 * 1024
+
+
+def iter_excel_chunks(file_path, chunk_rows=STREAMING_CHUNK_ROWS):
+    """以只读模式逐批读取第一个工作表，产出(数据块, 已读取行数, 估计总行数)"""
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        # 总行数来自工作表的维度元数据，仅用于显示进度
+        total_rows = max((worksheet.max_row or 1) - 1, 1)
+        rows = worksheet.iter_rows(values_only=True)
+        header = [f"Unnamed: {i}" if value is None else str(value)
+                  for i, value in enumerate(next(rows, ()))]
+
+        buffer = []
+        read_rows = 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append(tuple(row[:len(header)]) + (None,) * (len(header) - len(row)))
+            if len(buffer) >= chunk_rows:
+                read_rows += len(buffer)
+                yield pd.DataFrame(buffer, columns=header), read_rows, total_rows
+                buffer = []
+        if buffer:
+            read_rows += len(buffer)
+            yield pd.DataFrame(buffer, columns=header), read_rows, total_rows
+    finally:
+        workbook.close()
+
+
+def preprocess_chunk(chunk, column_kinds=None):
+    """对单个数据块做预处理，并把各列统一为固定类型以便按同一结构写入Parquet。
+
+    column_kinds记录第一个数据块推断出的列类型（number/datetime/string），
+    后续数据块按相同类型转换。
+    """
+    if column_kinds is None:
+        column_kinds = {}
+        for col in chunk.columns:
+            if col in ('单价（箱）', '数量（箱）') or pd.api.types.is_numeric_dtype(chunk[col]):
+                column_kinds[col] = 'number'
+            elif col == '发运月份' or pd.api.types.is_datetime64_any_dtype(chunk[col]):
+                column_kinds[col] = 'datetime'
+            else:
+                column_kinds[col] = 'string'
+
+    for col, kind in column_kinds.items():
+        if kind == 'number':
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype(np.float64)
+        elif kind == 'datetime':
+            # 流式加载中无法解析的月份记为缺失
+            chunk[col] = pd.to_datetime(chunk[col], errors='coerce').astype('datetime64[ns]')
+        else:
+            chunk[col] = chunk[col].map(lambda value: value if value is None or isinstance(value, str)
+                                        else None if pd.isna(value) else str(value)).astype(object)
+
+    chunk['销售额'] = chunk['单价（箱）'] * chunk['数量（箱）']
+    add_product_attributes(chunk)
+    # 各数据块的字典不同，写入缓存前统一为字符串列，读取时再转换为分类类型
+    for col in PRODUCT_FACT_COLUMNS:
+        chunk[col] = chunk[col].astype(object)
+    return chunk, column_kinds
+
+
+def chunk_schema(table, column_kinds):
+    """由第一个数据块确定缓存结构，整列为空时Arrow推断为null类型，按列类型放宽"""
+    null_types = {'number': pa.float64(), 'datetime': pa.timestamp('ns'), 'string': pa.string()}
+    fields = [field.with_type(null_types[column_kinds.get(field.name, 'string')])
+              if pa.types.is_null(field.type) else field
+              for field in table.schema]
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def stream_excel_to_cache(file_path, file_hash, max_mb=DEFAULT_CACHE_MAX_MB, progress=None, build_cube=False):
+    """分批读取工作簿，逐批预处理后写入列式缓存，峰值内存只与批大小有关。
+
+    build_cube为True时每个数据块写入后同时汇总进立方体并返回立方体，否则返回None；
+    需要逐行数据时再用read_cached_frame读取缓存（此时内存为整个数据集）。
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_path = get_cache_path(file_hash)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    writer = None
+    column_kinds = None
+    cube_parts = []
+    try:
+        for chunk, read_rows, total_rows in iter_excel_chunks(file_path):
+            chunk, column_kinds = preprocess_chunk(chunk, column_kinds)
+            if writer is None:
+                # 第一个数据块中整列为空的列在后续数据块中可能有值
+                schema = chunk_schema(pa.Table.from_pandas(chunk, preserve_index=False), column_kinds)
+                writer = pq.ParquetWriter(tmp_path, schema)
+            table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            del table
+            if build_cube:
+                # 与从缓存读取时一致，维度列转换为分类类型后再汇总
+                add_cube_part(cube_parts, optimize_dtypes(chunk))
+            if progress is not None:
+                progress(min(read_rows / total_rows, 1.0), read_rows)
+    except Exception:
+        # 加载失败或被取消时删除未写完的临时文件
+        if writer is not None:
+            writer.close()
+            writer = None
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        raise ValueError("工作表中没有数据")
+    os.replace(tmp_path, cache_path)
+    evict_cache(max_mb * 1024 * 1024, keep=cache_path)
+    return merge_cube_parts(cube_parts) if build_cube else None
+
+
+def evict_cache(max_bytes, keep=None):
+    """按最近使用时间淘汰缓存文件，直到总大小不超过上限。
+
+    多文件数据集中已登记文件的缓存不会被淘汰，以免历史文件被重新解析。
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    pinned = {os.path.abspath(get_cache_path(entry['hash'])) for entry in load_registry().values()}
+    if keep is not None:
+        pinned.add(os.path.abspath(keep))
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.endswith('.parquet') and os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        if os.path.abspath(path) in pinned:
+            continue
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+
+# ---- 产品名称与包装 ----
+# 提取包装类型
+def extract_packaging(product_name):
+    try:
+        if '袋装' in product_name:
+            return '袋装'
+        elif '盒装' in product_name:
+            return '盒装'
+        elif '随手包' in product_name:
+            return '随手包'
+        elif '迷你包' in product_name:
+            return '迷你包'
+        elif '分享装' in product_name:
+            return '分享装'
+        else:
+            return '其他'
+    except:
+        return '其他'
+
+
+# 提取规格（重量和单位，如 250G、1.5KG），没有规格时返回None
+def extract_spec(product_name):
+    if not isinstance(product_name, str):
+        return None
+    match = PRODUCT_SPEC_PATTERN.search(product_name)
+    return f"{match.group(1)}{match.group(2).upper()}" if match else None
+
+
+# 提取净含量，统一换算为克，没有规格时返回NaN
+def extract_net_weight(product_name):
+    if not isinstance(product_name, str):
+        return np.nan
+    match = PRODUCT_SPEC_PATTERN.search(product_name)
+    if not match:
+        return np.nan
+    return float(match.group(1)) * (1000 if match.group(2).upper() == 'KG' else 1)
+
+
+# 提取产地（名称末尾"-"之后的部分，如 中国），没有时返回None
+def extract_origin(product_name):
+    if not isinstance(product_name, str) or '-' not in product_name:
+        return None
+    return product_name.rsplit('-', 1)[1].strip() or None
+
+
+# 产品名称中需要去掉的规格和包装形式后缀
+PRODUCT_NAME_SUFFIXES = ['G分享装袋装', 'G盒装', 'G袋装', 'KG迷你包', 'KG随手包']
+# 产品名称中的数字和单位
+NUMBER_UNIT_PATTERN = re.compile(r'\d+\w*\s*')
+# 产品名称中的规格：数字（可带小数）加重量单位
+PRODUCT_SPEC_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(KG|G)', re.IGNORECASE)
+# 由产品名称派生的属性列及其解析函数
+PRODUCT_ATTRIBUTE_COLUMNS = {'包装类型': extract_packaging, '规格': extract_spec}
+
+
+# 创建产品代码到简化产品名称的映射函数 (修复版)
+def get_simplified_product_name(product_code, product_name):
+    try:
+        # 从产品名称中提取关键部分
+        if '口力' in product_name:
+            # 提取"口力"之后的产品类型
+            name_parts = product_name.split('口力')[1].split('-')[0].strip()
+            # 进一步简化，只保留主要部分（去掉规格和包装形式）
+            for suffix in PRODUCT_NAME_SUFFIXES:
+                name_parts = name_parts.split(suffix)[0]
+
+            # 去掉可能的数字和单位
+            simple_name = NUMBER_UNIT_PATTERN.sub('', name_parts).strip()
+
+            # 始终包含产品代码以确保唯一性
+            return f"{simple_name} ({product_code})"
+        else:
+            # 如果无法提取，则返回产品代码
+            return product_code
+    except Exception as e:
+        # 出错时返回产品代码
+        return product_code
+
+
+# 批量生成简化产品名称（向量化版本）
+def simplify_product_names(product_codes, product_names):
+    """对整列生成简化产品名称，结果与逐行调用get_simplified_product_name一致。
+
+    每个不同的产品名称只做一次字符串处理，每个不同的(产品代码, 产品名称)组合
+    只拼接一次结果，再按整数编码映射回所有行。
+    """
+    product_codes = pd.Series(product_codes)
+    product_names = pd.Series(product_names, index=product_codes.index)
+
+    # 对产品代码、产品名称及其组合进行整数编码
+    code_keys, code_uniques = pd.factorize(product_codes, use_na_sentinel=False)
+    name_keys, name_uniques = pd.factorize(product_names, use_na_sentinel=False)
+    pair_keys, pair_uniques = pd.factorize(code_keys.astype(np.int64) * len(name_uniques) + name_keys)
+
+    # 只对不同的产品名称做字符串处理
+    unique_names = pd.Series(np.asarray(name_uniques, dtype=object))
+    is_text = unique_names.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+    text_names = unique_names[is_text].astype(object)
+    branded = text_names[text_names.str.contains('口力', regex=False)]
+
+    name_parts = branded.str.split('口力', regex=False).str[1]
+    name_parts = name_parts.str.split('-', regex=False).str[0].str.strip()
+    for suffix in PRODUCT_NAME_SUFFIXES:
+        name_parts = name_parts.str.split(suffix, regex=False).str[0]
+    simple_names = name_parts.str.replace(NUMBER_UNIT_PATTERN, '', regex=True).str.strip()
+
+    core_names = np.full(len(unique_names), None, dtype=object)
+    core_names[simple_names.index.to_numpy()] = simple_names.to_numpy(dtype=object)
+
+    # 按(产品代码, 产品名称)组合拼接最终名称
+    code_values = np.asarray(code_uniques, dtype=object)
+    pair_results = np.empty(len(pair_uniques), dtype=object)
+    for i, pair in enumerate(pair_uniques):
+        product_code = code_values[pair // len(name_uniques)]
+        simple_name = core_names[pair % len(name_uniques)]
+        pair_results[i] = product_code if simple_name is None else f"{simple_name} ({product_code})"
+
+    return pd.Series(pair_results[pair_keys], index=product_codes.index)
+
+
+# ---- 产品维度表 ----
+# 保留在逐行数据中的产品属性（分类类型，图表和立方体直接按这些列分组）
+PRODUCT_FACT_COLUMNS = ['简化产品名称', '包装类型', '规格']
+
+
+def encode_column(series):
+    """返回列的整数编码（-1表示缺失）和取值数组，分类列直接使用已有的编码"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), np.asarray(series.cat.categories, dtype=object)
+    codes, values = pd.factorize(series)
+    return codes, np.asarray(values, dtype=object)
+
+
+class ProductDimension:
+    """由不同的(产品代码, 产品名称)组合建立的产品维度表。
+
+    产品名称只在这里按组合解析一次，table以产品键为索引，包含简化产品名称、包装类型、
+    规格、净含量（克）和产地；keys为逐行数据对应的产品键，逐行属性按键从维度表取出，
+    例如单价与净含量的比值只需在维度表上计算一次再按键映射。
+    """
+
+    def __init__(self, product_codes, product_names):
+        code_keys, codes = encode_column(pd.Series(product_codes))
+        name_keys, names = encode_column(pd.Series(product_names))
+        # 编码加一后组合，缺失值（-1）也成为一个组合
+        pair_keys, pairs = pd.factorize((code_keys.astype(np.int64) + 1) * (len(names) + 1) + name_keys + 1,
+                                        sort=True)
+        self.keys = pair_keys.astype(np.int32)
+
+        # 取值数组末尾追加NaN，使编码-1对应缺失值
+        code_values = np.append(codes, np.nan)
+        name_values = np.append(names, np.nan)
+        table = pd.DataFrame({
+            '产品代码': code_values[pairs // (len(names) + 1) - 1],
+            '产品名称': name_values[pairs % (len(names) + 1) - 1]
+        })
+        table.index.name = '产品键'
+        table['简化产品名称'] = simplify_product_names(table['产品代码'], table['产品名称'])
+        for col, extract in PRODUCT_ATTRIBUTE_COLUMNS.items():
+            table[col] = table['产品名称'].map(extract)
+        table['净含量（克）'] = table['产品名称'].map(extract_net_weight).astype(np.float64)
+        table['产地'] = table['产品名称'].map(extract_origin)
+        self.table = table
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(df['产品代码'], df['产品名称'])
+
+    def __len__(self):
+        return len(self.table)
+
+    def column(self, col):
+        """按产品键取出逐行的属性，文本属性为分类类型，数值属性为数组"""
+        values = self.table[col]
+        if pd.api.types.is_numeric_dtype(values):
+            return values.to_numpy()[self.keys]
+        value_codes, categories = pd.factorize(values.astype(object), sort=True)
+        # 字典按值重新推断类型，与缓存读回的分类列一致，否则合并时字典类型不同会报错
+        categories = pd.Index(categories.tolist())
+        return pd.Categorical.from_codes(value_codes[self.keys], categories=categories)
+
+    def summarize(self, df, rows=None):
+        """按产品键汇总销售额和箱数（rows为筛选后的行号），结果附在维度表上"""
+        keys = self.keys if rows is None else self.keys[rows]
+        sales = df['销售额'].to_numpy(dtype=np.float64)
+        quantity = df['数量（箱）'].to_numpy(dtype=np.float64)
+        if rows is not None:
+            sales, quantity = sales[rows], quantity[rows]
+        summary = self.table.copy()
+        summary['销售额'] = np.bincount(keys, weights=np.nan_to_num(sales), minlength=len(self))
+        summary['数量（箱）'] = np.bincount(keys, weights=np.nan_to_num(quantity), minlength=len(self))
+        summary['平均单价（箱）'] = summary['销售额'] / summary['数量（箱）'].replace(0, np.nan)
+        return summary[summary['数量（箱）'] > 0]
+
+
+def add_product_attributes(df):
+    """就地添加简化产品名称、包装类型和规格列，取自产品维度表，返回维度表"""
+    products = ProductDimension.from_frame(df)
+    for col in PRODUCT_FACT_COLUMNS:
+        df[col] = products.column(col)
+    return products
+
+
+# ---- 紧凑数据模型 ----
+def downcast_numeric(series):
+    """将数值列降级为能无损表示全部取值的最小类型"""
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+
+    values = series.to_numpy(dtype=np.float64)
+    if not np.isnan(values).any() and np.array_equal(values, np.trunc(values)) \
+            and np.abs(values).max(initial=0) < 2 ** 53:
+        # 取值均为整数的浮点列（如箱数）
+        return pd.to_numeric(series.astype(np.int64), downcast='integer')
+    if np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+        return series.astype(np.float32)
+    return series
+
+
+def optimize_dtypes(df):
+    """将维度列转换为分类类型，数值列降级为最小的安全类型"""
+    for col in DIMENSION_COLUMNS:
+        if col not in df.columns:
+            continue
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+        elif not df[col].cat.categories.is_monotonic_increasing:
+            # 按字典编码读取的分类列保持出现顺序，排序后分组结果才按取值排列
+            try:
+                df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+            except TypeError:
+                pass
+    for col in df.select_dtypes(include='number').columns:
+        df[col] = downcast_numeric(df[col])
+    return df
+
+
+def sorted_unique(series):
+    """返回列中实际出现的取值（字符串形式，已排序），分类列只遍历字典"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return sorted(series.cat.remove_unused_categories().cat.categories.astype(str))
+    return sorted(series.astype(str).unique())
+
+
+def build_product_name_mapping(df):
+    """产品代码到简化产品名称的映射，一次去重取每个产品代码首次出现的名称"""
+    pairs = df[['产品代码', '简化产品名称']].drop_duplicates('产品代码').dropna(subset=['产品代码'])
+    codes = pairs['产品代码'].astype(str)
+    names = pairs['简化产品名称'].astype(object)
+    return dict(zip(codes, names.where(names.notna(), codes).astype(str)))
+
+
+def get_dataset_fingerprint(df):
+    """返回数据集指纹，用作索引和各类缓存的键"""
+    fingerprint = df.attrs.get('fingerprint')
+    if fingerprint is None:
+        # 没有源文件哈希时，按数据内容计算
+        fingerprint = str(pd.util.hash_pandas_object(df, index=False).sum())
+        df.attrs['fingerprint'] = fingerprint
+    return fingerprint
+
+
+# ---- 筛选索引 ----
+# 侧边栏筛选器对应的维度列（按筛选顺序）
+FILTER_COLUMNS = ['所属区域', '客户简称', '产品代码', '申请人']
+
+
+class FilterIndex:
+    """侧边栏筛选器的倒排索引。
+
+    每个筛选维度按取值将行号分组排序，某个取值对应的行号是order中
+    offsets[i]:offsets[i + 1]的一段有序数组。筛选时只需合并选中取值的
+    行号段，再对各维度的结果做与运算，最后一次性取出对应的行。
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS):
+        self.n_rows = len(df)
+        self.postings = {}
+        row_dtype = np.int32 if self.n_rows < 2 ** 31 else np.int64
+        for col in columns:
+            if col not in df.columns:
+                continue
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codes = df[col].cat.codes.to_numpy()
+                values = df[col].cat.categories
+            else:
+                codes, values = pd.factorize(df[col])
+
+            # 稳定排序保证同一取值内的行号有序；缺失值（编码-1）排在最前
+            order = np.argsort(codes, kind='stable').astype(row_dtype)
+            counts = np.bincount(codes[codes >= 0], minlength=len(values))
+            offsets = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+            lookup = {str(value): i for i, value in enumerate(values)}
+            self.postings[col] = (lookup, order, offsets)
+
+    def column_mask(self, col, selected):
+        """返回某个维度选中取值对应的行掩码，选中全部取值时返回None"""
+        lookup, order, offsets = self.postings[col]
+        selected_ids = {lookup[str(value)] for value in selected if str(value) in lookup}
+        if len(selected_ids) == len(lookup) and offsets[0] == 0:
+            return None
+
+        # 选中的取值超过一半时，从全选中去掉未选中的行号段更快
+        if len(selected_ids) * 2 > len(lookup):
+            mask = np.ones(self.n_rows, dtype=bool)
+            mask[order[:offsets[0]]] = False
+            for i in set(range(len(lookup))) - selected_ids:
+                mask[order[offsets[i]:offsets[i + 1]]] = False
+        else:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            for i in selected_ids:
+                mask[order[offsets[i]:offsets[i + 1]]] = True
+        return mask
+
+    def filter_rows(self, selections):
+        """按筛选顺序合并各维度的行掩码。
+
+        与逐个维度依次筛选的行为一致：若某个维度使结果为空，则跳过该维度。
+        返回(行号数组或None, 被跳过的维度列表)，行号为None表示未筛选。
+        """
+        mask = None
+        skipped = []
+        for col, selected in selections.items():
+            if not selected or col not in self.postings:
+                continue
+            col_mask = self.column_mask(col, selected)
+            if col_mask is None:
+                continue
+            combined = col_mask if mask is None else mask & col_mask
+            if not combined.any():
+                skipped.append(col)
+                continue
+            mask = combined
+        if mask is None:
+            return None, skipped
+        return np.flatnonzero(mask), skipped
+
+    def normalize_selections(self, selections):
+        """将筛选条件规范化为可哈希的键：忽略空选择和全选，取值去重排序"""
+        normalized = []
+        for col, selected in selections.items():
+            if not selected or col not in self.postings:
+                continue
+            lookup, _, offsets = self.postings[col]
+            values = tuple(sorted({str(value) for value in selected if str(value) in lookup}))
+            if not values or (len(values) == len(lookup) and offsets[0] == 0):
+                continue
+            normalized.append((col, values))
+        return tuple(normalized)
+
+
+# ---- 聚合结果缓存 ----
+def estimate_size(value):
+    """估算缓存对象占用的内存字节数"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(value, pd.DataFrame) else int(usage)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class AggregateCache:
+    """按(数据集指纹, 筛选条件, 聚合规格)缓存聚合结果的LRU缓存。
+
+    缓存在所有会话间共享，按估算的内存占用设上限，超出时淘汰最久未使用的结果。
+    缓存的结果会被多个会话复用，调用方不应原地修改。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        size = estimate_size(value)
+        with self._lock:
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.current_bytes -= evicted_size
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes
+            }
+
+
+# ---- 预聚合立方体 ----
+# 立方体的最细粒度维度（简化产品名称由产品决定，不会增加行数）
+CUBE_DIMENSIONS = ['所属区域', '客户简称', '产品代码', '简化产品名称', '申请人', '包装类型', '发运月份']
+# 立方体中的可加度量
+CUBE_MEASURES = ['销售额', '数量（箱）', '单价合计', '单价计数', '行数']
+# 加载时预先物化的常用上卷
+CUBE_ROLLUPS = [('所属区域',), ('申请人',), ('包装类型',), ('产品代码', '简化产品名称')]
+# 需要去重计数的维度，按区域预先物化位集
+CUBE_DISTINCT_DIMENSIONS = ['客户简称', '产品代码']
+
+
+class SalesCube:
+    """按最细粒度维度组合预聚合的销售立方体。
+
+    fact中每行对应一个实际出现的维度组合，维度以整数编码存储（-1表示缺失），
+    度量为各行之和。图表和KPI都从立方体上卷得到，不再扫描逐行数据。
+    客户数、产品数等去重计数使用按编码置位的位集，位集可以按位或合并，
+    各区域的位集在加载时预先物化。
+    """
+
+    def __init__(self, df, materialize=True):
+        codes = {}
+        self.dictionaries = {}
+        self.categorical_dims = set()
+        for dim in CUBE_DIMENSIONS:
+            codes[dim], self.dictionaries[dim] = self._encode(df, dim)
+
+        prices = df['单价（箱）'].to_numpy(dtype=np.float64)
+        grain = pd.DataFrame(codes)
+        grain['销售额'] = df['销售额'].to_numpy()
+        grain['数量（箱）'] = df['数量（箱）'].to_numpy()
+        grain['单价合计'] = np.nan_to_num(prices)
+        grain['单价计数'] = (~np.isnan(prices)).astype(np.int64)
+        grain['行数'] = 1
+        self._build(grain.groupby(CUBE_DIMENSIONS, sort=False).sum().reset_index(), materialize)
+
+    @classmethod
+    def merge(cls, cubes, materialize=True):
+        """合并多个立方体：统一各维度字典后重新编码，再按最细粒度相加"""
+        merged = cls.__new__(cls)
+        merged.dictionaries = {}
+        merged.categorical_dims = set().union(*(cube.categorical_dims for cube in cubes))
+        facts = [cube.fact.copy() for cube in cubes]
+        for dim in CUBE_DIMENSIONS:
+            values = cubes[0].dictionaries[dim]
+            for cube in cubes[1:]:
+                values = values.union(cube.dictionaries[dim])
+            merged.dictionaries[dim] = values
+            for cube, fact in zip(cubes, facts):
+                # 末尾追加-1，使缺失编码保持为-1
+                recode = np.append(values.get_indexer(cube.dictionaries[dim]), -1)
+                fact[dim] = recode[fact[dim].to_numpy()]
+        merged._build(pd.concat(facts, ignore_index=True).groupby(CUBE_DIMENSIONS, sort=False).sum().reset_index(),
+                      materialize)
+        return merged
+
+    def append(self, df):
+        """把新增行的预聚合结果合并进来，返回新的立方体，已有数据不会被重新扫描"""
+        return SalesCube.merge([self, SalesCube(df)])
+
+    def _build(self, fact, materialize=True):
+        self.fact = fact
+        self.lookups = {
+            dim: {str(value): i for i, value in enumerate(values)}
+            for dim, values in self.dictionaries.items()
+        }
+        # 逐块汇总时中间结果只用于合并，合并完成后再物化
+        if materialize:
+            self.materialize()
+
+    def materialize(self):
+        """物化常用上卷和各区域的去重位集"""
+        self.materialized = {by: self.rollup(by) for by in CUBE_ROLLUPS}
+        self.region_bitsets = {
+            dim: self._group_bitsets('所属区域', dim) for dim in CUBE_DISTINCT_DIMENSIONS
+        }
+        self.distinct_totals = {
+            dim: int(np.count_nonzero(self._bitset(dim, None))) for dim in CUBE_DISTINCT_DIMENSIONS
+        }
+
+    def _encode(self, df, dim):
+        """返回维度列的整数编码和对应的取值字典"""
+        series = df[dim]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            self.categorical_dims.add(dim)
+            return series.cat.codes.to_numpy(), series.cat.categories
+        dim_codes, values = pd.factorize(series, sort=True)
+        return dim_codes, pd.Index(values)
+
+    def values(self, dim):
+        """维度中实际出现的取值（字符串形式，已排序）"""
+        dim_codes = np.unique(self.fact[dim].to_numpy())
+        return sorted(str(value) for value in self.dictionaries[dim].take(dim_codes[dim_codes >= 0]))
+
+    @property
+    def rows(self):
+        """汇总进立方体的逐行数据行数"""
+        return int(self.fact['行数'].sum())
+
+    def decode(self, dim, dim_codes):
+        """将整数编码还原为维度取值，分类维度保持分类类型"""
+        values = self.dictionaries[dim]
+        if dim in self.categorical_dims:
+            return pd.Categorical.from_codes(dim_codes, categories=values)
+        return values.take(dim_codes)
+
+    def _member_mask(self, dim, selected):
+        lookup = self.lookups[dim]
+        selected_codes = [lookup[str(value)] for value in selected if str(value) in lookup]
+        return np.isin(self.fact[dim].to_numpy(), selected_codes)
+
+    def select(self, selections):
+        """按侧边栏筛选条件选出立方体行，返回(行掩码, 实际生效的筛选条件)。
+
+        规则与FilterIndex.filter_rows一致：使结果为空的维度会被跳过。
+        行掩码为None表示未筛选。
+        """
+        mask = None
+        applied = {}
+        for dim, selected in selections.items():
+            if not selected or dim not in self.lookups:
+                continue
+            dim_mask = self._member_mask(dim, selected)
+            combined = dim_mask if mask is None else mask & dim_mask
+            if combined.any():
+                mask = combined
+                applied[dim] = selected
+        return mask, applied
+
+    def restrict(self, mask, dim, selected):
+        """在已有行掩码上再限定某个维度的取值，结果允许为空"""
+        dim_mask = self._member_mask(dim, selected)
+        return dim_mask if mask is None else mask & dim_mask
+
+    def rollup(self, by, mask=None, distinct=()):
+        """按指定维度上卷，返回解码后的维度列、各度量之和及去重计数"""
+        by = list(by)
+        if mask is None and not distinct and tuple(by) in getattr(self, 'materialized', {}):
+            return self.materialized[tuple(by)]
+
+        fact = self.fact if mask is None else self.fact[mask]
+        # 与pandas分组的默认行为一致，丢弃维度缺失的分组
+        fact = fact[(fact[by].to_numpy() >= 0).all(axis=1)]
+        result = fact.groupby(by, sort=True)[CUBE_MEASURES].sum()
+        for dim in distinct:
+            pairs = fact.loc[fact[dim] >= 0, by + [dim]].drop_duplicates()
+            result[dim] = pairs.groupby(by, sort=True).size().reindex(result.index, fill_value=0)
+        result = result.reset_index()
+        for dim in by:
+            result[dim] = self.decode(dim, result[dim].to_numpy())
+        return result
+
+    def _bitset(self, dim, mask):
+        """返回选中立方体行中出现过的维度取值位集"""
+        dim_codes = self.fact[dim].to_numpy() if mask is None else self.fact[dim].to_numpy()[mask]
+        bits = np.zeros(len(self.dictionaries[dim]) + 1, dtype=bool)
+        bits[dim_codes] = True  # 编码-1落在末尾的缺失位
+        return bits[:-1]
+
+    def _group_bitsets(self, group_dim, dim):
+        """按分组维度物化去重位集，每个分组一行压缩位集"""
+        group_codes = self.fact[group_dim].to_numpy()
+        bitsets = np.zeros((len(self.dictionaries[group_dim]), len(self.dictionaries[dim])), dtype=bool)
+        valid = (group_codes >= 0) & (self.fact[dim].to_numpy() >= 0)
+        bitsets[group_codes[valid], self.fact[dim].to_numpy()[valid]] = True
+        return np.packbits(bitsets, axis=1)
+
+    def distinct_count(self, dim, mask=None, applied=None):
+        """去重计数。只按区域筛选时合并物化的区域位集，否则由立方体行置位计算"""
+        if mask is None:
+            return self.distinct_totals[dim]
+        if applied is not None and set(applied) == {'所属区域'} and dim in self.region_bitsets:
+            lookup = self.lookups['所属区域']
+            region_codes = [lookup[str(value)] for value in applied['所属区域'] if str(value) in lookup]
+            merged = np.bitwise_or.reduce(self.region_bitsets[dim][region_codes], axis=0)
+            return int(np.unpackbits(merged, count=len(self.dictionaries[dim])).sum())
+        return int(np.count_nonzero(self._bitset(dim, mask)))
+
+    def totals(self, mask=None, applied=None):
+        """返回选中部分的度量总和、平均单价和去重计数"""
+        fact = self.fact if mask is None else self.fact[mask]
+        result = {measure: fact[measure].sum() for measure in CUBE_MEASURES}
+        result['平均单价'] = result['单价合计'] / result['单价计数'] if result['单价计数'] else np.nan
+        for dim in CUBE_DISTINCT_DIMENSIONS:
+            result[dim] = self.distinct_count(dim, mask, applied)
+        return result
+
+    def region_summary(self, mask=None):
+        """与build_region_summary相同的区域销售汇总"""
+        summary = self.rollup(['所属区域'], mask, distinct=['客户简称', '产品代码'])
+        summary = summary[['所属区域', '销售额', '客户简称', '产品代码', '数量（箱）']]
+        summary.columns = ['区域', '销售额', '客户数', '产品数', '销售数量']
+        return summary
+
+    def product_summary(self, mask=None):
+        """与build_product_summary相同的产品销售汇总"""
+        summary = self.rollup(['产品代码', '简化产品名称'], mask, distinct=['客户简称'])
+        summary = summary[['产品代码', '简化产品名称', '销售额', '客户简称', '数量（箱）']]
+        summary = summary.sort_values('销售额', ascending=False).reset_index(drop=True)
+        summary.columns = ['产品代码', '产品名称', '销售额', '购买客户数', '销售数量']
+        return summary
+
+
+def add_cube_part(parts, chunk, merge_every=CUBE_MERGE_CHUNKS):
+    """把一个数据块的立方体加入parts，累积到merge_every个时合并为一个，内存只与立方体大小有关"""
+    parts.append(SalesCube(chunk, materialize=False))
+    if len(parts) >= merge_every:
+        parts[:] = [SalesCube.merge(parts, materialize=False)]
+
+
+def merge_cube_parts(parts):
+    """合并逐块汇总的立方体并物化常用上卷"""
+    if not parts:
+        raise ValueError("没有数据")
+    if len(parts) == 1:
+        if not hasattr(parts[0], 'materialized'):
+            parts[0].materialize()
+        return parts[0]
+    return SalesCube.merge(parts)
+
+
+def build_cube_from_cache(file_hash, chunk_rows=STREAMING_CHUNK_ROWS):
+    """按批读取列式缓存并逐批汇总为立方体，不把逐行数据全部读入内存"""
+    parts = []
+    for chunk in iter_cached_chunks(file_hash, chunk_rows):
+        add_cube_part(parts, chunk)
+    return merge_cube_parts(parts)
+
+
+# ---- 时间序列 ----
+# 可选的重采样频率（pandas周期别名）及一年包含的周期数（用于同比）
+TIME_SERIES_FREQUENCIES = {'按月': 'M', '按周': 'W'}
+TIME_SERIES_YEAR_PERIODS = {'M': 12, 'W': 52}
+TIME_SERIES_DIMENSIONS = {'区域': '所属区域', '产品': '简化产品名称', '客户': '客户简称'}
+TIME_SERIES_METRICS = ['销售额', '滚动合计', '环比增长率', '同比增长率', '累计销售额']
+
+
+class SalesTimeSeries:
+    """按发运月份的销售时间序列。
+
+    从立方体按(发运月份, 维度)上卷得到的小表出发，按排序后的周期分组重采样，
+    得到 周期×维度成员 的销售额宽表，滚动合计、环比、同比和累计都在宽表上计算。
+    宽表按(数据来源, 筛选条件, 维度, 频率)缓存。同一数据来源追加了新数据时，
+    只重采样不早于已缓存最后一个周期的部分并与历史拼接；若历史周期的合计
+    与当前数据不一致（例如追加了更早月份的数据），则整体重算。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.incremental_updates = 0
+        self.full_rebuilds = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _resample(cube, dim, freq, mask):
+        by = ['发运月份'] if dim is None else ['发运月份', dim]
+        rollup = cube.rollup(by, mask)
+        if rollup.empty:
+            return pd.DataFrame(dtype=np.float64)
+        periods = pd.DatetimeIndex(rollup['发运月份']).to_period(freq)
+        if dim is None:
+            wide = rollup.groupby(periods)['销售额'].sum().to_frame('合计')
+        else:
+            wide = rollup.groupby([periods, rollup[dim]], observed=True)['销售额'].sum().unstack(fill_value=0)
+        # 补齐没有销售的周期，保证索引连续
+        wide = wide.reindex(pd.period_range(wide.index.min(), wide.index.max(), freq=freq), fill_value=0)
+        wide.index.name = '发运月份'
+        wide.columns.name = None
+        return wide.astype(np.float64)
+
+    @staticmethod
+    def _history_mask(cube, dim, mask, start_code):
+        date_codes = cube.fact['发运月份'].to_numpy()
+        history = (date_codes >= 0) & (date_codes < start_code)
+        if dim is not None:
+            history &= cube.fact[dim].to_numpy() >= 0
+        return history if mask is None else history & mask
+
+    def _extend(self, cube, dim, freq, mask, previous):
+        """在已缓存的宽表上追加新周期；历史部分与当前数据不一致时返回None"""
+        last_period = previous.index[-1]
+        start_code = cube.dictionaries['发运月份'].searchsorted(last_period.start_time)
+        history = self._history_mask(cube, dim, mask, start_code)
+        if not np.isclose(cube.fact['销售额'].to_numpy()[history].sum(), previous.iloc[:-1].to_numpy().sum()):
+            return None
+
+        date_codes = cube.fact['发运月份'].to_numpy()
+        tail_mask = date_codes >= start_code
+        tail = self._resample(cube, dim, freq, tail_mask if mask is None else tail_mask & mask)
+        wide = pd.concat([previous.iloc[:-1], tail]).fillna(0)
+        wide = wide.reindex(pd.period_range(wide.index.min(), wide.index.max(), freq=freq), fill_value=0)
+        wide.index.name = '发运月份'
+        return wide
+
+    def series(self, cube, fingerprint, lineage, filter_key, mask, dim, freq):
+        """返回 周期×维度成员 的销售额宽表，dim为None时只有一列合计"""
+        key = (lineage, filter_key, dim, freq)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry[0] == fingerprint:
+                    return entry[1]
+
+        wide = None
+        if entry is not None and not entry[1].empty:
+            wide = self._extend(cube, dim, freq, mask, entry[1])
+        if wide is None:
+            wide = self._resample(cube, dim, freq, mask)
+            self.full_rebuilds += 1
+        else:
+            self.incremental_updates += 1
+
+        with self._lock:
+            self._entries[key] = (fingerprint, wide)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return wide
+
+
+def compute_trend_metric(wide, metric, freq, window=3):
+    """在销售额宽表上计算趋势指标，增长率以百分比表示"""
+    if metric == '滚动合计':
+        return wide.rolling(window, min_periods=1).sum()
+    if metric == '累计销售额':
+        return wide.cumsum()
+    if metric in ('环比增长率', '同比增长率'):
+        periods = 1 if metric == '环比增长率' else TIME_SERIES_YEAR_PERIODS[freq]
+        previous = wide.shift(periods)
+        # 上期为0时增长率没有意义，记为缺失
+        return ((wide / previous.where(previous != 0)) - 1) * 100
+    return wide
+
+
+# ---- 客户细分 ----
+# RFM得分的分箱数；得分不低于该值视为"高"
+RFM_SCORE_BINS = 5
+RFM_HIGH_SCORE = 3
+# 按(R高, F高, M高)三位组合得到的经典八类客户，下标为 R*4 + F*2 + M
+RFM_SEGMENT_NAMES = [
+    '一般挽留客户', '重要挽留客户', '一般保持客户', '重要保持客户',
+    '一般发展客户', '重要发展客户', '一般价值客户', '重要价值客户'
+]
+
+
+def compute_rfm(cube, mask=None):
+    """由立方体计算每个客户的最近购买日期、购买频次（订单行数）和销售额。
+
+    立方体的发运月份字典已排序，日期编码的最大值即最近购买日期。
+    """
+    fact = cube.fact if mask is None else cube.fact[mask]
+    fact = fact[(fact['客户简称'].to_numpy() >= 0) & (fact['发运月份'].to_numpy() >= 0)]
+    if fact.empty:
+        return pd.DataFrame(columns=['客户简称', '最近购买日期', '最近购买间隔(天)', '购买频次', '销售额'])
+
+    grouped = fact.groupby('客户简称', sort=False).agg(
+        last_date=('发运月份', 'max'), frequency=('行数', 'sum'), monetary=('销售额', 'sum')
+    )
+    dates = cube.dictionaries['发运月份']
+    last_dates = pd.DatetimeIndex(dates.take(grouped['last_date'].to_numpy()))
+    reference_date = dates[fact['发运月份'].max()]
+    return pd.DataFrame({
+        '客户简称': cube.decode('客户简称', grouped.index.to_numpy()),
+        '最近购买日期': last_dates,
+        '最近购买间隔(天)': (reference_date - last_dates).days.to_numpy(),
+        '购买频次': grouped['frequency'].to_numpy(),
+        '销售额': grouped['monetary'].to_numpy()
+    })
+
+
+def quantile_scores(values, bins=RFM_SCORE_BINS, higher_is_better=True):
+    """按排名分位数把数值分为1..bins档，并列值取相同的档"""
+    pct = pd.Series(values).rank(method='average', pct=True).to_numpy()
+    scores = np.clip(np.ceil(pct * bins), 1, bins).astype(np.int8)
+    return scores if higher_is_better else (bins + 1 - scores).astype(np.int8)
+
+
+def kmeans(features, k, n_iter=50, seed=0, tol=1e-6):
+    """NumPy实现的k-means（k-means++初始化），返回(标签, 聚类中心)"""
+    rng = np.random.default_rng(seed)
+    n = len(features)
+    k = min(k, n)
+    centers = np.empty((k, features.shape[1]))
+    centers[0] = features[rng.integers(n)]
+    closest = ((features - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        # 按与已选中心距离的平方加权抽取下一个中心
+        total = closest.sum()
+        index = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centers[i] = features[index]
+        closest = np.minimum(closest, ((features - centers[i]) ** 2).sum(axis=1))
+
+    labels = np.zeros(n, dtype=np.int64)
+    for _ in range(n_iter):
+        # ||x-c||² = ||x||² - 2x·c + ||c||²，||x||²对所有中心相同可省略
+        distances = (centers ** 2).sum(axis=1) - 2 * features @ centers.T
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, features)
+        # 空簇保留原中心
+        new_centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        shift = np.abs(new_centers - centers).max()
+        centers = new_centers
+        if shift < tol:
+            break
+    return labels, centers
+
+
+def segment_customers(cube, mask=None, method='RFM分位数', n_clusters=4):
+    """计算客户RFM并分群。
+
+    RFM分位数：R、F、M各按分位数打1..5分，按三项是否达到高分组合为八类客户；
+    K-means：对(最近购买间隔, log购买频次, log销售额)标准化后聚类，
+    簇按平均销售额从高到低命名。
+    """
+    rfm = compute_rfm(cube, mask)
+    if rfm.empty:
+        return rfm
+
+    rfm['R得分'] = quantile_scores(rfm['最近购买间隔(天)'].to_numpy(), higher_is_better=False)
+    rfm['F得分'] = quantile_scores(rfm['购买频次'].to_numpy())
+    rfm['M得分'] = quantile_scores(rfm['销售额'].to_numpy())
+
+    if method == 'K-means':
+        features = np.column_stack([
+            rfm['最近购买间隔(天)'].to_numpy(dtype=np.float64),
+            np.log1p(rfm['购买频次'].to_numpy(dtype=np.float64)),
+            np.log1p(np.clip(rfm['销售额'].to_numpy(dtype=np.float64), 0, None))
+        ])
+        std = features.std(axis=0)
+        features = (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+        labels, _ = kmeans(features, n_clusters)
+        # 按各簇平均销售额排序命名
+        cluster_sales = pd.Series(rfm['销售额'].to_numpy()).groupby(labels).mean()
+        rank = {label: i + 1 for i, label in enumerate(cluster_sales.sort_values(ascending=False).index)}
+        names = np.array([f"群组{rank.get(label, 0)}" for label in range(labels.max() + 1)])
+        segments = names[labels]
+        categories = sorted(set(segments))
+    else:
+        high = np.column_stack([rfm[col].to_numpy() >= RFM_HIGH_SCORE for col in ['R得分', 'F得分', 'M得分']])
+        segments = np.asarray(RFM_SEGMENT_NAMES)[high @ np.array([4, 2, 1])]
+        categories = [name for name in reversed(RFM_SEGMENT_NAMES) if name in set(segments)]
+
+    rfm['客户分群'] = pd.Categorical(segments, categories=categories)
+    return rfm.sort_values('销售额', ascending=False, ignore_index=True)
+
+
+# ---- 产品组合 ----
+class ProductAffinity:
+    """基于客户×产品稀疏矩阵的共同购买分析。
+
+    由立方体中出现过的(客户, 产品)组合构造0/1的CSR矩阵B，
+    产品共同购买矩阵 C = BᵀB，C[x, y] 为同时购买x和y的客户数，
+    对角线为各产品的购买客户数。支持度、置信度和提升度都由C直接算出，
+    不需要逐对遍历产品。
+    """
+
+    def __init__(self, cube, mask=None):
+        fact = cube.fact if mask is None else cube.fact[mask]
+        customers = fact['客户简称'].to_numpy()
+        products = fact['产品代码'].to_numpy()
+        valid = (customers >= 0) & (products >= 0)
+        customers, products = customers[valid], products[valid]
+
+        # 只保留选中部分出现过的客户和产品，矩阵维度与筛选后的规模一致
+        customer_codes, customer_index = np.unique(customers, return_inverse=True)
+        product_codes, product_index = np.unique(products, return_inverse=True)
+        matrix = sp.csr_matrix(
+            (np.ones(len(customer_index), dtype=np.int32), (customer_index, product_index)),
+            shape=(len(customer_codes), len(product_codes))
+        )
+        # 同一客户多次购买同一产品只计一次
+        matrix.data[:] = 1
+
+        self.products = np.asarray(cube.decode('产品代码', product_codes), dtype=object)
+        self.n_customers = len(customer_codes)
+        self.co_purchase = (matrix.T @ matrix).tocsr()
+        self.product_customers = self.co_purchase.diagonal()
+
+    @property
+    def nbytes(self):
+        # 供聚合缓存估算占用
+        matrix = self.co_purchase
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes + self.products.nbytes * 8
+
+    def product_stats(self):
+        """各产品的购买客户数和支持度"""
+        return pd.DataFrame({
+            '产品代码': self.products,
+            '购买客户数': self.product_customers,
+            '支持度': self.product_customers / max(self.n_customers, 1)
+        }).sort_values('购买客户数', ascending=False, ignore_index=True)
+
+    def _scores(self, rows, cols, counts):
+        n = max(self.n_customers, 1)
+        support_x = self.product_customers[rows] / n
+        support_y = self.product_customers[cols] / n
+        support = counts / n
+        confidence = counts / self.product_customers[rows]
+        return pd.DataFrame({
+            '共同购买客户数': counts,
+            '支持度': support,
+            '置信度': confidence,
+            '提升度': support / (support_x * support_y)
+        })
+
+    def top_pairs(self, top_n=20, min_customers=1, sort_by='提升度'):
+        """产品对排名（每对只出现一次）"""
+        upper = sp.triu(self.co_purchase, k=1).tocoo()
+        keep = upper.data >= min_customers
+        rows, cols, counts = upper.row[keep], upper.col[keep], upper.data[keep]
+        pairs = self._scores(rows, cols, counts)
+        pairs.insert(0, '产品A', self.products[rows])
+        pairs.insert(1, '产品B', self.products[cols])
+        return pairs.nlargest(top_n, [sort_by, '共同购买客户数']).reset_index(drop=True)
+
+    def also_bought(self, product, top_n=10, min_customers=1):
+        """购买了product的客户还购买了哪些产品，按置信度排序"""
+        matches = np.flatnonzero(self.products == product)
+        if len(matches) == 0:
+            return pd.DataFrame(columns=['产品代码', '共同购买客户数', '支持度', '置信度', '提升度'])
+        x = matches[0]
+        row = self.co_purchase.getrow(x)
+        keep = (row.indices != x) & (row.data >= min_customers)
+        cols, counts = row.indices[keep], row.data[keep]
+        scores = self._scores(np.full(len(cols), x), cols, counts)
+        scores.insert(0, '产品代码', self.products[cols])
+        return scores.nlargest(top_n, ['置信度', '提升度']).reset_index(drop=True)
+
+
+# ---- 市场渗透率 ----
+class PenetrationIndex:
+    """客户×产品×区域的购买关联结构，用于计算渗透率。
+
+    只保存去重后的(区域, 客户, 产品)、(区域, 客户)、(月份, 客户)和
+    (月份, 新品客户)组合，各组合按立方体编码压成一个int64键，一次扫描立方体行即可建立。
+    数据追加新月份后，把已保存的键映射到新立方体的字典，
+    只扫描不早于上次最后月份的立方体行并取并集（并集幂等，重复扫描最后一个月不影响结果）。
+    """
+
+    DIMS = ('所属区域', '客户简称', '产品代码', '发运月份')
+    INCIDENCES = {
+        'triples': ('所属区域', '客户简称', '产品代码'),
+        'region_customers': ('所属区域', '客户简称'),
+        'month_customers': ('发运月份', '客户简称'),
+        'month_new_customers': ('发运月份', '客户简称')
+    }
+
+    def __init__(self, cube, mask, new_products):
+        self.new_products = [str(code) for code in new_products]
+        self.dictionaries = {dim: cube.dictionaries[dim] for dim in self.DIMS}
+        self.keys = {name: np.empty(0, dtype=np.int64) for name in self.INCIDENCES}
+        self._add_rows(cube, mask)
+        self._record_history(cube, mask)
+
+    def _shape(self, name):
+        return tuple(max(len(self.dictionaries[dim]), 1) for dim in self.INCIDENCES[name])
+
+    def codes(self, name):
+        """把组合键还原为各维度的编码"""
+        return np.unravel_index(self.keys[name], self._shape(name))
+
+    def _record_history(self, cube, mask):
+        # 记录最后月份之前的立方体行数，用于判断追加的数据是否改变了历史
+        date_codes = cube.fact['发运月份'].to_numpy()
+        self.last_date_code = int(date_codes.max()) if len(date_codes) else -1
+        before = date_codes < self.last_date_code
+        self.history_rows = int(cube.fact['行数'].to_numpy()[before if mask is None else before & mask].sum())
+
+    def _add_rows(self, cube, mask):
+        fact = cube.fact if mask is None else cube.fact[mask]
+        columns = {dim: fact[dim].to_numpy().astype(np.int64) for dim in self.DIMS}
+        lookup = cube.lookups['产品代码']
+        new_codes = [lookup[code] for code in self.new_products if code in lookup]
+        is_new = np.isin(columns['产品代码'], new_codes)
+
+        for name, dims in self.INCIDENCES.items():
+            valid = np.logical_and.reduce([columns[dim] >= 0 for dim in dims])
+            if name == 'month_new_customers':
+                valid &= is_new
+            keys = np.ravel_multi_index([columns[dim][valid] for dim in dims], self._shape(name))
+            self.keys[name] = np.unique(np.concatenate([self.keys[name], keys]))
+
+    def _remap(self, cube):
+        """把已保存的键映射到新立方体的字典"""
+        recode = {
+            dim: cube.dictionaries[dim].get_indexer(self.dictionaries[dim]).astype(np.int64)
+            for dim in self.DIMS
+        }
+        old_codes = {name: self.codes(name) for name in self.INCIDENCES}
+        self.dictionaries = {dim: cube.dictionaries[dim] for dim in self.DIMS}
+        self.keys = {
+            name: np.sort(np.ravel_multi_index(
+                [recode[dim][old_codes[name][i]] for i, dim in enumerate(dims)], self._shape(name)
+            ))
+            for name, dims in self.INCIDENCES.items()
+        }
+
+    def extended(self, cube, mask):
+        """返回合入追加月份后的新结构，历史部分与当前立方体不一致时返回None"""
+        if self.last_date_code < 0:
+            return None
+        last_date = self.dictionaries['发运月份'][self.last_date_code]
+        start_code = cube.dictionaries['发运月份'].searchsorted(last_date)
+        date_codes = cube.fact['发运月份'].to_numpy()
+        before = date_codes < start_code
+        history_rows = int(cube.fact['行数'].to_numpy()[before if mask is None else before & mask].sum())
+        if history_rows != self.history_rows:
+            return None
+
+        # 已有结构可能正被其他会话读取，在浅拷贝上更新
+        updated = copy.copy(self)
+        updated._remap(cube)
+        tail = date_codes >= start_code
+        updated._add_rows(cube, tail if mask is None else tail & mask)
+        updated._record_history(cube, mask)
+        return updated
+
+    def region_product_rates(self):
+        """各区域内购买各产品的客户占比(%)，行为区域，列为产品代码"""
+        n_regions = len(self.dictionaries['所属区域'])
+        n_products = len(self.dictionaries['产品代码'])
+        region, _, product = self.codes('triples')
+        counts = np.bincount(region * n_products + product,
+                             minlength=n_regions * n_products).reshape(n_regions, n_products)
+        totals = self.region_customer_counts(drop_empty=False).to_numpy()
+        regions = totals > 0
+        products = counts.any(axis=0)
+        rates = counts[regions][:, products] / totals[regions, None] * 100
+        return pd.DataFrame(
+            rates,
+            index=pd.Index(self.dictionaries['所属区域'][regions], name='所属区域'),
+            columns=pd.Index(np.asarray(self.dictionaries['产品代码'])[products], name='产品代码')
+        )
+
+    def region_customer_counts(self, drop_empty=True):
+        region, _ = self.codes('region_customers')
+        totals = pd.Series(np.bincount(region, minlength=len(self.dictionaries['所属区域'])),
+                           index=self.dictionaries['所属区域'], name='客户数')
+        return totals[totals > 0] if drop_empty else totals
+
+    def new_product_trend(self):
+        """各月及累计的新品渗透率：购买新品的客户数 / 有购买的客户数"""
+        months = self.dictionaries['发运月份']
+        n_months = len(months)
+        if n_months == 0 or len(self.keys['month_customers']) == 0:
+            return pd.DataFrame()
+
+        def month_counts(name):
+            month, customer = self.codes(name)
+            # 每个客户首次出现的月份，用于累计客户数；键按月份排序，首次出现即最早月份
+            _, first = np.unique(customer, return_index=True)
+            return (np.bincount(month, minlength=n_months),
+                    np.cumsum(np.bincount(month[first], minlength=n_months)))
+
+        active, cumulative_active = month_counts('month_customers')
+        buyers, cumulative_buyers = month_counts('month_new_customers')
+        trend = pd.DataFrame({
+            '发运月份': months,
+            '有购买客户数': active,
+            '新品客户数': buyers,
+            '当月渗透率': np.divide(buyers * 100, active, out=np.zeros(n_months), where=active > 0),
+            '累计客户数': cumulative_active,
+            '累计新品客户数': cumulative_buyers,
+            '累计渗透率': np.divide(cumulative_buyers * 100, cumulative_active, out=np.zeros(n_months),
+                                 where=cumulative_active > 0)
+        })
+        return trend[trend['有购买客户数'] > 0].reset_index(drop=True)
+
+
+class PenetrationEngine:
+    """按(数据来源, 筛选条件, 新品列表)保存渗透率结构，数据追加后增量更新"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.incremental_updates = 0
+        self.full_rebuilds = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self, cube, fingerprint, lineage, filter_key, mask, new_products):
+        key = (lineage, filter_key, tuple(new_products))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry[0] == fingerprint:
+                    return entry[1]
+
+        index = entry[1].extended(cube, mask) if entry is not None else None
+        if index is not None:
+            self.incremental_updates += 1
+        else:
+            index = PenetrationIndex(cube, mask, new_products)
+            self.full_rebuilds += 1
+
+        with self._lock:
+            self._entries[key] = (fingerprint, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+
+# ---- 散点分箱 ----
+def bin_scatter_points(df, x, y, weight, color, bins=SCATTER_GRID_BINS):
+    """按x×y网格分箱聚合散点，每个(颜色分组, 网格)只输出一个点。
+
+    点的位置为格内按weight加权的重心，大小为格内weight之和，
+    输出点数不超过 分组数×bins²，与原始行数无关。
+    """
+    xs = df[x].to_numpy(dtype=np.float64)
+    ys = df[y].to_numpy(dtype=np.float64)
+    ws = df[weight].to_numpy(dtype=np.float64)
+    valid = np.isfinite(xs) & np.isfinite(ys) & np.isfinite(ws)
+    xs, ys, ws = xs[valid], ys[valid], ws[valid]
+    if len(xs) == 0:
+        return pd.DataFrame(columns=[color, x, y, weight, '订单行数'])
+
+    def bin_index(values):
+        edges = np.linspace(values.min(), values.max(), bins + 1)
+        return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bins - 1)
+
+    # 权重为负或为零的格退化为简单平均
+    positive = np.clip(ws, 0, None)
+    cells = pd.DataFrame({
+        color: df[color].to_numpy()[valid],
+        'cell': bin_index(xs) * bins + bin_index(ys),
+        'wx': xs * positive,
+        'wy': ys * positive,
+        'w': positive,
+        'sx': xs,
+        'sy': ys,
+        weight: ws,
+        '订单行数': 1
+    })
+    grouped = cells.groupby([color, 'cell'], observed=True, sort=False).sum().reset_index()
+    weighted = grouped['w'] > 0
+    grouped[x] = np.where(weighted, grouped['wx'] / grouped['w'].where(weighted, 1), grouped['sx'] / grouped['订单行数'])
+    grouped[y] = np.where(weighted, grouped['wy'] / grouped['w'].where(weighted, 1), grouped['sy'] / grouped['订单行数'])
+    return grouped[[color, x, y, weight, '订单行数']]
+
+
+# ---- 新品批次 ----
+def normalize_cohorts(cohorts):
+    """清理新品批次登记：去掉无名称或重名的批次，同一产品只归入最先登记的批次"""
+    names, assigned, result = set(), set(), []
+    for cohort in cohorts or []:
+        name = str(cohort.get('name') or '').strip()
+        if not name or name in names:
+            continue
+        products = [code for code in dict.fromkeys(str(code) for code in cohort.get('products', []))
+                    if code not in assigned]
+        names.add(name)
+        assigned.update(products)
+        result.append({'name': name, 'launch_date': cohort.get('launch_date') or None, 'products': products})
+    return result
+
+
+def cohort_registry_key(cohorts):
+    """新品批次登记的可哈希表示，用作缓存键"""
+    return tuple((cohort['name'], cohort['launch_date'], tuple(cohort['products'])) for cohort in cohorts)
+
+
+def compute_row_cohorts(df, registry_key):
+    """每行所属新品批次的编码，-1表示不是新品。每个不同的产品代码只查一次批次"""
+    lookup = {code: i for i, (_, _, products) in enumerate(registry_key) for code in products}
+    series = df['产品代码']
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        product_codes, products = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        product_codes, products = pd.factorize(series)
+    # 末尾一项对应缺失的产品代码（编码-1）
+    product_cohorts = np.array([lookup.get(str(code), -1) for code in products] + [-1], dtype=np.int16)
+    return product_cohorts[product_codes]
+
+
+def new_product_view(df, rows, row_cohorts, cohort_names):
+    """按行号取出新品数据，并附上所属新品批次"""
+    view = df.take(rows)
+    view['新品批次'] = pd.Categorical.from_codes(row_cohorts[rows], categories=cohort_names)
+    return view
+
+
+def compare_cohorts(cube, mask, cohorts):
+    """按新品批次并排汇总：各批次的销售额、客户数，以及上市后各月的销售额。
+
+    产品到批次的对应只在产品字典上做一次，立方体行通过产品编码查表得到批次。
+    上市后月数以登记的上市日期为起点，未登记上市日期的批次以首个有销售的月份为起点。
+    """
+    lookup = cube.lookups['产品代码']
+    product_cohorts = np.full(len(cube.dictionaries['产品代码']) + 1, -1, dtype=np.int64)
+    for i, cohort in enumerate(cohorts):
+        for code in cohort['products']:
+            if code in lookup:
+                product_cohorts[lookup[code]] = i
+
+    fact = cube.fact if mask is None else cube.fact[mask]
+    cohort_codes = product_cohorts[fact['产品代码'].to_numpy()]
+    fact = fact[cohort_codes >= 0]
+    cohort_codes = cohort_codes[cohort_codes >= 0]
+    customers = fact['客户简称'].where(fact['客户简称'] >= 0)
+
+    summary = pd.DataFrame({
+        '销售额': fact['销售额'].groupby(cohort_codes).sum(),
+        '数量（箱）': fact['数量（箱）'].groupby(cohort_codes).sum(),
+        '客户数': customers.groupby(cohort_codes).nunique(),
+        '产品数': fact['产品代码'].groupby(cohort_codes).nunique()
+    }).reindex(range(len(cohorts)), fill_value=0)
+    summary['单客户销售额'] = summary['销售额'] / summary['客户数'].where(summary['客户数'] > 0)
+    summary.insert(0, '新品批次', [cohort['name'] for cohort in cohorts])
+    summary.insert(1, '上市日期', [cohort['launch_date'] for cohort in cohorts])
+    summary = summary.reset_index(drop=True)
+
+    months = cube.dictionaries['发运月份']
+    if not isinstance(months, pd.DatetimeIndex) or fact.empty:
+        return summary, pd.DataFrame()
+    date_codes = fact['发运月份'].to_numpy()
+    dated = date_codes >= 0
+    month_ordinals = months.to_period('M').asi8[date_codes[dated]]
+    timeline = pd.DataFrame({
+        '批次编码': cohort_codes[dated],
+        '月份序号': month_ordinals,
+        '销售额': fact['销售额'].to_numpy()[dated]
+    }).groupby(['批次编码', '月份序号'], as_index=False)['销售额'].sum()
+
+    first_months = timeline.groupby('批次编码')['月份序号'].min()
+    launch_ordinals = pd.Series({
+        i: pd.Period(cohort['launch_date'], freq='M').ordinal if cohort['launch_date'] else first_months.get(i)
+        for i, cohort in enumerate(cohorts)
+    })
+    timeline['上市后月数'] = timeline['月份序号'] - timeline['批次编码'].map(launch_ordinals)
+    timeline['新品批次'] = np.asarray(summary['新品批次'])[timeline['批次编码']]
+    return summary, timeline[['新品批次', '上市后月数', '销售额']]
+
+
+# ---- 工作簿解析 ----
+# 解析工作簿并预处理 - 结果写入列式缓存
+def ingest_workbook(file_path, file_hash, config=None, progress=None, notify=None, cube_only=False,
+                    with_products=False):
+    """解析工作簿并预处理，结果写入列式缓存。
+
+    config提供缓存容量和流式加载阈值，progress(比例, 已读取行数)报告进度，
+    notify(提示文字)输出非致命的提示；未传入时使用默认配置并忽略进度和提示。
+    cube_only为True时返回立方体而不是逐行数据：流式加载的工作簿逐块汇总，
+    内存只与批大小和立方体大小有关。with_products为True时返回(数据, 产品维度表)，
+    维度表取自预处理时建立的一份；流式加载的工作簿逐块建立，维度表为None。
+    """
+    config = config or {}
+    progress = progress or (lambda fraction, rows: None)
+    notify = notify or (lambda message: None)
+
+    if should_stream(file_path, config.get("streaming_threshold_mb", DEFAULT_STREAMING_THRESHOLD_MB)):
+        # 超大文件分批读取并写入列式缓存，逐批报告进度
+        cube = stream_excel_to_cache(
+            file_path, file_hash,
+            config.get("parquet_cache_max_mb", DEFAULT_CACHE_MAX_MB),
+            progress=progress, build_cube=cube_only
+        )
+        if cube_only:
+            return cube
+        # 仪表盘需要逐行数据，读回整个数据集
+        df = read_cached_frame(file_hash)
+        df.attrs['fingerprint'] = file_hash
+        return (df, None) if with_products else df
+
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+    df = pd.read_excel(file_path, engine='openpyxl')
+    progress(0.8, len(df))
+
+    # 数据预处理
+    df['销售额'] = df['单价（箱）'] * df['数量（箱）']
+
+    # 确保发运月份是日期类型
+    try:
+        df['发运月份'] = pd.to_datetime(df['发运月份'])
+    except Exception as e:
+        notify(f"发运月份转换为日期类型时出错。原因：{str(e)}。将保持原格式。")
+
+    # 添加简化产品名称、包装类型和规格列，产品名称按(产品代码, 产品名称)组合只解析一次
+    products = add_product_attributes(df)
+
+    # 转换为紧凑数据模型（分类维度列+降级数值列）
+    df = optimize_dtypes(df)
+    df.attrs['fingerprint'] = file_hash
+
+    # 写入列式缓存，后续加载同一版本文件时直接读取
+    write_cached_frame(df, file_hash, config.get("parquet_cache_max_mb", DEFAULT_CACHE_MAX_MB), notify)
+    progress(1.0, len(df))
+    if cube_only:
+        return SalesCube(df)
+    return (df, products) if with_products else df
+
+
+# 快速预览 - 只读取工作表开头几行，总行数取自工作表的维度元数据
+def read_workbook_preview(file_path, n_rows=10):
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        total_rows = max((worksheet.max_row or 1) - 1, 0)
+        rows = list(worksheet.iter_rows(max_row=n_rows + 1, values_only=True))
+    finally:
+        workbook.close()
+        if hasattr(file_path, 'read'):
+            file_path.seek(0)
+    if not rows:
+        return pd.DataFrame(), 0
+    header = [f"Unnamed: {i}" if value is None else str(value) for i, value in enumerate(rows[0])]
+    return pd.DataFrame([row[:len(header)] for row in rows[1:]], columns=header), total_rows
+
+
+class IngestCancelled(Exception):
+    pass
+
+
+class IngestJob:
+    """在后台线程中加载一个工作簿。
+
+    页面脚本每次重跑时读取进度和状态，不会阻塞在解析上；用户再次上传文件时
+    取消仍在运行的任务，流式加载在下一个数据块处停止。
+    """
+
+    def __init__(self, key, file_path, name, config, datasets=None):
+        self.key = key
+        self.file_path = file_path
+        self.name = name
+        self.config = dict(config)
+        self.datasets = datasets
+        self.preview = None
+        self.preview_rows = None
+        self.progress = (0.0, 0)
+        self.status = 'running'
+        self.result = None
+        # 导入时建立的产品维度表，命中缓存时为None
+        self.products = None
+        # 结果登记到共享数据集后的句柄，由调用方设置
+        self.dataset = None
+        self.error = None
+        self.notices = []
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-{name}", daemon=True)
+
+    def start(self):
+        try:
+            self.preview, self.preview_rows = read_workbook_preview(self.file_path)
+        except Exception:
+            # 预览失败不影响完整加载
+            self.preview, self.preview_rows = None, None
+        self._thread.start()
+        return self
+
+    def wait(self, timeout):
+        self._thread.join(timeout)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def release(self):
+        """任务结束后释放源文件缓冲区、预览和结果，只保留状态、提示和共享数据集句柄"""
+        self.file_path = None
+        self.preview = None
+        self.preview_rows = None
+        self.result = None
+        self.products = None
+
+    def _report(self, fraction, rows):
+        if self._cancel_event.is_set():
+            raise IngestCancelled()
+        self.progress = (fraction, rows)
+
+    def _run(self):
+        try:
+            file_hash = compute_file_hash(self.file_path)
+            # 其他会话已加载同一文件时直接共用，不再读取列式缓存
+            df = self.datasets.get(file_hash) if self.datasets is not None else None
+            if df is None:
+                df = read_cached_frame(file_hash)
+                if df is None:
+                    df, self.products = ingest_workbook(self.file_path, file_hash, self.config,
+                                                        progress=self._report, notify=self.notices.append,
+                                                        with_products=True)
+                df.attrs['fingerprint'] = file_hash
+            if self._cancel_event.is_set():
+                raise IngestCancelled()
+            self.result = df
+            self.status = 'done'
+        except IngestCancelled:
+            self.status = 'cancelled'
+        except Exception as e:
+            self.error = str(e)
+            self.status = 'failed'
+
+
+# ---- 多文件数据集 ----
+def concat_frames(frames):
+    """合并多个预处理后的数据，分类列合并字典后仍为分类类型"""
+    if len(frames) == 1:
+        return frames[0]
+    columns = list(dict.fromkeys(col for frame in frames for col in frame.columns))
+    data = {}
+    for col in columns:
+        parts = [frame[col] if col in frame.columns else pd.Series(np.nan, index=frame.index)
+                 for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            # 新导入与缓存读回的字典类型可能不同（object与str），统一后再合并字典
+            if len({part.cat.categories.dtype for part in parts}) > 1:
+                parts = [pd.Categorical.from_codes(part.cat.codes, categories=part.cat.categories.astype(object))
+                         for part in parts]
+            data[col] = pd.api.types.union_categoricals(parts, sort_categories=True)
+        else:
+            data[col] = pd.concat(parts, ignore_index=True).to_numpy()
+    return pd.DataFrame(data)
+
+
+class DatasetStore:
+    """由多个源文件（如每月导出的工作簿）组成的数据集。
+
+    通过登记表记录各文件的修改时间、大小和内容哈希，只有新增或变化的文件
+    才会被解析；每个文件预处理后的数据保存在列式缓存中。只新增文件时，
+    新文件的行和立方体预聚合追加到已合并的结果上，不重新处理已导入的文件。
+
+    keep_frame为False时只保留立方体（frame为None）：已缓存的文件按批读取后汇总，
+    新文件由ingest直接返回立方体，内存只与批大小和立方体大小有关，适合只需要汇总的场景。
+    """
+
+    def __init__(self, source, keep_frame=True):
+        self.source = source
+        self.keep_frame = keep_frame
+        self.file_hashes = {}
+        self.frame = None
+        self.cube = None
+        self.fingerprint = None
+        self._lock = threading.Lock()
+
+    def _file_hash(self, path, registry):
+        # 修改时间和大小均未变化时直接使用登记的哈希，不重新读取文件
+        stat = os.stat(path)
+        entry = registry.get(path)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry['hash']
+        file_hash = compute_file_hash(path)
+        registry[path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': file_hash, 'rows': None}
+        return file_hash
+
+    def _load_file(self, path, file_hash, registry, ingest):
+        frame = read_cached_frame(file_hash)
+        if frame is None:
+            frame = ingest(path, file_hash)
+        registry[path]['rows'] = len(frame)
+        return frame
+
+    def _load_cube(self, path, file_hash, registry, ingest):
+        if PARQUET_AVAILABLE and os.path.exists(get_cache_path(file_hash)):
+            cube = build_cube_from_cache(file_hash)
+        else:
+            cube = ingest(path, file_hash)
+        registry[path]['rows'] = cube.rows
+        return cube
+
+    @property
+    def rows(self):
+        return len(self.frame) if self.frame is not None else self.cube.rows
+
+    def refresh(self, ingest=ingest_workbook, notify=None):
+        """检查源文件变化并更新数据集，返回是否有变化。
+
+        ingest(路径, 文件哈希)解析列式缓存未命中的文件，返回逐行数据（keep_frame为False时
+        返回立方体）；notify输出保存登记表时的错误。
+        """
+        with self._lock:
+            registry = load_registry()
+            # 清理已不存在的文件
+            for path in [path for path in registry if not os.path.exists(path)]:
+                del registry[path]
+
+            paths = resolve_dataset_files(self.source)
+            if not paths:
+                raise FileNotFoundError(f"没有找到匹配的工作簿: {self.source}")
+            current = {path: self._file_hash(path, registry) for path in paths}
+            if self.cube is not None and current == self.file_hashes:
+                save_registry(registry, notify)
+                return False
+
+            appended_only = self.cube is not None and all(
+                self.file_hashes.get(path, file_hash) == file_hash for path, file_hash in current.items()
+            ) and set(self.file_hashes) <= set(current)
+            if not self.keep_frame:
+                # 只保留立方体：只有新增文件时把新文件的立方体合并到已有结果上
+                cubes = [self._load_cube(path, file_hash, registry, ingest)
+                         for path, file_hash in current.items() if not appended_only or path not in self.file_hashes]
+                self.cube = merge_cube_parts(([self.cube] if appended_only else []) + cubes)
+            elif appended_only:
+                # 只有新增文件：把新文件的行和预聚合追加到已有结果上
+                new_frames = [self._load_file(path, file_hash, registry, ingest)
+                              for path, file_hash in current.items() if path not in self.file_hashes]
+                new_rows = concat_frames(new_frames)
+                self.cube = self.cube.append(new_rows)
+                self.frame = concat_frames([self.frame, new_rows])
+            else:
+                # 文件被修改或删除：从各文件的列式缓存重新合并
+                frames = [self._load_file(path, file_hash, registry, ingest)
+                          for path, file_hash in current.items()]
+                self.frame = concat_frames(frames)
+                self.cube = SalesCube(self.frame)
+
+            self.file_hashes = current
+            self.fingerprint = hashlib.sha256('|'.join(current.values()).encode()).hexdigest()
+            if self.frame is not None:
+                self.frame.attrs['fingerprint'] = self.fingerprint
+            save_registry(registry, notify)
+            return True
+
+
+# ---- 共享数据集 ----
+class DatasetHandle:
+    """会话持有的共享数据集引用，只保存数据集指纹"""
+
+    __slots__ = ('key', '_pool', '__weakref__')
+
+    def __init__(self, key, pool):
+        self.key = key
+        self._pool = pool
+
+    @property
+    def frame(self):
+        return self._pool.get(self.key)
+
+    @property
+    def products(self):
+        return self._pool.products(self.key)
+
+
+class SharedDatasetPool:
+    """进程内所有会话共用的只读数据集，按数据集指纹去重。
+
+    会话只持有DatasetHandle，同一数据集在进程内只保留一份，重复读取的一份直接丢弃。
+    所有句柄被回收（会话结束）后数据集不再被引用，最近使用的max_idle个仍保留，
+    刷新页面时不必重新读取。共享的数据集不能原地修改，需要派生新列时先复制。
+    产品维度表随数据集保存，优先使用导入时建立的一份，没有时首次使用才建立。
+    """
+
+    def __init__(self, max_idle=2):
+        self.max_idle = max_idle
+        self.reused = 0
+        self._frames = OrderedDict()
+        self._products = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def products(self, key):
+        """返回数据集的产品维度表，数据集已被清理时返回None"""
+        with self._lock:
+            products = self._products.get(key)
+            frame = self._frames.get(key)
+        if products is not None or frame is None:
+            return products
+        # 在锁外解析产品名称，并发建立时保留先登记的一份
+        products = ProductDimension.from_frame(frame)
+        with self._lock:
+            if key not in self._frames:
+                return products
+            return self._products.setdefault(key, products)
+
+    def attach(self, df, products=None):
+        """登记数据集并返回句柄；已有相同指纹的数据集时返回已有的一份"""
+        key = get_dataset_fingerprint(df)
+        with self._lock:
+            if key in self._frames:
+                self.reused += 1
+            else:
+                self._frames[key] = df
+            if products is not None and self._frames[key] is df:
+                self._products.setdefault(key, products)
+            self._frames.move_to_end(key)
+            handle = DatasetHandle(key, self)
+            self._users.setdefault(key, weakref.WeakSet()).add(handle)
+            self._evict()
+        return handle
+
+    def _evict(self):
+        # 只清理没有会话使用的数据集，按最近使用保留max_idle个
+        idle = [key for key in self._frames if not self._users.get(key)]
+        for key in idle[:max(len(idle) - self.max_idle, 0)]:
+            del self._frames[key]
+            self._products.pop(key, None)
+            self._users.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'datasets': len(self._frames),
+                'sessions': sum(len(users) for users in self._users.values()),
+                'reused': self.reused,
+                'bytes': sum(estimate_size(frame) for frame in self._frames.values())
+            }
+
+
+# ---- 示例数据 ----
+def build_sample_data():
+    """没有上传文件时使用的简化版示例数据，与从文件加载的数据经过相同的预处理"""
+    data = {
+        '客户简称': ['广州佳成行', '广州佳成行', '广州佳成行', '广州佳成行', '广州佳成行',
+                     '广州佳成行', '河南甜丰號', '河南甜丰號', '河南甜丰號', '河南甜丰號',
+                     '河南甜丰號', '广州佳成行', '河南甜丰號', '广州佳成行', '河南甜丰號',
+                     '广州佳成行'],
+        '所属区域': ['南', '南', '南', '南', '南', '南', '中', '中', '中', '中', '中',
+                     '南', '中', '南', '中', '南'],
+        '发运月份': ['2025-03', '2025-03', '2025-03', '2025-03', '2025-03', '2025-03',
+                     '2025-03', '2025-03', '2025-03', '2025-03', '2025-03', '2025-03',
+                     '2025-03', '2025-03', '2025-03', '2025-03'],
+        '申请人': ['梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽',
+                   '胡斌', '胡斌', '胡斌', '胡斌', '胡斌', '梁洪泽', '胡斌', '梁洪泽',
+                   '胡斌', '梁洪泽'],
+        '产品代码': ['F3415D', 'F3421D', 'F0104J', 'F0104L', 'F3411A', 'F01E4B',
+                     'F01L4C', 'F01C2P', 'F01E6D', 'F3450B', 'F3415B', 'F0110C',
+                     'F0183F', 'F01K8A', 'F0183K', 'F0101P'],
+        '产品名称': ['口力酸小虫250G分享装袋装-中国', '口力可乐瓶250G分享装袋装-中国',
+                     '口力比萨XXL45G盒装-中国', '口力比萨68G袋装-中国', '口力午餐袋77G袋装-中国',
+                     '口力汉堡108G袋装-中国', '口力扭扭虫2KG迷你包-中国', '口力字节软糖2KG迷你包-中国',
+                     '口力西瓜1.5KG随手包-中国', '口力七彩熊1.5KG随手包-中国', '口力酸小虫1.5KG随手包-中国',
+                     '口力软糖新品A-中国', '口力软糖新品B-中国', '口力软糖新品C-中国', '口力软糖新品D-中国',
+                     '口力软糖新品E-中国'],
+        '订单类型': ['订单-正常产品'] * 16,
+        '单价（箱）': [121.44, 121.44, 216.96, 126.72, 137.04, 137.04, 127.2, 127.2,
+                     180, 180, 180, 150, 160, 170, 180, 190],
+        '数量（箱）': [10, 10, 20, 50, 252, 204, 7, 2, 6, 6, 6, 30, 20, 15, 10, 5]
+    }
+
+    df = pd.DataFrame(data)
+    df['销售额'] = df['单价（箱）'] * df['数量（箱）']
+
+    # 与从文件加载时一致，发运月份转换为日期类型
+    df['发运月份'] = pd.to_datetime(df['发运月份'])
+
+    # 添加简化产品名称、包装类型和规格列
+    add_product_attributes(df)
+
+    df = optimize_dtypes(df)
+    df.attrs['fingerprint'] = 'sample'
+    return df
+
+
+# ---- 报告与导出 ----
+# 区域销售汇总
+def build_region_summary(df):
+    region_summary = df.groupby('所属区域', observed=True).agg({
+        '销售额': 'sum',
+        '客户简称': pd.Series.nunique,
+        '产品代码': pd.Series.nunique,
+        '数量（箱）': 'sum'
+    }).reset_index()
+    region_summary.columns = ['区域', '销售额', '客户数', '产品数', '销售数量']
+    return region_summary
+
+
+# 产品销售汇总
+def build_product_summary(df):
+    product_summary = df.groupby(['产品代码', '简化产品名称'], observed=True).agg({
+        '销售额': 'sum',
+        '客户简称': pd.Series.nunique,
+        '数量（箱）': 'sum'
+    }).sort_values('销售额', ascending=False).reset_index()
+    product_summary.columns = ['产品代码', '产品名称', '销售额', '购买客户数', '销售数量']
+    return product_summary
+
+
+# 以constant_memory模式逐行写出工作表 - 内存占用与行数无关
+def write_sheet_rows(workbook, sheet_name, df, chunk_rows=10000):
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+    datetime_columns = {i for i, col in enumerate(df.columns)
+                        if pd.api.types.is_datetime64_any_dtype(df[col])}
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        # 按列转换为Python对象，缺失值写为空单元格
+        columns = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist() for col in chunk.columns]
+        for offset, values in enumerate(zip(*columns)):
+            row = start + offset + 1
+            for col, value in enumerate(values):
+                if value is None:
+                    continue
+                if col in datetime_columns:
+                    worksheet.write_datetime(row, col, value.to_pydatetime(), datetime_format)
+                else:
+                    worksheet.write(row, col, value)
+
+
+# 创建Excel报告
+def generate_excel_report(df, new_products_df=None, region_summary=None, product_summary=None):
+    """生成Excel报告。df和new_products_df为None时只写出区域和产品汇总"""
+    # 区域销售汇总、产品销售汇总
+    if region_summary is None:
+        region_summary = build_region_summary(df)
+    if product_summary is None:
+        product_summary = build_product_summary(df)
+
+    output = BytesIO()
+    sheets = []
+    if df is not None:
+        sheets.append(('销售数据总览', df))
+    if new_products_df is not None and not new_products_df.empty:
+        sheets.append(('新品销售数据', new_products_df))
+    sheets += [('区域销售汇总', region_summary), ('产品销售汇总', product_summary)]
+
+    if df is not None and len(df) >= EXCEL_CONSTANT_MEMORY_ROWS:
+        # 大数据量时逐行写出，xlsxwriter不在内存中保留整张工作表
+        import xlsxwriter
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        for sheet_name, sheet_df in sheets:
+            write_sheet_rows(workbook, sheet_name, sheet_df)
+        workbook.close()
+    else:
+        writer = pd.ExcelWriter(output, engine='xlsxwriter')
+        for sheet_name, sheet_df in sheets:
+            sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        # 保存Excel
+        writer.close()
+
+    return output.getvalue()
+
+
+def generate_error_report(message):
+    """生成只包含错误信息的Excel报告"""
+    error_output = BytesIO()
+    with pd.ExcelWriter(error_output, engine='xlsxwriter') as writer:
+        pd.DataFrame({'错误': [message]}).to_excel(writer, sheet_name='错误信息', index=False)
+    return error_output.getvalue()
+
+
+# 导出为Parquet - 直接由列式数据写出，分类列保存为字典编码
+def export_parquet(df):
+    output = BytesIO()
+    df.to_parquet(output, engine='pyarrow', index=False)
+    return output.getvalue()
+
+
+# 导出为gzip压缩的CSV - 由Arrow表分批编码，不经过Excel工作簿
+def export_csv_gz(df):
+    if not PARQUET_AVAILABLE:
+        output = BytesIO()
+        df.to_csv(output, index=False, encoding='utf-8-sig', compression='gzip')
+        return output.getvalue()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 日期时间列精确到秒，避免输出微秒
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.timestamp('s')))
+    sink = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(sink, 'gzip') as stream:
+        # 写入BOM，Excel打开时能正确识别UTF-8中文
+        stream.write('\ufeff'.encode('utf-8'))
+        pcsv.write_csv(table, stream)
+    return sink.getvalue().to_pybytes()
+
+
+# ---- 性能剖析 ----
+def current_rss_bytes():
+    """当前进程的常驻内存字节数，无法获取时返回None"""
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RerunProfiler:
+    """记录一次脚本运行中各阶段的耗时和内存变化。
+
+    stage()可以嵌套，每个阶段记录耗时、常驻内存的变化，开启trace_memory时还记录
+    阶段内Python分配内存的峰值（tracemalloc，开销较大，只在排查时开启）。
+    tracemalloc在进程内全局统计，多个会话同时运行时峰值仅供参考。
+    """
+
+    # 由本类开启的内存跟踪，关闭时只停止这种情况，不影响以 -X tracemalloc 启动的进程
+    _started_tracing = False
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            RerunProfiler._started_tracing = True
+        self.stages = []
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        record = {'name': name, 'depth': len(self._stack)}
+        self.stages.append(record)
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # 重置峰值前先把已出现的峰值记到外层阶段
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        frame = {'peak': 0, 'traced': current if tracing else 0, 'rss': current_rss_bytes()}
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            self._stack.pop()
+            rss = current_rss_bytes()
+            if rss is not None and frame['rss'] is not None:
+                record['rss_delta_mb'] = round((rss - frame['rss']) / 1024 / 1024, 3)
+            if tracing and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], frame['peak'])
+                record['alloc_peak_mb'] = round((peak - frame['traced']) / 1024 / 1024, 3)
+
+    @staticmethod
+    def stop_tracing():
+        """停止由剖析开启的内存跟踪，恢复正常运行速度"""
+        if RerunProfiler._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        RerunProfiler._started_tracing = False
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def summary(self):
+        """各阶段的耗时表，阶段名称按嵌套层级缩进"""
+        rows = [{
+            '阶段': '\u3000' * record['depth'] + record['name'],
+            '耗时 (ms)': round(record.get('seconds', 0) * 1000, 1),
+            '内存变化 (MB)': record.get('rss_delta_mb'),
+            '分配峰值 (MB)': record.get('alloc_peak_mb')
+        } for record in self.stages]
+        summary = pd.DataFrame(rows, columns=['阶段', '耗时 (ms)', '内存变化 (MB)', '分配峰值 (MB)'])
+        return summary.dropna(axis=1, how='all')
+
+    def to_record(self, **extra):
+        """写入剖析日志的一条记录"""
+        rss = current_rss_bytes()
+        return dict({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'seconds': round(self.elapsed, 6),
+            'rss_mb': None if rss is None else round(rss / 1024 / 1024, 1),
+            'trace_memory': self.trace_memory,
+            'stages': self.stages
+        }, **extra)
+
+
+class ProfileLog:
+    """追加写入的JSONL剖析日志，进程内共享并统计脚本运行次数。
+
+    每次运行写一行JSON；文件超过max_mb时轮换为 .1 文件，只保留一份旧日志。
+    """
+
+    def __init__(self, path, max_mb=DEFAULT_PROFILE_LOG_MAX_MB):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        self.reruns = 0
+        self._lock = threading.Lock()
+
+    def next_rerun(self):
+        """进程内的运行序号"""
+        with self._lock:
+            self.reruns += 1
+            return self.reruns
+
+    def append(self, record, notify=None):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                if notify is not None:
+                    notify(f"写入性能剖析日志时出错: {str(e)}")
@@ -3,14 +3,31 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 import matplotlib.pyplot as plt
 import seaborn as sns
 from io import BytesIO
-import traceback
 import os
 import json
-from pathlib import Path
+import time
+import hashlib
+import logging
+
+# 数据解析、缓存和各项分析的计算部分，不依赖streamlit，也供批量报告命令行工具使用
+from sales_analytics import (
+    PARQUET_AVAILABLE, SCIPY_AVAILABLE,
+    DEFAULT_CACHE_MAX_MB, DEFAULT_STREAMING_THRESHOLD_MB, DEFAULT_AGGREGATE_CACHE_MAX_MB,
+    SCATTER_BINNING_ROWS, DEFAULT_NEW_PRODUCT_COHORTS,
+    TIME_SERIES_FREQUENCIES, TIME_SERIES_DIMENSIONS, TIME_SERIES_METRICS,
+    FilterIndex, AggregateCache, SalesCube, SalesTimeSeries, PenetrationEngine, ProductAffinity, DatasetStore,
+    SharedDatasetPool,
+    IngestJob, ingest_workbook, sorted_unique, build_product_name_mapping, get_dataset_fingerprint,
+    compute_trend_metric, segment_customers, bin_scatter_points,
+    normalize_cohorts, cohort_registry_key, compute_row_cohorts, new_product_view, compare_cohorts,
+    generate_excel_report, generate_error_report, export_parquet, export_csv_gz,
+    RerunProfiler, ProfileLog, build_sample_data
+)
 
 # 设置页面配置
 st.set_page_config(
@@ -22,6 +39,12 @@ st.set_page_config(
 
 # 定义配置文件路径
 CONFIG_PATH = "./.streamlit/dashboard_config.json"
+# 图表缓存（序列化后的图表JSON）的默认内存上限
+DEFAULT_FIGURE_CACHE_MAX_MB = 64
+# 每次运行的各阶段耗时和缓存命中情况追加写入该日志
+PROFILE_LOG_PATH = "./.streamlit/rerun_profile.jsonl"
+# 在页面脚本之外（如点击下载时）发生的错误无法显示在页面上，写入服务端日志
+logger = logging.getLogger(__name__)
 
 
 # ---- 配置加载与保存函数 ----
@@ -37,7 +60,14 @@ def load_config():
             default_config = {
                 "default_file_path": "C:/Users/何晴雅/Desktop/Q1xlsx.xlsx",
                 "tableau_theme": True,
-                "last_uploaded_file": None
+                "last_uploaded_file": None,
+                "parquet_cache_max_mb": DEFAULT_CACHE_MAX_MB,
+                "aggregate_cache_max_mb": DEFAULT_AGGREGATE_CACHE_MAX_MB,
+                "figure_cache_max_mb": DEFAULT_FIGURE_CACHE_MAX_MB,
+                "streaming_threshold_mb": DEFAULT_STREAMING_THRESHOLD_MB,
+                "dataset_source": "",
+                "new_product_cohorts": DEFAULT_NEW_PRODUCT_COHORTS,
+                "profile_log_enabled": True
             }
             save_config(default_config)
             return default_config
@@ -46,7 +76,14 @@ def load_config():
         return {
             "default_file_path": "C:/Users/何晴雅/Desktop/Q1xlsx.xlsx",
             "tableau_theme": True,
-            "last_uploaded_file": None
+            "last_uploaded_file": None,
+            "parquet_cache_max_mb": DEFAULT_CACHE_MAX_MB,
+            "aggregate_cache_max_mb": DEFAULT_AGGREGATE_CACHE_MAX_MB,
+            "figure_cache_max_mb": DEFAULT_FIGURE_CACHE_MAX_MB,
+            "streaming_threshold_mb": DEFAULT_STREAMING_THRESHOLD_MB,
+            "dataset_source": "",
+            "new_product_cohorts": DEFAULT_NEW_PRODUCT_COHORTS,
+            "profile_log_enabled": True
         }
 
 
@@ -60,6 +97,13 @@ def save_config(config):
         st.error(f"保存配置文件时出错: {str(e)}")
 
 
+# ---- 性能剖析 ----
+@st.cache_resource
+def get_profile_log(path):
+    # 进程级共享的剖析日志，同时统计所有会话的运行次数
+    return ProfileLog(path)
+
+
 # 加载配置
 if 'config' not in st.session_state:
     st.session_state.config = load_config()
@@ -67,12 +111,23 @@ if 'config' not in st.session_state:
 # 初始化session state变量
 if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
-if 'df' not in st.session_state:
-    st.session_state.df = None
+if 'dataset' not in st.session_state:
+    st.session_state.dataset = None
 if 'file_path' not in st.session_state:
     st.session_state.file_path = st.session_state.config['default_file_path']
 if 'is_sample_data' not in st.session_state:
     st.session_state.is_sample_data = True
+if 'dataset_source' not in st.session_state:
+    st.session_state.dataset_source = st.session_state.config.get("dataset_source", "")
+if 'profile_session_id' not in st.session_state:
+    st.session_state.profile_session_id = os.urandom(4).hex()
+    st.session_state.rerun_count = 0
+
+# 性能剖析：记录本次运行各阶段的耗时和内存，显示在侧边栏调试信息中并追加写入日志
+st.session_state.rerun_count += 1
+profile_log = get_profile_log(PROFILE_LOG_PATH)
+process_rerun = profile_log.next_rerun()
+profiler = RerunProfiler(trace_memory=st.session_state.get('trace_memory', False))
 
 # 定义一些更美观的Tableau风格CSS样式
 st.markdown("""
@@ -376,130 +431,221 @@ def format_yuan(value):
     return f"{value:,.0f}元"
 
 
-# 安全筛选函数
-def safe_filter(df, filter_func):
-    """安全应用筛选条件，确保筛选后的数据不为空"""
-    try:
-        filtered = filter_func(df)
-        if filtered.empty:
-            st.warning("当前筛选条件下没有匹配的数据。请尝试放宽筛选条件。")
-            return df  # 返回原始数据而不是空数据
-        return filtered
-    except Exception as e:
-        st.error(f"筛选数据时出错: {str(e)}")
-        return df
+# 柱状图和散点图共用的布局样式（字号、边距、背景），只构建一次
+@st.cache_resource
+def get_chart_layout_template():
+    axis_style = dict(title_font=dict(size=16), tickfont=dict(size=14))
+    return go.Layout(
+        xaxis=axis_style,
+        yaxis=axis_style,
+        margin=dict(t=60, b=80, l=80, r=60),
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
 
 
-# 加载数据函数 - 修改以支持默认文件路径和session state
-@st.cache_data
-def load_data(file_path=None):
-    # 如果提供了文件路径，从文件加载
-    try:
-        if file_path is not None:
-            try:
-                # 检查是否是FileUploader对象还是字符串路径
-                if hasattr(file_path, 'read'):
-                    # 是上传的文件对象
-                    df = pd.read_excel(file_path, engine='openpyxl')
-                    # 更新配置中的最后一次上传路径
-                    st.session_state.config["last_uploaded_file"] = file_path.name
-                    save_config(st.session_state.config)
-                else:
-                    # 是文件路径字符串
-                    df = pd.read_excel(file_path, engine='openpyxl')
-            except Exception as e:
-                st.error(f"文件加载失败: {str(e)}。使用示例数据进行演示。")
-                df = load_sample_data()
-                return df, True  # 返回示例数据标记
+def apply_chart_style(fig, x_title, y_title="销售额 (元)", **layout):
+    fig.update_layout(
+        get_chart_layout_template(),
+        xaxis_title_text=x_title,
+        yaxis_title_text=y_title,
+        **layout
+    )
+
+
+# ---- 筛选索引 ----
+
+
+@st.cache_resource(max_entries=8)
+def get_filter_index(fingerprint, _df):
+    # 每个数据集只建立一次索引，按数据集指纹缓存
+    return FilterIndex(_df)
+
+
+@st.cache_resource(max_entries=8)
+def get_product_name_mapping(fingerprint, _df):
+    # 每个数据集只构建一次产品名称映射，按数据集指纹缓存，每次重新运行直接复用
+    return build_product_name_mapping(_df)
+
+
+# ---- 聚合结果缓存 ----
+
+
+@st.cache_resource
+def get_aggregate_cache(max_mb):
+    # 进程级共享的聚合缓存
+    return AggregateCache(max_mb * 1024 * 1024)
+
+
+def hash_chart_input(data):
+    """计算图表输入数据的内容哈希，DataFrame/Series按内容和列名，其他对象按repr"""
+    hasher = hashlib.sha256()
+    for item in (data if isinstance(data, tuple) else (data,)):
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            hasher.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+            hasher.update(repr(list(item.columns) if isinstance(item, pd.DataFrame) else item.name).encode())
         else:
-            df = load_sample_data()
-            return df, True  # 返回示例数据标记
+            hasher.update(repr(item).encode())
+    return hasher.hexdigest()
 
-        # 数据预处理
-        df['销售额'] = df['单价（箱）'] * df['数量（箱）']
 
-        # 确保发运月份是日期类型
-        try:
-            df['发运月份'] = pd.to_datetime(df['发运月份'])
-        except Exception as e:
-            st.info(f"发运月份转换为日期类型时出错。原因：{str(e)}。将保持原格式。")
+class FigureCache(AggregateCache):
+    """按(图表名称, 输入数据哈希, 样式参数)缓存序列化后的图表JSON。
 
-        # 添加简化产品名称列
-        df['简化产品名称'] = df.apply(lambda row: get_simplified_product_name(row['产品代码'], row['产品名称']), axis=1)
+    输入数据未变化的图表直接从JSON还原，不再经过plotly express构建；
+    同时记录每个图表最近一次构建的耗时。
+    """
 
-        return df, False  # 返回实际数据标记
-    except Exception as e:
-        st.error(f"加载数据时出现未预期的错误: {str(e)}")
-        st.write("错误详情:")
-        st.write(traceback.format_exc())
-        df = load_sample_data()
-        return df, True  # 返回示例数据标记
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self.build_times = {}
+
+    def get_figure(self, name, data, build, style=None):
+        key = (name, hash_chart_input(data), repr(sorted(style.items())) if style else None)
+
+        def compute():
+            start = time.perf_counter()
+            fig_json = build().to_json()
+            with self._lock:
+                self.build_times[name] = time.perf_counter() - start
+            return fig_json
+
+        return pio.from_json(self.get_or_compute(key, compute))
+
+
+@st.cache_resource
+def get_figure_cache(max_mb):
+    # 进程级共享的图表缓存
+    return FigureCache(max_mb * 1024 * 1024)
+
+
+# ---- 预聚合立方体 ----
+
+
+@st.cache_resource(max_entries=8)
+def get_sales_cube(fingerprint, _df):
+    # 每个数据集只构建一次立方体，按数据集指纹缓存
+    return SalesCube(_df)
+
+
+# ---- 时间序列 ----
+# 趋势图最多展示的维度成员数（按销售额取前几名）
+TREND_TOP_MEMBERS = 10
+
+
+@st.cache_resource
+def get_time_series_engine():
+    # 进程级共享的时间序列缓存
+    return SalesTimeSeries()
+
+
+# ---- 市场渗透率 ----
+# 热力图中按平均渗透率展示的产品数
+PENETRATION_TOP_PRODUCTS = 20
+
+
+@st.cache_resource
+def get_penetration_engine():
+    # 进程级共享的渗透率结构
+    return PenetrationEngine()
 
 
-# 创建产品代码到简化产品名称的映射函数 (修复版)
-def get_simplified_product_name(product_code, product_name):
+# ---- 新品批次 ----
+@st.cache_resource(max_entries=8)
+def get_row_cohorts(fingerprint, registry_key, _df):
+    # 每个数据集和批次登记只计算一次各行所属批次
+    return compute_row_cohorts(_df, registry_key)
+
+
+# ---- 共享数据集 ----
+@st.cache_resource
+def get_shared_datasets():
+    # 进程级共享：同一数据集在所有会话之间只保留一份，会话只持有句柄和筛选状态
+    return SharedDatasetPool()
+
+
+# ---- 多文件数据集 ----
+
+
+@st.cache_resource
+def get_dataset_store(source):
+    # 每个数据源在进程内只保留一份合并后的数据集
+    return DatasetStore(source)
+
+
+def ingest_workbook_with_progress(file_path, file_hash):
+    """在页面脚本中解析工作簿，显示进度条和提示"""
+    progress_bar = st.progress(0.0, text="正在加载数据...")
     try:
-        # 从产品名称中提取关键部分
-        if '口力' in product_name:
-            # 提取"口力"之后的产品类型
-            name_parts = product_name.split('口力')[1].split('-')[0].strip()
-            # 进一步简化，只保留主要部分（去掉规格和包装形式）
-            for suffix in ['G分享装袋装', 'G盒装', 'G袋装', 'KG迷你包', 'KG随手包']:
-                name_parts = name_parts.split(suffix)[0]
-
-            # 去掉可能的数字和单位
-            import re
-            simple_name = re.sub(r'\d+\w*\s*', '', name_parts).strip()
-
-            # 始终包含产品代码以确保唯一性
-            return f"{simple_name} ({product_code})"
-        else:
-            # 如果无法提取，则返回产品代码
-            return product_code
-    except Exception as e:
-        # 出错时返回产品代码
-        return product_code
+        return ingest_workbook(
+            file_path, file_hash, st.session_state.config,
+            progress=lambda fraction, rows: progress_bar.progress(fraction, text=f"正在加载数据：已读取 {rows:,} 行"),
+            notify=st.info
+        )
+    finally:
+        progress_bar.empty()
+
+
+# 加载数据函数 - 在后台线程中加载，加载期间显示预览和进度，完成后返回任务
+def load_data_in_background(file_path, key, name):
+    job = st.session_state.get('ingest_job')
+    if job is not None and job.key != key:
+        # 换了文件：取消仍在运行的旧任务
+        job.cancel()
+        job = None
+    if job is None:
+        source = file_path
+        if hasattr(file_path, 'getvalue'):
+            # 工作线程使用独立的缓冲区，避免与页面脚本共用读写位置
+            source = BytesIO(file_path.getvalue())
+            source.name = file_path.name
+        job = IngestJob(key, source, name, st.session_state.config, datasets=get_shared_datasets()).start()
+        st.session_state.ingest_job = job
+        # 命中列式缓存时很快完成，不必先显示预览
+        job.wait(0.5)
+
+    if job.status == 'running':
+        show_loading_preview(job)
+        st.stop()
+    return job
+
+
+def show_loading_preview(job):
+    st.info(f"正在后台加载文件: {job.name}。加载完成后将自动显示完整分析。")
+    if job.preview is not None:
+        if job.preview_rows:
+            st.caption(f"工作表约 {job.preview_rows:,} 行数据，以下为前 {len(job.preview)} 行预览：")
+        st.dataframe(job.preview)
+
+    @st.fragment(run_every=0.5)
+    def poll_progress():
+        fraction, rows = job.progress
+        st.progress(fraction, text=f"正在加载数据：已读取 {rows:,} 行" if rows else "正在读取工作簿...")
+        if job.status != 'running':
+            st.rerun()
+
+    poll_progress()
+
+
+def finish_ingest_job(job):
+    """取出已结束的后台任务的结果，失败时使用示例数据，返回(共享数据集句柄, is_sample)"""
+    shared_datasets = get_shared_datasets()
+    for notice in job.notices:
+        st.info(notice)
+    if job.status == 'done':
+        if job.dataset is None:
+            job.dataset = shared_datasets.attach(job.result, products=job.products)
+        # 会话中的任务只保留句柄，上传文件的副本、预览和重复读取的数据随之释放
+        job.release()
+        return job.dataset, False
+    job.release()
+    st.error(f"文件加载失败: {job.error}。使用示例数据进行演示。")
+    return shared_datasets.attach(load_sample_data()), True
 
 
 # 创建示例数据（以防用户没有上传文件）
 @st.cache_data
 def load_sample_data():
-    # 创建简化版示例数据
-    data = {
-        '客户简称': ['广州佳成行', '广州佳成行', '广州佳成行', '广州佳成行', '广州佳成行',
-                     '广州佳成行', '河南甜丰號', '河南甜丰號', '河南甜丰號', '河南甜丰號',
-                     '河南甜丰號', '广州佳成行', '河南甜丰號', '广州佳成行', '河南甜丰號',
-                     '广州佳成行'],
-        '所属区域': ['南', '南', '南', '南', '南', '南', '中', '中', '中', '中', '中',
-                     '南', '中', '南', '中', '南'],
-        '发运月份': ['2025-03', '2025-03', '2025-03', '2025-03', '2025-03', '2025-03',
-                     '2025-03', '2025-03', '2025-03', '2025-03', '2025-03', '2025-03',
-                     '2025-03', '2025-03', '2025-03', '2025-03'],
-        '申请人': ['梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽', '梁洪泽',
-                   '胡斌', '胡斌', '胡斌', '胡斌', '胡斌', '梁洪泽', '胡斌', '梁洪泽',
-                   '胡斌', '梁洪泽'],
-        '产品代码': ['F3415D', 'F3421D', 'F0104J', 'F0104L', 'F3411A', 'F01E4B',
-                     'F01L4C', 'F01C2P', 'F01E6D', 'F3450B', 'F3415B', 'F0110C',
-                     'F0183F', 'F01K8A', 'F0183K', 'F0101P'],
-        '产品名称': ['口力酸小虫250G分享装袋装-中国', '口力可乐瓶250G分享装袋装-中国',
-                     '口力比萨XXL45G盒装-中国', '口力比萨68G袋装-中国', '口力午餐袋77G袋装-中国',
-                     '口力汉堡108G袋装-中国', '口力扭扭虫2KG迷你包-中国', '口力字节软糖2KG迷你包-中国',
-                     '口力西瓜1.5KG随手包-中国', '口力七彩熊1.5KG随手包-中国', '口力酸小虫1.5KG随手包-中国',
-                     '口力软糖新品A-中国', '口力软糖新品B-中国', '口力软糖新品C-中国', '口力软糖新品D-中国',
-                     '口力软糖新品E-中国'],
-        '订单类型': ['订单-正常产品'] * 16,
-        '单价（箱）': [121.44, 121.44, 216.96, 126.72, 137.04, 137.04, 127.2, 127.2,
-                     180, 180, 180, 150, 160, 170, 180, 190],
-        '数量（箱）': [10, 10, 20, 50, 252, 204, 7, 2, 6, 6, 6, 30, 20, 15, 10, 5]
-    }
-
-    df = pd.DataFrame(data)
-    df['销售额'] = df['单价（箱）'] * df['数量（箱）']
-
-    # 添加简化产品名称列
-    df['简化产品名称'] = df.apply(lambda row: get_simplified_product_name(row['产品代码'], row['产品名称']), axis=1)
-
-    return df
+    return build_sample_data()
 
 
 # 侧边栏 - 配置和上传
@@ -533,89 +679,152 @@ with st.sidebar.expander("默认文件设置", expanded=False):
         st.session_state.file_path = default_file
         # 清除之前缓存的数据，使其重新加载
         st.session_state.data_loaded = False
-        st.experimental_rerun()
+        st.rerun()
+
+# 多文件数据集配置
+with st.sidebar.expander("多文件数据集", expanded=False):
+    dataset_source = st.text_input(
+        "数据集目录或通配符",
+        value=st.session_state.dataset_source,
+        help="例如 ./data 或 ./data/销售_*.xlsx，目录下的所有工作簿将合并为一个数据集；新增文件只解析新文件"
+    )
 
-# 加载数据逻辑 - 优先使用上传的文件，其次使用默认路径
-try:
-    # 检查是否需要加载数据（未加载或重新上传）
-    if not st.session_state.data_loaded or uploaded_file is not None:
-        if uploaded_file is not None:
-            # 用户刚刚上传了新文件
-            df, is_sample = load_data(uploaded_file)
-            st.session_state.df = df
-            st.session_state.is_sample_data = is_sample
-            st.session_state.data_loaded = True
-
-            if not is_sample:
-                st.sidebar.success(f"""
-                <div class="success-status">
-                    <span class="status-icon">✅</span> 已成功加载文件: {uploaded_file.name}
-                </div>
-                """, unsafe_allow_html=True)
+    col_load, col_refresh, col_clear = st.columns(3)
+    if col_load.button("加载数据集"):
+        st.session_state.dataset_source = dataset_source.strip()
+        st.session_state.config["dataset_source"] = st.session_state.dataset_source
+        save_config(st.session_state.config)
+        st.session_state.data_loaded = False
+        st.rerun()
+    if col_refresh.button("刷新数据集", disabled=not st.session_state.dataset_source):
+        # 重新检查源文件，只处理新增或变化的文件
+        st.session_state.data_loaded = False
+        st.rerun()
+    if col_clear.button("停用数据集", disabled=not st.session_state.dataset_source):
+        st.session_state.dataset_source = ""
+        st.session_state.config["dataset_source"] = ""
+        save_config(st.session_state.config)
+        st.session_state.data_loaded = False
+        st.rerun()
 
-        elif not st.session_state.data_loaded:
-            # 尝试从默认路径加载
-            try:
-                default_path = st.session_state.config["default_file_path"]
-                if os.path.exists(default_path):
-                    df, is_sample = load_data(default_path)
-                    st.session_state.df = df
-                    st.session_state.is_sample_data = is_sample
+    if st.session_state.dataset_source:
+        dataset_store = get_dataset_store(st.session_state.dataset_source)
+        if dataset_store.file_hashes:
+            st.caption(f"已合并 {len(dataset_store.file_hashes)} 个文件")
+
+# 加载数据逻辑 - 优先使用上传的文件，其次使用多文件数据集，最后使用默认路径
+# 会话中只保存共享数据集的句柄，同一文件在多个会话中只占一份内存
+shared_datasets = get_shared_datasets()
+with profiler.stage('加载数据'):
+    try:
+        # 检查是否需要加载数据（未加载或重新上传）
+        if not st.session_state.data_loaded or uploaded_file is not None:
+            if uploaded_file is not None:
+                # 用户刚刚上传了新文件，在后台线程中加载
+                if st.session_state.config.get("last_uploaded_file") != uploaded_file.name:
+                    # 更新配置中的最后一次上传路径
+                    st.session_state.config["last_uploaded_file"] = uploaded_file.name
+                    save_config(st.session_state.config)
+                job = load_data_in_background(uploaded_file, uploaded_file.file_id, uploaded_file.name)
+                st.session_state.dataset, is_sample = finish_ingest_job(job)
+                st.session_state.is_sample_data = is_sample
+                st.session_state.data_loaded = True
+
+                if not is_sample:
+                    st.sidebar.success(f"""
+                    <div class="success-status">
+                        <span class="status-icon">✅</span> 已成功加载文件: {uploaded_file.name}
+                    </div>
+                    """, unsafe_allow_html=True)
+
+            elif st.session_state.dataset_source:
+                # 从多文件数据集加载，只解析新增或变化的文件
+                try:
+                    dataset_store = get_dataset_store(st.session_state.dataset_source)
+                    dataset_store.refresh(ingest=ingest_workbook_with_progress, notify=st.error)
+                    st.session_state.dataset = shared_datasets.attach(dataset_store.frame)
+                    st.session_state.is_sample_data = False
                     st.session_state.data_loaded = True
 
-                    if not is_sample:
-                        st.sidebar.success(f"""
-                        <div class="success-status">
-                            <span class="status-icon">✅</span> 已从默认路径加载文件: {os.path.basename(default_path)}
+                    st.sidebar.success(f"""
+                    <div class="success-status">
+                        <span class="status-icon">✅</span> 已加载数据集: {len(dataset_store.file_hashes)} 个文件，共 {len(dataset_store.frame):,} 行
+                    </div>
+                    """, unsafe_allow_html=True)
+                except Exception as e:
+                    st.session_state.dataset = shared_datasets.attach(load_sample_data())
+                    st.session_state.is_sample_data = True
+                    st.session_state.data_loaded = True
+
+                    st.sidebar.error(f"""
+                    <div class="error-status">
+                        <span class="status-icon">❌</span> 加载数据集出错: {str(e)}。使用示例数据。
+                    </div>
+                    """, unsafe_allow_html=True)
+
+            elif not st.session_state.data_loaded:
+                # 尝试从默认路径加载
+                try:
+                    default_path = st.session_state.config["default_file_path"]
+                    if os.path.exists(default_path):
+                        # 文件修改后重新加载
+                        job_key = f"{os.path.abspath(default_path)}:{os.path.getmtime(default_path)}"
+                        job = load_data_in_background(default_path, job_key, os.path.basename(default_path))
+                        st.session_state.dataset, is_sample = finish_ingest_job(job)
+                        st.session_state.is_sample_data = is_sample
+                        st.session_state.data_loaded = True
+
+                        if not is_sample:
+                            st.sidebar.success(f"""
+                            <div class="success-status">
+                                <span class="status-icon">✅</span> 已从默认路径加载文件: {os.path.basename(default_path)}
+                            </div>
+                            """, unsafe_allow_html=True)
+                    else:
+                        # 默认文件不存在，使用示例数据
+                        st.session_state.dataset = shared_datasets.attach(load_sample_data())
+                        st.session_state.is_sample_data = True
+                        st.session_state.data_loaded = True
+
+                        st.sidebar.warning(f"""
+                        <div class="warning-status">
+                            <span class="status-icon">⚠️</span> 默认文件不存在，使用示例数据。请上传您的文件。
                         </div>
                         """, unsafe_allow_html=True)
-                else:
-                    # 默认文件不存在，使用示例数据
-                    df = load_sample_data()
-                    st.session_state.df = df
+                except Exception as e:
+                    # 出错则使用示例数据
+                    st.session_state.dataset = shared_datasets.attach(load_sample_data())
                     st.session_state.is_sample_data = True
                     st.session_state.data_loaded = True
 
-                    st.sidebar.warning(f"""
-                    <div class="warning-status">
-                        <span class="status-icon">⚠️</span> 默认文件不存在，使用示例数据。请上传您的文件。
+                    st.sidebar.error(f"""
+                    <div class="error-status">
+                        <span class="status-icon">❌</span> 加载默认文件出错: {str(e)}。使用示例数据。
                     </div>
                     """, unsafe_allow_html=True)
-            except Exception as e:
-                # 出错则使用示例数据
-                df = load_sample_data()
-                st.session_state.df = df
-                st.session_state.is_sample_data = True
-                st.session_state.data_loaded = True
-
-                st.sidebar.error(f"""
-                <div class="error-status">
-                    <span class="status-icon">❌</span> 加载默认文件出错: {str(e)}。使用示例数据。
+        else:
+            # 使用已加载的数据
+            if st.session_state.is_sample_data:
+                st.sidebar.info("""
+                <div class="info-message">
+                    <span class="status-icon">ℹ️</span> 正在使用示例数据。请上传您的数据文件获取真实分析。
                 </div>
                 """, unsafe_allow_html=True)
-    else:
-        # 使用已加载的数据
-        df = st.session_state.df
 
-        if st.session_state.is_sample_data:
-            st.sidebar.info("""
-            <div class="info-message">
-                <span class="status-icon">ℹ️</span> 正在使用示例数据。请上传您的数据文件获取真实分析。
-            </div>
-            """, unsafe_allow_html=True)
+    except Exception as e:
+        st.error(f"加载数据时出错: {str(e)}")
+        st.session_state.dataset = shared_datasets.attach(load_sample_data())
+        st.session_state.is_sample_data = True
+        st.session_state.data_loaded = True
 
-except Exception as e:
-    st.error(f"加载数据时出错: {str(e)}")
-    df = load_sample_data()
-    st.session_state.df = df
-    st.session_state.is_sample_data = True
-    st.session_state.data_loaded = True
+        st.sidebar.warning("""
+        <div class="warning-status">
+            <span class="status-icon">⚠️</span> 由于错误，使用示例数据进行演示。请检查您的数据文件格式。
+        </div>
+        """, unsafe_allow_html=True)
 
-    st.sidebar.warning("""
-    <div class="warning-status">
-        <span class="status-icon">⚠️</span> 由于错误，使用示例数据进行演示。请检查您的数据文件格式。
-    </div>
-    """, unsafe_allow_html=True)
+    # 共享的数据集只读，需要派生新列时先复制
+    df = st.session_state.dataset.frame
 
 # 如果当前使用的是示例数据，显示提示信息
 if st.session_state.is_sample_data:
@@ -632,83 +841,197 @@ with st.expander("数据预览", expanded=False):
     st.write(f"总行数: {len(df)}")
     st.write(f"列名: {', '.join(df.columns)}")
 
-# 定义新品产品代码
-new_products = ['F0110C', 'F0183F', 'F01K8A', 'F0183K', 'F0101P']
-new_products_df = df[df['产品代码'].isin(new_products)]
-
-# 创建产品代码到简化名称的映射字典（用于图表显示）
-product_name_mapping = {
-    code: df[df['产品代码'] == code]['简化产品名称'].iloc[0] if len(df[df['产品代码'] == code]) > 0 else code
-    for code in df['产品代码'].unique()
-}
-
-# 侧边栏 - 筛选器
-st.sidebar.markdown('<div class="sidebar-header">筛选数据</div>', unsafe_allow_html=True)
-
-# 筛选器容器开始
-st.sidebar.markdown('<div class="filter-container">', unsafe_allow_html=True)
-
-# 区域筛选器
-all_regions = sorted(df['所属区域'].astype(str).unique())
-selected_regions = st.sidebar.multiselect("选择区域", all_regions, default=all_regions)
-
-# 客户筛选器
-all_customers = sorted(df['客户简称'].astype(str).unique())
-selected_customers = st.sidebar.multiselect("选择客户", all_customers, default=[])
-
-# 产品代码筛选器
-all_products = sorted(df['产品代码'].astype(str).unique())
-product_options = [(code, product_name_mapping[code]) for code in all_products]
-selected_products = st.sidebar.multiselect(
-    "选择产品",
-    options=all_products,
-    format_func=lambda x: f"{x} ({product_name_mapping[x]})",
-    default=[]
-)
+with profiler.stage('筛选器'):
+    # 创建产品代码到简化名称的映射字典（用于图表显示）
+    product_name_mapping = get_product_name_mapping(get_dataset_fingerprint(df), df)
 
-# 申请人筛选器
-all_applicants = sorted(df['申请人'].astype(str).unique())
-selected_applicants = st.sidebar.multiselect("选择申请人", all_applicants, default=[])
+    # 侧边栏 - 筛选器
+    st.sidebar.markdown('<div class="sidebar-header">筛选数据</div>', unsafe_allow_html=True)
 
-# 筛选器容器结束
-st.sidebar.markdown('</div>', unsafe_allow_html=True)
+    # 筛选器容器开始
+    st.sidebar.markdown('<div class="filter-container">', unsafe_allow_html=True)
+
+    # 区域筛选器
+    all_regions = sorted_unique(df['所属区域'])
+    selected_regions = st.sidebar.multiselect("选择区域", all_regions, default=all_regions)
 
-# 应用筛选条件
-filtered_df = df.copy()
+    # 客户筛选器
+    all_customers = sorted_unique(df['客户简称'])
+    selected_customers = st.sidebar.multiselect("选择客户", all_customers, default=[])
 
-if selected_regions:
-    filtered_df = safe_filter(filtered_df, lambda d: d[d['所属区域'].isin(selected_regions)])
+    # 产品代码筛选器
+    all_products = sorted_unique(df['产品代码'])
+    selected_products = st.sidebar.multiselect(
+        "选择产品",
+        options=all_products,
+        format_func=lambda x: f"{x} ({product_name_mapping[x]})",
+        default=[]
+    )
 
-if selected_customers:
-    filtered_df = safe_filter(filtered_df, lambda d: d[d['客户简称'].isin(selected_customers)])
+    # 申请人筛选器
+    all_applicants = sorted_unique(df['申请人'])
+    selected_applicants = st.sidebar.multiselect("选择申请人", all_applicants, default=[])
+
+    # 筛选器容器结束
+    st.sidebar.markdown('</div>', unsafe_allow_html=True)
+
+# 新品批次登记：保存在配置文件中，可在侧边栏编辑
+new_product_cohorts = normalize_cohorts(
+    st.session_state.config.get("new_product_cohorts", DEFAULT_NEW_PRODUCT_COHORTS))
+
+with st.sidebar.expander("新品批次设置", expanded=False):
+    cohort_names = [cohort['name'] for cohort in new_product_cohorts]
+    editing_name = st.selectbox("选择批次", cohort_names + ["新建批次"])
+    editing_index = cohort_names.index(editing_name) if editing_name in cohort_names else None
+    editing = new_product_cohorts[editing_index] if editing_index is not None else \
+        {'name': '', 'launch_date': None, 'products': []}
+
+    cohort_name = st.text_input("批次名称", value=editing['name'])
+    cohort_launch = st.date_input(
+        "上市日期",
+        value=pd.Timestamp(editing['launch_date']).date() if editing['launch_date'] else None,
+        help="用于按上市后月数对齐比较各批次；留空时以首个有销售的月份为起点"
+    )
+    cohort_product_options = sorted(set(all_products) | set(editing['products']))
+    cohort_products = st.multiselect(
+        "批次产品",
+        options=cohort_product_options,
+        default=editing['products'],
+        format_func=lambda x: f"{x} ({product_name_mapping.get(x, x)})"
+    )
 
-if selected_products:
-    filtered_df = safe_filter(filtered_df, lambda d: d[d['产品代码'].isin(selected_products)])
+    col_save, col_delete = st.columns(2)
+    if col_save.button("保存批次"):
+        if not cohort_name.strip():
+            st.warning("请填写批次名称。")
+        else:
+            updated = {
+                'name': cohort_name.strip(),
+                'launch_date': cohort_launch.isoformat() if cohort_launch else None,
+                'products': cohort_products
+            }
+            # 产品移入当前批次时从其他批次中移除
+            others = [
+                dict(cohort, products=[code for code in cohort['products'] if code not in cohort_products])
+                for i, cohort in enumerate(new_product_cohorts) if i != editing_index
+            ]
+            if editing_index is None:
+                others.append(updated)
+            else:
+                others.insert(editing_index, updated)
+            st.session_state.config["new_product_cohorts"] = normalize_cohorts(others)
+            save_config(st.session_state.config)
+            st.rerun()
+    if col_delete.button("删除批次", disabled=editing_index is None):
+        st.session_state.config["new_product_cohorts"] = [
+            cohort for i, cohort in enumerate(new_product_cohorts) if i != editing_index
+        ]
+        save_config(st.session_state.config)
+        st.rerun()
+
+# 新品即所有批次登记的产品；每行所属批次在数据加载后计算一次，新品数据按行号取出
+with profiler.stage('新品批次'):
+    new_products = [code for cohort in new_product_cohorts for code in cohort['products']]
+    new_product_cohort_key = cohort_registry_key(new_product_cohorts)
+    new_product_cohort_names = [cohort['name'] for cohort in new_product_cohorts]
+    row_cohorts = get_row_cohorts(get_dataset_fingerprint(df), new_product_cohort_key, df)
+    new_product_rows = np.flatnonzero(row_cohorts >= 0)
+
+# 应用筛选条件：通过预建的倒排索引合并各筛选器，再一次性取出匹配的行
+with profiler.stage('筛选数据'):
+    filter_selections = {
+        '所属区域': selected_regions,
+        '客户简称': selected_customers,
+        '产品代码': selected_products,
+        '申请人': selected_applicants
+    }
 
-if selected_applicants:
-    filtered_df = safe_filter(filtered_df, lambda d: d[d['申请人'].isin(selected_applicants)])
+    filtered_rows = None
+    try:
+        filter_index = get_filter_index(get_dataset_fingerprint(df), df)
+        filtered_rows, skipped_filters = filter_index.filter_rows(filter_selections)
+        for _ in skipped_filters:
+            st.warning("当前筛选条件下没有匹配的数据。请尝试放宽筛选条件。")
+        filter_key = filter_index.normalize_selections(filter_selections)
+    except Exception as e:
+        st.error(f"筛选数据时出错: {str(e)}")
+        filtered_rows = None
+        filter_key = ()
+
+    # 检查筛选后是否还有数据
+    if filtered_rows is not None and len(filtered_rows) == 0:
+        st.error("应用所有筛选条件后没有匹配的数据。请调整筛选条件。")
+        # 重置为原始数据
+        filtered_rows = None
+        filter_key = ()
+        st.warning("已重置为原始数据。")
+    filtered_row_count = len(df) if filtered_rows is None else len(filtered_rows)
+
+
+def filtered_view(columns=None):
+    """筛选后的数据：只取出需要的列和行，未筛选时直接使用共享数据集，不复制"""
+    data = df if columns is None else df[columns]
+    return data if filtered_rows is None else data.take(filtered_rows)
+
+
+# 聚合结果缓存：按(数据集指纹, 规范化筛选条件, 聚合规格)复用之前的计算结果
+aggregate_cache = get_aggregate_cache(
+    st.session_state.config.get("aggregate_cache_max_mb", DEFAULT_AGGREGATE_CACHE_MAX_MB))
+figure_cache = get_figure_cache(
+    st.session_state.config.get("figure_cache_max_mb", DEFAULT_FIGURE_CACHE_MAX_MB))
+time_series_engine = get_time_series_engine()
+penetration_engine = get_penetration_engine()
+dataset_fingerprint = get_dataset_fingerprint(df)
+# 运行开始时的缓存统计，运行结束时相减得到本次运行的命中情况
+cache_stats_start = {'聚合缓存': aggregate_cache.stats(), '图表缓存': figure_cache.stats()}
+
+
+def cached_aggregate(spec, compute):
+    """获取当前数据集和筛选条件下的聚合结果，未命中时调用compute计算"""
+    return aggregate_cache.get_or_compute((dataset_fingerprint, filter_key, spec), compute)
+
+
+def show_figure(name, data, build, style=None):
+    """从图表缓存取得图表并显示，耗时计入性能剖析中该图表的阶段"""
+    with profiler.stage(f"图表 {name}"):
+        st.plotly_chart(figure_cache.get_figure(name, data, build, style), use_container_width=True)
+
+
+# 预聚合立方体：图表和KPI都从立方体上卷得到，不再扫描逐行数据
+# 多文件数据集的立方体随新增文件增量追加，直接复用
+with profiler.stage('预聚合立方体'):
+    dataset_store = get_dataset_store(st.session_state.dataset_source) if st.session_state.dataset_source else None
+    if dataset_store is not None and dataset_store.fingerprint == dataset_fingerprint:
+        sales_cube = dataset_store.cube
+    else:
+        sales_cube = get_sales_cube(dataset_fingerprint, df)
+    cube_mask, cube_applied = sales_cube.select(filter_selections) if filter_key else (None, {})
+    new_product_mask = sales_cube.restrict(cube_mask, '产品代码', new_products)
+    # 多文件数据集追加新文件后指纹会变化，增量结构按数据来源缓存，以便只处理新增的数据
+    if dataset_store is not None and dataset_store.fingerprint == dataset_fingerprint:
+        dataset_lineage = ('dataset', st.session_state.dataset_source)
+    else:
+        dataset_lineage = dataset_fingerprint
 
-# 检查筛选后是否还有数据
-if filtered_df.empty:
-    st.error("应用所有筛选条件后没有匹配的数据。请调整筛选条件。")
-    # 重置为原始数据
-    filtered_df = df.copy()
-    st.warning("已重置为原始数据。")
 
-# 根据筛选后的数据筛选新品数据
-filtered_new_products_df = filtered_df[filtered_df['产品代码'].isin(new_products)]
+# 根据筛选后的行号取出新品数据，使用预先计算的行批次，不再逐行比较产品代码
+with profiler.stage('筛选新品数据'):
+    filtered_new_rows = new_product_rows if filtered_rows is None else filtered_rows[row_cohorts[filtered_rows] >= 0]
+    filtered_new_products_df = new_product_view(df, filtered_new_rows, row_cohorts, new_product_cohort_names)
 
 # 导航栏
 st.markdown('<div class="sub-header">导航</div>', unsafe_allow_html=True)
-tabs = st.tabs(["销售概览", "新品分析", "客户细分", "产品组合", "市场渗透率"])
+tabs = st.tabs(["销售概览", "新品分析", "销售趋势", "客户细分", "产品组合", "市场渗透率"])
 
-with tabs[0]:  # 销售概览
+with tabs[0], profiler.stage('销售概览'):
     # KPI指标行
     st.markdown('<div class="sub-header">🔑 关键绩效指标</div>', unsafe_allow_html=True)
     col1, col2, col3, col4 = st.columns(4)
 
     try:
-        total_sales = filtered_df['销售额'].sum()
+        kpis = cached_aggregate('kpis', lambda: sales_cube.totals(cube_mask, cube_applied))
+
+        total_sales = kpis['销售额']
         with col1:
             st.markdown(f"""
             <div class="card">
@@ -717,7 +1040,7 @@ with tabs[0]:  # 销售概览
             </div>
             """, unsafe_allow_html=True)
 
-        total_customers = filtered_df['客户简称'].nunique()
+        total_customers = kpis['客户简称']
         with col2:
             st.markdown(f"""
             <div class="card">
@@ -726,7 +1049,7 @@ with tabs[0]:  # 销售概览
             </div>
             """, unsafe_allow_html=True)
 
-        total_products = filtered_df['产品代码'].nunique()
+        total_products = kpis['产品代码']
         with col3:
             st.markdown(f"""
             <div class="card">
@@ -735,7 +1058,7 @@ with tabs[0]:  # 销售概览
             </div>
             """, unsafe_allow_html=True)
 
-        avg_price = filtered_df['单价（箱）'].mean()
+        avg_price = kpis['平均单价']
         with col4:
             st.markdown(f"""
             <div class="card">
@@ -752,42 +1075,41 @@ with tabs[0]:  # 销售概览
 
     try:
         # 区域销售额柱状图
-        region_sales = filtered_df.groupby('所属区域')['销售额'].sum().reset_index()
+        region_sales = cached_aggregate(
+            'region_sales',
+            lambda: sales_cube.rollup(['所属区域'], cube_mask)[['所属区域', '销售额']]
+        )
 
         if not region_sales.empty:
             with col1:
                 # 添加图表容器
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
-                fig_region = px.bar(
-                    region_sales,
-                    x='所属区域',
-                    y='销售额',
-                    color='所属区域',
-                    title='各区域销售额',
-                    labels={'销售额': '销售额 (元)', '所属区域': '区域'},
-                    height=500,
-                    color_discrete_sequence=px.colors.qualitative.Bold
-                )
-                # 添加文本标签
-                fig_region.update_traces(
-                    text=[format_yuan(val) for val in region_sales['销售额']],
-                    textposition='outside',
-                    textfont=dict(size=14)
-                )
-                fig_region.update_layout(
-                    xaxis_title=dict(text="区域", font=dict(size=16)),
-                    yaxis_title=dict(text="销售额 (元)", font=dict(size=16)),
-                    xaxis_tickfont=dict(size=14),
-                    yaxis_tickfont=dict(size=14),
-                    margin=dict(t=60, b=80, l=80, r=60),
-                    plot_bgcolor='rgba(0,0,0,0)'
-                )
-                # 确保Y轴有足够空间显示数据标签
-                fig_region.update_yaxes(
-                    range=[0, region_sales['销售额'].max() * 1.2]
-                )
-                st.plotly_chart(fig_region, use_container_width=True)
+                def build_fig_region():
+                    fig_region = px.bar(
+                        region_sales,
+                        x='所属区域',
+                        y='销售额',
+                        color='所属区域',
+                        title='各区域销售额',
+                        labels={'销售额': '销售额 (元)', '所属区域': '区域'},
+                        height=500,
+                        color_discrete_sequence=px.colors.qualitative.Bold
+                    )
+                    # 添加文本标签
+                    fig_region.update_traces(
+                        text=[format_yuan(val) for val in region_sales['销售额']],
+                        textposition='outside',
+                        textfont=dict(size=14)
+                    )
+                    apply_chart_style(fig_region, "区域")
+                    # 确保Y轴有足够空间显示数据标签
+                    fig_region.update_yaxes(
+                        range=[0, region_sales['销售额'].max() * 1.2]
+                    )
+                    return fig_region
+
+                show_figure('region_sales', region_sales, build_fig_region)
 
                 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -796,24 +1118,27 @@ with tabs[0]:  # 销售概览
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
                 # 区域销售占比饼图
-                fig_region_pie = px.pie(
-                    region_sales,
-                    values='销售额',
-                    names='所属区域',
-                    title='各区域销售占比',
-                    hole=0.4,
-                    color_discrete_sequence=px.colors.qualitative.Bold
-                )
-                fig_region_pie.update_traces(
-                    textposition='inside',
-                    textinfo='percent+label',
-                    textfont=dict(size=14)
-                )
-                fig_region_pie.update_layout(
-                    margin=dict(t=60, b=60, l=60, r=60),
-                    font=dict(size=14)
-                )
-                st.plotly_chart(fig_region_pie, use_container_width=True)
+                def build_fig_region_pie():
+                    fig_region_pie = px.pie(
+                        region_sales,
+                        values='销售额',
+                        names='所属区域',
+                        title='各区域销售占比',
+                        hole=0.4,
+                        color_discrete_sequence=px.colors.qualitative.Bold
+                    )
+                    fig_region_pie.update_traces(
+                        textposition='inside',
+                        textinfo='percent+label',
+                        textfont=dict(size=14)
+                    )
+                    fig_region_pie.update_layout(
+                        margin=dict(t=60, b=60, l=60, r=60),
+                        font=dict(size=14)
+                    )
+                    return fig_region_pie
+
+                show_figure('region_sales_pie', region_sales, build_fig_region_pie)
 
                 st.markdown('</div>', unsafe_allow_html=True)
         else:
@@ -825,28 +1150,11 @@ with tabs[0]:  # 销售概览
     st.markdown('<div class="sub-header section-gap">📦 产品销售分析</div>', unsafe_allow_html=True)
 
 
-    # 提取包装类型
-    def extract_packaging(product_name):
-        try:
-            if '袋装' in product_name:
-                return '袋装'
-            elif '盒装' in product_name:
-                return '盒装'
-            elif '随手包' in product_name:
-                return '随手包'
-            elif '迷你包' in product_name:
-                return '迷你包'
-            elif '分享装' in product_name:
-                return '分享装'
-            else:
-                return '其他'
-        except:
-            return '其他'
-
-
     try:
-        filtered_df['包装类型'] = filtered_df['产品名称'].apply(extract_packaging)
-        packaging_sales = filtered_df.groupby('包装类型')['销售额'].sum().reset_index()
+        packaging_sales = cached_aggregate(
+            'packaging_sales',
+            lambda: sales_cube.rollup(['包装类型'], cube_mask)[['包装类型', '销售额']]
+        )
 
         col1, col2 = st.columns(2)
 
@@ -856,34 +1164,30 @@ with tabs[0]:  # 销售概览
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
                 # 包装类型销售额柱状图
-                fig_packaging = px.bar(
-                    packaging_sales.sort_values(by='销售额', ascending=False),
-                    x='包装类型',
-                    y='销售额',
-                    color='包装类型',
-                    title='不同包装类型销售额',
-                    labels={'销售额': '销售额 (元)', '包装类型': '包装类型'},
-                    height=500
-                )
-                # 添加文本标签
-                fig_packaging.update_traces(
-                    text=[format_yuan(val) for val in packaging_sales['销售额']],
-                    textposition='outside',
-                    textfont=dict(size=14)
-                )
-                fig_packaging.update_layout(
-                    xaxis_title=dict(text="包装类型", font=dict(size=16)),
-                    yaxis_title=dict(text="销售额 (元)", font=dict(size=16)),
-                    xaxis_tickfont=dict(size=14),
-                    yaxis_tickfont=dict(size=14),
-                    margin=dict(t=60, b=80, l=80, r=60),
-                    plot_bgcolor='rgba(0,0,0,0)'
-                )
-                # 确保Y轴有足够空间显示数据标签
-                fig_packaging.update_yaxes(
-                    range=[0, packaging_sales['销售额'].max() * 1.2]
-                )
-                st.plotly_chart(fig_packaging, use_container_width=True)
+                def build_fig_packaging():
+                    fig_packaging = px.bar(
+                        packaging_sales.sort_values(by='销售额', ascending=False),
+                        x='包装类型',
+                        y='销售额',
+                        color='包装类型',
+                        title='不同包装类型销售额',
+                        labels={'销售额': '销售额 (元)', '包装类型': '包装类型'},
+                        height=500
+                    )
+                    # 添加文本标签
+                    fig_packaging.update_traces(
+                        text=[format_yuan(val) for val in packaging_sales['销售额']],
+                        textposition='outside',
+                        textfont=dict(size=14)
+                    )
+                    apply_chart_style(fig_packaging, "包装类型")
+                    # 确保Y轴有足够空间显示数据标签
+                    fig_packaging.update_yaxes(
+                        range=[0, packaging_sales['销售额'].max() * 1.2]
+                    )
+                    return fig_packaging
+
+                show_figure('packaging_sales', packaging_sales, build_fig_packaging)
 
                 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -891,30 +1195,48 @@ with tabs[0]:  # 销售概览
             # 添加图表容器
             st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
-            # 价格-销量散点图
+            # 价格-销量散点图 - 行数较多时在服务端按网格聚合，避免向浏览器发送逐行数据
             try:
-                fig_price_qty = px.scatter(
-                    filtered_df,
-                    x='单价（箱）',
-                    y='数量（箱）',
-                    size='销售额',
-                    color='所属区域',
-                    hover_name='简化产品名称',  # 使用简化产品名称
-                    title='价格与销售数量关系',
-                    labels={'单价（箱）': '单价 (元/箱)', '数量（箱）': '销售数量 (箱)'},
-                    height=500
-                )
+                price_qty_binned = filtered_row_count > SCATTER_BINNING_ROWS
+                if price_qty_binned:
+                    price_qty_points = cached_aggregate('price_qty_bins', lambda: bin_scatter_points(
+                        filtered_view(['单价（箱）', '数量（箱）', '销售额', '所属区域']),
+                        '单价（箱）', '数量（箱）', '销售额', '所属区域'
+                    ))
+                else:
+                    price_qty_points = filtered_view(['单价（箱）', '数量（箱）', '销售额', '所属区域', '简化产品名称'])
+
+                def build_fig_price_qty():
+                    if price_qty_binned:
+                        fig_price_qty = px.scatter(
+                            price_qty_points,
+                            x='单价（箱）',
+                            y='数量（箱）',
+                            size='销售额',
+                            color='所属区域',
+                            hover_data={'订单行数': True},
+                            title='价格与销售数量关系（按网格聚合）',
+                            labels={'单价（箱）': '单价 (元/箱)', '数量（箱）': '销售数量 (箱)'},
+                            height=500
+                        )
+                    else:
+                        fig_price_qty = px.scatter(
+                            price_qty_points,
+                            x='单价（箱）',
+                            y='数量（箱）',
+                            size='销售额',
+                            color='所属区域',
+                            hover_name='简化产品名称',  # 使用简化产品名称
+                            title='价格与销售数量关系',
+                            labels={'单价（箱）': '单价 (元/箱)', '数量（箱）': '销售数量 (箱)'},
+                            height=500
+                        )
 
-                # 添加趋势线
-                fig_price_qty.update_layout(
-                    xaxis_title=dict(text="单价 (元/箱)", font=dict(size=16)),
-                    yaxis_title=dict(text="销售数量 (箱)", font=dict(size=16)),
-                    xaxis_tickfont=dict(size=14),
-                    yaxis_tickfont=dict(size=14),
-                    margin=dict(t=60, b=80, l=80, r=60),
-                    plot_bgcolor='rgba(0,0,0,0)'
-                )
-                st.plotly_chart(fig_price_qty, use_container_width=True)
+                    # 添加趋势线
+                    apply_chart_style(fig_price_qty, "单价 (元/箱)", "销售数量 (箱)")
+                    return fig_price_qty
+
+                show_figure('price_qty', price_qty_points, build_fig_price_qty, style={'binned': price_qty_binned})
             except Exception as e:
                 st.error(f"创建价格-销量散点图时出错: {str(e)}")
 
@@ -926,40 +1248,40 @@ with tabs[0]:  # 销售概览
     st.markdown('<div class="sub-header section-gap">👨‍💼 申请人销售业绩</div>', unsafe_allow_html=True)
 
     try:
-        applicant_performance = filtered_df.groupby('申请人')['销售额'].sum().sort_values(ascending=False).reset_index()
+        applicant_performance = cached_aggregate(
+            'applicant_performance',
+            lambda: sales_cube.rollup(['申请人'], cube_mask)[['申请人', '销售额']]
+            .sort_values('销售额', ascending=False).reset_index(drop=True)
+        )
 
         if not applicant_performance.empty:
             # 添加图表容器
             st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
-            fig_applicant = px.bar(
-                applicant_performance,
-                x='申请人',
-                y='销售额',
-                color='申请人',
-                title='申请人销售业绩排名',
-                labels={'销售额': '销售额 (元)', '申请人': '申请人'},
-                height=500
-            )
-            # 添加文本标签
-            fig_applicant.update_traces(
-                text=[format_yuan(val) for val in applicant_performance['销售额']],
-                textposition='outside',
-                textfont=dict(size=14)
-            )
-            fig_applicant.update_layout(
-                xaxis_title=dict(text="申请人", font=dict(size=16)),
-                yaxis_title=dict(text="销售额 (元)", font=dict(size=16)),
-                xaxis_tickfont=dict(size=14),
-                yaxis_tickfont=dict(size=14),
-                margin=dict(t=60, b=80, l=80, r=60),
-                plot_bgcolor='rgba(0,0,0,0)'
-            )
-            # 确保Y轴有足够空间显示数据标签
-            fig_applicant.update_yaxes(
-                range=[0, applicant_performance['销售额'].max() * 1.2]
-            )
-            st.plotly_chart(fig_applicant, use_container_width=True)
+            def build_fig_applicant():
+                fig_applicant = px.bar(
+                    applicant_performance,
+                    x='申请人',
+                    y='销售额',
+                    color='申请人',
+                    title='申请人销售业绩排名',
+                    labels={'销售额': '销售额 (元)', '申请人': '申请人'},
+                    height=500
+                )
+                # 添加文本标签
+                fig_applicant.update_traces(
+                    text=[format_yuan(val) for val in applicant_performance['销售额']],
+                    textposition='outside',
+                    textfont=dict(size=14)
+                )
+                apply_chart_style(fig_applicant, "申请人")
+                # 确保Y轴有足够空间显示数据标签
+                fig_applicant.update_yaxes(
+                    range=[0, applicant_performance['销售额'].max() * 1.2]
+                )
+                return fig_applicant
+
+            show_figure('applicant_performance', applicant_performance, build_fig_applicant)
 
             st.markdown('</div>', unsafe_allow_html=True)
         else:
@@ -967,22 +1289,37 @@ with tabs[0]:  # 销售概览
     except Exception as e:
         st.error(f"创建申请人销售业绩图表时出错: {str(e)}")
 
+    # 产品维度表：每个产品的规格、净含量和产地，附上筛选后的销售额和箱数
+    with st.expander("查看产品维度表"):
+        try:
+            # 维度表随共享数据集保存，导入时建立的一份直接复用
+            product_dimension = st.session_state.dataset.products
+            product_dimension_summary = cached_aggregate(
+                'product_dimension_summary', lambda: product_dimension.summarize(df, filtered_rows).sort_values(
+                    '销售额', ascending=False))
+            st.dataframe(product_dimension_summary, hide_index=True)
+        except Exception as e:
+            st.error(f"创建产品维度表时出错: {str(e)}")
+
     # 原始数据表
     with st.expander("查看筛选后的原始数据"):
-        st.dataframe(filtered_df)
+        st.dataframe(filtered_view())
 
-with tabs[1]:  # 新品分析
+with tabs[1], profiler.stage('新品分析'):
     st.markdown('<div class="sub-header">🆕 新品销售分析</div>', unsafe_allow_html=True)
 
     # 检查新品数据是否为空
-    if filtered_new_products_df.empty:
+    if not new_product_mask.any():
         st.warning("当前筛选条件下没有新品销售数据。请调整筛选条件或确认产品代码是否正确。")
     else:
         # 新品KPI指标
         col1, col2, col3 = st.columns(3)
 
         try:
-            new_products_sales = filtered_new_products_df['销售额'].sum()
+            new_product_kpis = cached_aggregate(('new_product_kpis', tuple(new_products)),
+                                                lambda: sales_cube.totals(new_product_mask))
+
+            new_products_sales = new_product_kpis['销售额']
             with col1:
                 st.markdown(f"""
                 <div class="card">
@@ -1000,7 +1337,7 @@ with tabs[1]:  # 新品分析
                 </div>
                 """, unsafe_allow_html=True)
 
-            new_products_customers = filtered_new_products_df['客户简称'].nunique()
+            new_products_customers = new_product_kpis['客户简称']
             with col3:
                 st.markdown(f"""
                 <div class="card">
@@ -1016,41 +1353,40 @@ with tabs[1]:  # 新品分析
 
         try:
             # 使用简化产品名称
-            product_sales = filtered_new_products_df.groupby(['产品代码', '简化产品名称'])['销售额'].sum().reset_index()
-            product_sales = product_sales.sort_values('销售额', ascending=False)
+            product_sales = cached_aggregate(
+                ('new_product_sales', tuple(new_products)),
+                lambda: sales_cube.rollup(['产品代码', '简化产品名称'], new_product_mask)[
+                    ['产品代码', '简化产品名称', '销售额']].sort_values('销售额', ascending=False)
+            )
 
             if not product_sales.empty:
                 # 添加图表容器
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
-                fig_product_sales = px.bar(
-                    product_sales,
-                    x='简化产品名称',  # 使用简化产品名称
-                    y='销售额',
-                    color='简化产品名称',  # 使用简化产品名称
-                    title='新品产品销售额对比',
-                    labels={'销售额': '销售额 (元)', '简化产品名称': '产品名称'},
-                    height=500
-                )
-                # 添加文本标签
-                fig_product_sales.update_traces(
-                    text=[format_yuan(val) for val in product_sales['销售额']],
-                    textposition='outside',
-                    textfont=dict(size=14)
-                )
-                fig_product_sales.update_layout(
-                    xaxis_title=dict(text="产品名称", font=dict(size=16)),
-                    yaxis_title=dict(text="销售额 (元)", font=dict(size=16)),
-                    xaxis_tickfont=dict(size=14),
-                    yaxis_tickfont=dict(size=14),
-                    margin=dict(t=60, b=80, l=80, r=60),
-                    plot_bgcolor='rgba(0,0,0,0)'
-                )
-                # 确保Y轴有足够空间显示数据标签
-                fig_product_sales.update_yaxes(
-                    range=[0, product_sales['销售额'].max() * 1.2]
-                )
-                st.plotly_chart(fig_product_sales, use_container_width=True)
+                def build_fig_product_sales():
+                    fig_product_sales = px.bar(
+                        product_sales,
+                        x='简化产品名称',  # 使用简化产品名称
+                        y='销售额',
+                        color='简化产品名称',  # 使用简化产品名称
+                        title='新品产品销售额对比',
+                        labels={'销售额': '销售额 (元)', '简化产品名称': '产品名称'},
+                        height=500
+                    )
+                    # 添加文本标签
+                    fig_product_sales.update_traces(
+                        text=[format_yuan(val) for val in product_sales['销售额']],
+                        textposition='outside',
+                        textfont=dict(size=14)
+                    )
+                    apply_chart_style(fig_product_sales, "产品名称")
+                    # 确保Y轴有足够空间显示数据标签
+                    fig_product_sales.update_yaxes(
+                        range=[0, product_sales['销售额'].max() * 1.2]
+                    )
+                    return fig_product_sales
+
+                show_figure('new_product_sales', product_sales, build_fig_product_sales)
 
                 st.markdown('</div>', unsafe_allow_html=True)
             else:
@@ -1068,30 +1404,32 @@ with tabs[1]:  # 新品分析
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
                 # 区域新品销售额堆叠柱状图
-                region_product_sales = filtered_new_products_df.groupby(['所属区域', '简化产品名称'])[
-                    '销售额'].sum().reset_index()
+                region_product_sales = cached_aggregate(
+                    ('new_product_region_sales', tuple(new_products)),
+                    lambda: sales_cube.rollup(['所属区域', '简化产品名称'], new_product_mask)[
+                        ['所属区域', '简化产品名称', '销售额']]
+                )
 
                 if not region_product_sales.empty:
-                    fig_region_product = px.bar(
-                        region_product_sales,
-                        x='所属区域',
-                        y='销售额',
-                        color='简化产品名称',  # 使用简化产品名称
-                        title='各区域新品销售额分布',
-                        labels={'销售额': '销售额 (元)', '所属区域': '区域', '简化产品名称': '产品名称'},
-                        height=500
-                    )
-                    fig_region_product.update_layout(
-                        xaxis_title=dict(text="区域", font=dict(size=16)),
-                        yaxis_title=dict(text="销售额 (元)", font=dict(size=16)),
-                        xaxis_tickfont=dict(size=14),
-                        yaxis_tickfont=dict(size=14),
-                        margin=dict(t=60, b=80, l=80, r=60),
-                        plot_bgcolor='rgba(0,0,0,0)',
-                        legend_title="产品名称",
-                        legend_font=dict(size=12)
-                    )
-                    st.plotly_chart(fig_region_product, use_container_width=True)
+                    def build_fig_region_product():
+                        fig_region_product = px.bar(
+                            region_product_sales,
+                            x='所属区域',
+                            y='销售额',
+                            color='简化产品名称',  # 使用简化产品名称
+                            title='各区域新品销售额分布',
+                            labels={'销售额': '销售额 (元)', '所属区域': '区域', '简化产品名称': '产品名称'},
+                            height=500
+                        )
+                        apply_chart_style(
+                            fig_region_product,
+                            "区域",
+                            legend_title="产品名称",
+                            legend_font=dict(size=12)
+                        )
+                        return fig_region_product
+
+                    show_figure('new_product_region_sales', region_product_sales, build_fig_region_product)
                 else:
                     st.warning("没有足够的区域新品销售数据来创建图表。")
 
@@ -1102,23 +1440,26 @@ with tabs[1]:  # 新品分析
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
                 # 新品占比饼图
-                fig_new_vs_old = px.pie(
-                    values=[new_products_sales, total_sales - new_products_sales],
-                    names=['新品', '非新品'],
-                    title='新品销售额占总销售额比例',
-                    hole=0.4,
-                    color_discrete_sequence=['#ff9999', '#66b3ff']
-                )
-                fig_new_vs_old.update_traces(
-                    textposition='inside',
-                    textinfo='percent+label',
-                    textfont=dict(size=14)
-                )
-                fig_new_vs_old.update_layout(
-                    margin=dict(t=60, b=60, l=60, r=60),
-                    font=dict(size=14)
-                )
-                st.plotly_chart(fig_new_vs_old, use_container_width=True)
+                def build_fig_new_vs_old():
+                    fig_new_vs_old = px.pie(
+                        values=[new_products_sales, total_sales - new_products_sales],
+                        names=['新品', '非新品'],
+                        title='新品销售额占总销售额比例',
+                        hole=0.4,
+                        color_discrete_sequence=['#ff9999', '#66b3ff']
+                    )
+                    fig_new_vs_old.update_traces(
+                        textposition='inside',
+                        textinfo='percent+label',
+                        textfont=dict(size=14)
+                    )
+                    fig_new_vs_old.update_layout(
+                        margin=dict(t=60, b=60, l=60, r=60),
+                        font=dict(size=14)
+                    )
+                    return fig_new_vs_old
+
+                show_figure('new_vs_old_share', (new_products_sales, total_sales), build_fig_new_vs_old)
 
                 st.markdown('</div>', unsafe_allow_html=True)
         except Exception as e:
@@ -1127,65 +1468,72 @@ with tabs[1]:  # 新品分析
         # 区域内新品销售占比热力图
         st.markdown('<div class="sub-header section-gap">各区域内新品销售占比</div>', unsafe_allow_html=True)
 
-        try:
+        # 计算各区域内各新品的销售占比透视表
+        def build_region_share_pivot(cube, mask):
             # 计算各区域的新品总销售额
-            region_total_sales = filtered_new_products_df.groupby('所属区域')['销售额'].sum().reset_index()
+            region_total_sales = cube.rollup(['所属区域'], mask)[['所属区域', '销售额']]
 
             # 计算各区域各新品的销售占比
-            region_product_sales = filtered_new_products_df.groupby(['所属区域', '产品代码', '简化产品名称'])[
-                '销售额'].sum().reset_index()
-
-            if not region_total_sales.empty and not region_product_sales.empty:
-                region_product_sales = region_product_sales.merge(region_total_sales, on='所属区域',
-                                                                  suffixes=('', '_区域总计'))
-                region_product_sales['销售占比'] = region_product_sales['销售额'] / region_product_sales[
-                    '销售额_区域总计'] * 100
-
-                # 创建显示名称列（简化产品名称）
-                region_product_sales['显示名称'] = region_product_sales['简化产品名称']
-
-                # 透视表
-                pivot_percentage = pd.pivot_table(
-                    region_product_sales,
-                    values='销售占比',
-                    index='所属区域',
-                    columns='显示名称',  # 使用简化名称作为列名
-                    fill_value=0
-                )
+            region_product_sales = cube.rollup(['所属区域', '产品代码', '简化产品名称'], mask)[
+                ['所属区域', '产品代码', '简化产品名称', '销售额']]
+
+            if region_total_sales.empty or region_product_sales.empty:
+                return None
+
+            region_product_sales = region_product_sales.merge(region_total_sales, on='所属区域',
+                                                              suffixes=('', '_区域总计'))
+            region_product_sales['销售占比'] = region_product_sales['销售额'] / region_product_sales[
+                '销售额_区域总计'] * 100
+
+            # 创建显示名称列（简化产品名称）
+            region_product_sales['显示名称'] = region_product_sales['简化产品名称']
+
+            # 透视表
+            return pd.pivot_table(
+                region_product_sales,
+                values='销售占比',
+                index='所属区域',
+                columns='显示名称',  # 使用简化名称作为列名
+                fill_value=0,
+                observed=True
+            )
 
+
+        try:
+            pivot_percentage = cached_aggregate(
+                ('new_product_region_share', tuple(new_products)),
+                lambda: build_region_share_pivot(sales_cube, new_product_mask)
+            )
+
+            if pivot_percentage is not None:
                 # 添加图表容器
                 st.markdown('<div class="chart-container">', unsafe_allow_html=True)
 
                 # 使用Plotly创建热力图
-                fig_heatmap = px.imshow(
-                    pivot_percentage,
-                    labels=dict(x="产品名称", y="区域", color="销售占比 (%)"),
-                    x=pivot_percentage.columns,
-                    y=pivot_percentage.index,
-                    color_continuous_scale="YlGnBu",
-                    title="各区域内新品销售占比 (%)",
-                    height=500
-                )
+                def build_fig_heatmap():
+                    fig_heatmap = px.imshow(
+                        pivot_percentage,
+                        labels=dict(x="产品名称", y="区域", color="销售占比 (%)"),
+                        x=pivot_percentage.columns,
+                        y=pivot_percentage.index,
+                        color_continuous_scale="YlGnBu",
+                        title="各区域内新品销售占比 (%)",
+                        height=500
+                    )
 
-                fig_heatmap.update_layout(
-                    xaxis_title=dict(text="产品名称", font=dict(size=16)),
-                    yaxis_title=dict(text="区域", font=dict(size=16)),
-                    margin=dict(t=80, b=80, l=100, r=100),
-                    font=dict(size=14)
-                )
+                    fig_heatmap.update_layout(
+                        xaxis_title=dict(text="产品名称", font=dict(size=16)),
+                        yaxis_title=dict(text="区域", font=dict(size=16)),
+                        margin=dict(t=80, b=80, l=100, r=100),
+                        font=dict(size=14)
+                    )
 
-                # 添加注释
-                for i in range(len(pivot_percentage.index)):
-                    for j in range(len(pivot_percentage.columns)):
-                        fig_heatmap.add_annotation(
-                            x=j,
-                            y=i,
-                            text=f"{pivot_percentage.iloc[i, j]:.1f}%",
-                            showarrow=False,
-                            font=dict(color="black" if pivot_percentage.iloc[i, j] < 50 else "white", size=14)
-                        )
+                    # 单元格标签由占比矩阵一次生成，文字颜色由Plotly按单元格底色自动取对比色
+                    cell_text = np.char.add(np.char.mod('%.1f', pivot_percentage.to_numpy(dtype=np.float64)), '%')
+                    fig_heatmap.update_traces(text=cell_text, texttemplate='%{text}', textfont=dict(size=14))
+                    return fig_heatmap
 
-                st.plotly_chart(fig_heatmap, use_container_width=True)
+                show_figure('new_product_region_share', pivot_percentage, build_fig_heatmap)
 
                 st.markdown('</div>', unsafe_allow_html=True)
             else:
@@ -1193,76 +1541,519 @@ with tabs[1]:  # 新品分析
         except Exception as e:
             st.error(f"创建区域内新品销售占比热力图时出错: {str(e)}")
 
+        # 新品批次对比
+        st.markdown('<div class="sub-header section-gap">新品批次对比</div>', unsafe_allow_html=True)
+
+        try:
+            cohort_summary, cohort_timeline = cached_aggregate(
+                ('new_product_cohorts', new_product_cohort_key),
+                lambda: compare_cohorts(sales_cube, cube_mask, new_product_cohorts)
+            )
+
+            col1, col2 = st.columns(2)
+            with col1:
+                # 添加图表容器
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                def build_fig_cohort_sales():
+                    fig_cohort_sales = px.bar(
+                        cohort_summary,
+                        x='新品批次',
+                        y='销售额',
+                        color='新品批次',
+                        hover_data={'客户数': True, '产品数': True, '上市日期': True},
+                        title='各新品批次销售额',
+                        height=500
+                    )
+                    # 添加文本标签
+                    fig_cohort_sales.update_traces(
+                        text=[format_yuan(val) for val in cohort_summary['销售额']],
+                        textposition='outside',
+                        textfont=dict(size=14)
+                    )
+                    apply_chart_style(fig_cohort_sales, "新品批次")
+                    fig_cohort_sales.update_yaxes(range=[0, max(cohort_summary['销售额'].max(), 1) * 1.2])
+                    return fig_cohort_sales
+
+                show_figure('new_product_cohort_sales', cohort_summary, build_fig_cohort_sales)
+
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            with col2:
+                if cohort_timeline.empty:
+                    st.info("发运月份不是日期类型，无法按上市后月数比较各批次。")
+                else:
+                    # 添加图表容器
+                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                    def build_fig_cohort_timeline():
+                        fig_cohort_timeline = px.line(
+                            cohort_timeline,
+                            x='上市后月数',
+                            y='销售额',
+                            color='新品批次',
+                            markers=True,
+                            title='各新品批次上市后每月销售额',
+                            height=500
+                        )
+                        apply_chart_style(fig_cohort_timeline, "上市后月数")
+                        fig_cohort_timeline.update_xaxes(dtick=1)
+                        return fig_cohort_timeline
+
+                    show_figure('new_product_cohort_timeline', cohort_timeline, build_fig_cohort_timeline)
+
+                    st.markdown('</div>', unsafe_allow_html=True)
+
+            st.dataframe(cohort_summary.round(1), hide_index=True)
+        except Exception as e:
+            st.error(f"创建新品批次对比时出错: {str(e)}")
+
         # 新品数据表
         with st.expander("查看新品销售数据"):
             display_columns = [col for col in filtered_new_products_df.columns if
                                col != '产品代码' or col != '产品名称']
             st.dataframe(filtered_new_products_df[display_columns])
 
-# 与原始代码其余部分相同，这里省略其余Tab的代码...
-# 客户细分、产品组合和市场渗透率Tab的代码保持不变
+with tabs[2], profiler.stage('销售趋势'):
+    st.markdown('<div class="sub-header">📈 销售趋势分析</div>', unsafe_allow_html=True)
+
+    if not pd.api.types.is_datetime64_any_dtype(df['发运月份']):
+        st.warning("发运月份不是日期类型，无法进行趋势分析。请检查数据文件中的发运月份格式。")
+    else:
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            trend_freq_label = st.radio("时间粒度", list(TIME_SERIES_FREQUENCIES), horizontal=True)
+        with col2:
+            trend_dim_label = st.selectbox("分组维度", ['合计'] + list(TIME_SERIES_DIMENSIONS))
+        with col3:
+            trend_metric = st.selectbox("趋势指标", TIME_SERIES_METRICS)
+        with col4:
+            trend_window = st.slider("滚动窗口（周期数）", min_value=2, max_value=12, value=3,
+                                     disabled=trend_metric != '滚动合计')
+
+        trend_freq = TIME_SERIES_FREQUENCIES[trend_freq_label]
+        trend_dim = TIME_SERIES_DIMENSIONS.get(trend_dim_label)
+
+        try:
+            trend_sales = time_series_engine.series(
+                sales_cube, dataset_fingerprint, dataset_lineage, filter_key, cube_mask, trend_dim, trend_freq
+            )
+
+            if trend_sales.empty:
+                st.warning("当前筛选条件下没有可用于趋势分析的数据。")
+            else:
+                # 成员较多时只展示销售额最高的若干个
+                trend_members = trend_sales.sum().nlargest(TREND_TOP_MEMBERS).index
+                trend_values = cached_aggregate(
+                    ('trend', trend_dim, trend_freq, trend_metric, trend_window),
+                    lambda: compute_trend_metric(trend_sales[trend_members], trend_metric, trend_freq, trend_window)
+                )
+                trend_unit = '%' if trend_metric.endswith('增长率') else '元'
+                trend_long = trend_values.to_timestamp().reset_index().melt(
+                    id_vars='发运月份', var_name=trend_dim_label, value_name=trend_metric
+                )
+
+                # 添加图表容器
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                def build_fig_trend():
+                    fig_trend = px.line(
+                        trend_long,
+                        x='发运月份',
+                        y=trend_metric,
+                        color=trend_dim_label,
+                        markers=True,
+                        title=f"{trend_metric}趋势（{trend_freq_label}）",
+                        height=500
+                    )
+                    apply_chart_style(fig_trend, "发运月份", f"{trend_metric} ({trend_unit})")
+                    return fig_trend
+
+                show_figure('sales_trend', trend_long, build_fig_trend,
+                            style={'unit': trend_unit, 'freq': trend_freq_label})
+
+                st.markdown('</div>', unsafe_allow_html=True)
+
+                # 最近一个周期的销售额、环比、同比和累计
+                st.markdown('<div class="sub-header section-gap">最近周期概况</div>', unsafe_allow_html=True)
+                latest_summary = cached_aggregate(
+                    ('trend_latest', trend_dim, trend_freq),
+                    lambda: pd.DataFrame({
+                        metric: compute_trend_metric(trend_sales[trend_members], metric, trend_freq).iloc[-1]
+                        for metric in ['销售额', '环比增长率', '同比增长率', '累计销售额']
+                    }).rename_axis(trend_dim_label).reset_index()
+                )
+                st.caption(f"最近周期: {trend_sales.index[-1]}")
+                st.dataframe(latest_summary, hide_index=True)
+
+                with st.expander("查看趋势数据"):
+                    st.dataframe(trend_values)
+        except Exception as e:
+            st.error(f"创建销售趋势分析时出错: {str(e)}")
+
+with tabs[3], profiler.stage('客户细分'):
+    st.markdown('<div class="sub-header">👥 客户细分</div>', unsafe_allow_html=True)
+
+    if not pd.api.types.is_datetime64_any_dtype(df['发运月份']):
+        st.warning("发运月份不是日期类型，无法计算最近购买间隔。请检查数据文件中的发运月份格式。")
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            segment_method = st.radio("分群方法", ['RFM分位数', 'K-means'], horizontal=True,
+                                      help="RFM分位数按最近购买间隔、购买频次、销售额的五分位得分分为八类客户；"
+                                           "K-means按三项指标的标准化值聚类")
+        with col2:
+            segment_clusters = st.slider("K-means分群数", min_value=2, max_value=8, value=4,
+                                         disabled=segment_method != 'K-means')
+
+        try:
+            customer_segments = cached_aggregate(
+                ('customer_segments', segment_method, segment_clusters if segment_method == 'K-means' else None),
+                lambda: segment_customers(sales_cube, cube_mask, segment_method, segment_clusters)
+            )
+
+            if customer_segments.empty:
+                st.warning("当前筛选条件下没有可用于客户细分的数据。")
+            else:
+                segment_summary = cached_aggregate(
+                    ('customer_segment_summary', segment_method, segment_clusters if segment_method == 'K-means' else None),
+                    lambda: customer_segments.groupby('客户分群', observed=True).agg(
+                        客户数=('客户简称', 'size'),
+                        销售额=('销售额', 'sum'),
+                        平均最近购买间隔=('最近购买间隔(天)', 'mean'),
+                        平均购买频次=('购买频次', 'mean'),
+                        平均销售额=('销售额', 'mean')
+                    ).reset_index()
+                )
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    # 添加图表容器
+                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                    def build_fig_segment_sales():
+                        fig_segment_sales = px.bar(
+                            segment_summary,
+                            x='客户分群',
+                            y='销售额',
+                            color='客户分群',
+                            title='各客户分群销售额',
+                            labels={'销售额': '销售额 (元)', '客户分群': '客户分群'},
+                            height=500
+                        )
+                        # 添加文本标签
+                        fig_segment_sales.update_traces(
+                            text=[format_yuan(val) for val in segment_summary['销售额']],
+                            textposition='outside',
+                            textfont=dict(size=14)
+                        )
+                        apply_chart_style(fig_segment_sales, "客户分群")
+                        # 确保Y轴有足够空间显示数据标签
+                        fig_segment_sales.update_yaxes(
+                            range=[0, segment_summary['销售额'].max() * 1.2]
+                        )
+                        return fig_segment_sales
+
+                    show_figure('customer_segment_sales', segment_summary, build_fig_segment_sales)
+
+                    st.markdown('</div>', unsafe_allow_html=True)
+
+                with col2:
+                    # 添加图表容器
+                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                    # 客户数较多时按网格聚合后再绘制
+                    segment_binned = len(customer_segments) > SCATTER_BINNING_ROWS
+                    if segment_binned:
+                        segment_points = cached_aggregate(
+                            ('customer_segment_bins', segment_method, segment_clusters if segment_method == 'K-means' else None),
+                            lambda: bin_scatter_points(customer_segments, '最近购买间隔(天)', '销售额', '购买频次', '客户分群')
+                        )
+                    else:
+                        segment_points = customer_segments[['客户简称', '最近购买间隔(天)', '销售额', '购买频次', '客户分群']]
+
+                    def build_fig_segment_scatter():
+                        fig_segment_scatter = px.scatter(
+                            segment_points,
+                            x='最近购买间隔(天)',
+                            y='销售额',
+                            size='购买频次',
+                            color='客户分群',
+                            hover_name=None if segment_binned else '客户简称',
+                            title='客户最近购买间隔与销售额' + ('（按网格聚合）' if segment_binned else ''),
+                            labels={'销售额': '销售额 (元)'},
+                            height=500
+                        )
+                        apply_chart_style(fig_segment_scatter, "最近购买间隔 (天)")
+                        return fig_segment_scatter
+
+                    show_figure('customer_segment_scatter', segment_points, build_fig_segment_scatter,
+                                style={'binned': segment_binned})
+
+                    st.markdown('</div>', unsafe_allow_html=True)
+
+                # 分群概况
+                st.markdown('<div class="sub-header section-gap">分群概况</div>', unsafe_allow_html=True)
+                st.dataframe(segment_summary.round(1), hide_index=True)
+
+                with st.expander("查看客户分群明细"):
+                    st.dataframe(customer_segments, hide_index=True)
+        except Exception as e:
+            st.error(f"创建客户细分分析时出错: {str(e)}")
+
+with tabs[4], profiler.stage('产品组合'):
+    st.markdown('<div class="sub-header">🧺 产品组合分析</div>', unsafe_allow_html=True)
+
+    if not SCIPY_AVAILABLE:
+        st.warning("产品组合分析需要安装scipy。请运行 pip install scipy 后重新启动仪表盘。")
+    else:
+        try:
+            product_affinity = cached_aggregate('product_affinity', lambda: ProductAffinity(sales_cube, cube_mask))
+
+            if len(product_affinity.products) < 2:
+                st.warning("当前筛选条件下产品数量不足，无法进行产品组合分析。")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    affinity_min_customers = st.slider(
+                        "最少共同购买客户数", min_value=1, max_value=max(int(product_affinity.product_customers.max()), 2),
+                        value=1, help="过滤掉共同购买客户过少、提升度不稳定的产品对"
+                    )
+                with col2:
+                    affinity_sort = st.selectbox("产品对排序依据", ['提升度', '共同购买客户数', '置信度'])
+
+                # 同一客户购买的产品对排名
+                st.markdown('<div class="sub-header section-gap">常被同一客户购买的产品对</div>', unsafe_allow_html=True)
+                top_pairs = cached_aggregate(
+                    ('product_affinity_pairs', affinity_min_customers, affinity_sort),
+                    lambda: product_affinity.top_pairs(20, affinity_min_customers, affinity_sort)
+                )
+                if top_pairs.empty:
+                    st.info("没有满足条件的产品对，请降低最少共同购买客户数。")
+                else:
+                    display_pairs = top_pairs.copy()
+                    display_pairs['产品A'] = display_pairs['产品A'].map(lambda code: product_name_mapping.get(code, code))
+                    display_pairs['产品B'] = display_pairs['产品B'].map(lambda code: product_name_mapping.get(code, code))
+                    st.dataframe(display_pairs.round(3), hide_index=True)
+
+                # 购买了X的客户还购买了
+                st.markdown('<div class="sub-header section-gap">购买该产品的客户还购买了</div>', unsafe_allow_html=True)
+                affinity_products = product_affinity.product_stats()['产品代码'].tolist()
+                affinity_product = st.selectbox(
+                    "选择产品",
+                    options=affinity_products,
+                    format_func=lambda x: f"{x} ({product_name_mapping.get(x, x)})"
+                )
+                also_bought = cached_aggregate(
+                    ('product_affinity_also_bought', affinity_product, affinity_min_customers),
+                    lambda: product_affinity.also_bought(affinity_product, 10, affinity_min_customers)
+                )
+
+                if also_bought.empty:
+                    st.info("购买该产品的客户没有购买其他产品。")
+                else:
+                    also_bought = also_bought.assign(
+                        产品名称=also_bought['产品代码'].map(lambda code: product_name_mapping.get(code, code))
+                    )
+                    # 添加图表容器
+                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                    def build_fig_also_bought():
+                        fig_also_bought = px.bar(
+                            also_bought,
+                            x='产品名称',
+                            y='置信度',
+                            color='提升度',
+                            color_continuous_scale='YlGnBu',
+                            hover_data={'共同购买客户数': True, '支持度': ':.3f'},
+                            title=f"购买 {product_name_mapping.get(affinity_product, affinity_product)} 的客户还购买了",
+                            height=500
+                        )
+                        # 添加文本标签
+                        fig_also_bought.update_traces(
+                            text=[f"{val:.0%}" for val in also_bought['置信度']],
+                            textposition='outside',
+                            textfont=dict(size=14)
+                        )
+                        apply_chart_style(fig_also_bought, "产品名称", "置信度")
+                        fig_also_bought.update_yaxes(range=[0, 1.15], tickformat='.0%')
+                        return fig_also_bought
+
+                    show_figure('product_also_bought', also_bought, build_fig_also_bought,
+                                style={'product': affinity_product})
+
+                    st.markdown('</div>', unsafe_allow_html=True)
+
+                with st.expander("查看各产品购买客户数"):
+                    product_stats = product_affinity.product_stats()
+                    product_stats.insert(1, '产品名称', product_stats['产品代码'].map(lambda code: product_name_mapping.get(code, code)))
+                    st.dataframe(product_stats.round(3), hide_index=True)
+        except Exception as e:
+            st.error(f"创建产品组合分析时出错: {str(e)}")
+
+with tabs[5], profiler.stage('市场渗透率'):
+    st.markdown('<div class="sub-header">🗺️ 市场渗透率分析</div>', unsafe_allow_html=True)
+
+    try:
+        penetration_index = penetration_engine.index(
+            sales_cube, dataset_fingerprint, dataset_lineage, filter_key, cube_mask, new_products
+        )
+        penetration_rates = cached_aggregate(('penetration_rates', tuple(new_products)),
+                                             penetration_index.region_product_rates)
+
+        if penetration_rates.empty:
+            st.warning("当前筛选条件下没有可用于渗透率分析的数据。")
+        else:
+            penetration_scope = st.radio("产品范围", ['新品', '渗透率最高的产品'], horizontal=True)
+            if penetration_scope == '新品':
+                scope_products = [code for code in penetration_rates.columns if str(code) in new_products]
+            else:
+                # 按全部区域的平均渗透率取前几个产品，避免热力图列数过多
+                scope_products = penetration_rates.mean().nlargest(PENETRATION_TOP_PRODUCTS).index.tolist()
+
+            # 各区域各产品渗透率热力图
+            st.markdown('<div class="sub-header section-gap">各区域产品渗透率</div>', unsafe_allow_html=True)
+            if not scope_products:
+                st.info("当前筛选条件下没有新品的购买记录。")
+            else:
+                penetration_matrix = penetration_rates[scope_products]
+                penetration_matrix.columns = [product_name_mapping.get(str(code), str(code)) for code in scope_products]
+
+                # 添加图表容器
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                def build_fig_penetration():
+                    fig_penetration = px.imshow(
+                        penetration_matrix,
+                        labels=dict(x="产品名称", y="区域", color="渗透率 (%)"),
+                        x=penetration_matrix.columns,
+                        y=penetration_matrix.index,
+                        color_continuous_scale="YlGnBu",
+                        title="各区域购买该产品的客户占比 (%)",
+                        height=500
+                    )
+
+                    fig_penetration.update_layout(
+                        xaxis_title=dict(text="产品名称", font=dict(size=16)),
+                        yaxis_title=dict(text="区域", font=dict(size=16)),
+                        margin=dict(t=80, b=80, l=100, r=100),
+                        font=dict(size=14)
+                    )
+
+                    cell_text = np.char.add(np.char.mod('%.1f', penetration_matrix.to_numpy(dtype=np.float64)), '%')
+                    fig_penetration.update_traces(text=cell_text, texttemplate='%{text}', textfont=dict(size=14))
+                    return fig_penetration
+
+                show_figure('region_product_penetration', penetration_matrix, build_fig_penetration)
+
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # 新品渗透率随时间变化
+            st.markdown('<div class="sub-header section-gap">新品渗透率趋势</div>', unsafe_allow_html=True)
+            penetration_trend = cached_aggregate(('new_product_penetration_trend', tuple(new_products)),
+                                                 penetration_index.new_product_trend)
+
+            if penetration_trend.empty or penetration_trend['累计新品客户数'].iloc[-1] == 0:
+                st.info("当前筛选条件下没有新品的购买记录。")
+            else:
+                # 添加图表容器
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+
+                def build_fig_penetration_trend():
+                    fig_penetration_trend = px.line(
+                        penetration_trend.melt(id_vars='发运月份', value_vars=['当月渗透率', '累计渗透率'],
+                                               var_name='指标', value_name='渗透率'),
+                        x='发运月份',
+                        y='渗透率',
+                        color='指标',
+                        markers=True,
+                        title='购买新品的客户占有购买客户的比例 (%)',
+                        height=500
+                    )
+                    apply_chart_style(fig_penetration_trend, "发运月份", "渗透率 (%)")
+                    return fig_penetration_trend
+
+                show_figure('new_product_penetration_trend', penetration_trend, build_fig_penetration_trend)
+
+                st.markdown('</div>', unsafe_allow_html=True)
+
+                with st.expander("查看新品渗透率明细"):
+                    st.dataframe(penetration_trend.round({'当月渗透率': 1, '累计渗透率': 1}), hide_index=True)
+
+            with st.expander("查看各区域客户数"):
+                st.dataframe(penetration_index.region_customer_counts().rename_axis('所属区域').reset_index(),
+                             hide_index=True)
+    except Exception as e:
+        st.error(f"创建市场渗透率分析时出错: {str(e)}")
 
 # 底部下载区域
 st.markdown("---")
 st.markdown('<div class="sub-header">📊 导出分析结果</div>', unsafe_allow_html=True)
 
 
-# 创建Excel报告
-def generate_excel_report(df, new_products_df):
+profile_log_enabled = st.session_state.config.get("profile_log_enabled", True)
+profile_session_id = st.session_state.profile_session_id
+
+
+def profile_download(name, build):
+    """下载文件在点击时才生成，不在本次运行的剖析中，单独计时后写入剖析日志"""
+    def build_and_log():
+        profile = RerunProfiler()
+        with profile.stage(name):
+            data = build()
+        if profile_log_enabled:
+            profile_log.append(profile.to_record(type='download', session=profile_session_id, bytes=len(data)))
+        return data
+    return build_and_log
+
+
+# 下载按钮 - 报告和导出文件只在点击下载时生成，并按筛选条件和新品批次登记缓存
+def build_excel_report():
+    # 在点击下载时调用，不在页面脚本中运行，出错时只能写入日志并返回错误报告
     try:
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine='xlsxwriter')
-
-        # 销售概览表
-        df.to_excel(writer, sheet_name='销售数据总览', index=False)
-
-        # 新品分析表
-        if not new_products_df.empty:
-            new_products_df.to_excel(writer, sheet_name='新品销售数据', index=False)
-
-        # 区域销售汇总
-        region_summary = df.groupby('所属区域').agg({
-            '销售额': 'sum',
-            '客户简称': pd.Series.nunique,
-            '产品代码': pd.Series.nunique,
-            '数量（箱）': 'sum'
-        }).reset_index()
-        region_summary.columns = ['区域', '销售额', '客户数', '产品数', '销售数量']
-        region_summary.to_excel(writer, sheet_name='区域销售汇总', index=False)
-
-        # 产品销售汇总
-        product_summary = df.groupby(['产品代码', '简化产品名称']).agg({
-            '销售额': 'sum',
-            '客户简称': pd.Series.nunique,
-            '数量（箱）': 'sum'
-        }).sort_values('销售额', ascending=False).reset_index()
-        product_summary.columns = ['产品代码', '产品名称', '销售额', '购买客户数', '销售数量']
-        product_summary.to_excel(writer, sheet_name='产品销售汇总', index=False)
-
-        # 保存Excel
-        writer.close()
-
-        return output.getvalue()
+        return cached_aggregate(('report_excel', new_product_cohort_key), lambda: generate_excel_report(
+            filtered_view(),
+            filtered_new_products_df,
+            region_summary=cached_aggregate('report_region_summary', lambda: sales_cube.region_summary(cube_mask)),
+            product_summary=cached_aggregate('report_product_summary', lambda: sales_cube.product_summary(cube_mask))
+        ))
     except Exception as e:
-        st.error(f"生成Excel报告时出错: {str(e)}")
+        logger.exception("生成Excel报告时出错")
         # 返回一个简单的错误报告
-        error_output = BytesIO()
-        with pd.ExcelWriter(error_output, engine='xlsxwriter') as writer:
-            pd.DataFrame({'错误': [f"生成报告时出错: {str(e)}"]}).to_excel(writer, sheet_name='错误信息', index=False)
-        return error_output.getvalue()
+        return generate_error_report(f"生成报告时出错: {str(e)}")
 
 
-# 下载按钮
 try:
-    excel_report = generate_excel_report(filtered_df, filtered_new_products_df)
-
     st.markdown('<div class="download-button">', unsafe_allow_html=True)
-    st.download_button(
-        label="下载Excel分析报告",
-        data=excel_report,
-        file_name="销售数据分析报告.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    col_excel, col_csv, col_parquet = st.columns(3)
+    with col_excel:
+        st.download_button(
+            label="下载Excel分析报告",
+            data=profile_download('Excel分析报告', build_excel_report),
+            file_name="销售数据分析报告.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
+        )
+    with col_csv:
+        st.download_button(
+            label="导出筛选数据（CSV.gz）",
+            data=profile_download('导出CSV.gz', lambda: cached_aggregate(
+                'export_csv_gz', lambda: export_csv_gz(filtered_view()))),
+            file_name="销售数据.csv.gz",
+            mime="application/gzip",
+            on_click="ignore"
+        )
+    with col_parquet:
+        st.download_button(
+            label="导出筛选数据（Parquet）",
+            data=profile_download('导出Parquet', lambda: cached_aggregate(
+                'export_parquet', lambda: export_parquet(filtered_view()))),
+            file_name="销售数据.parquet",
+            mime="application/vnd.apache.parquet",
+            on_click="ignore",
+            disabled=not PARQUET_AVAILABLE,
+            help=None if PARQUET_AVAILABLE else "需要安装pyarrow"
+        )
     st.markdown('</div>', unsafe_allow_html=True)
 except Exception as e:
     st.error(f"创建下载按钮时出错: {str(e)}")
@@ -1277,9 +2068,65 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# 调试信息：聚合缓存和图表缓存命中情况
+with st.sidebar.expander("调试信息", expanded=False):
+    cache_stats = aggregate_cache.stats()
+    st.write(f"聚合缓存命中: {cache_stats['hits']}")
+    st.write(f"聚合缓存未命中: {cache_stats['misses']}")
+    st.write(f"命中率: {cache_stats['hit_rate']:.1%}")
+    st.write(f"缓存条目: {cache_stats['entries']}（{cache_stats['bytes'] / 1024 / 1024:.2f} MB）")
+
+    figure_stats = figure_cache.stats()
+    st.write(f"图表缓存命中率: {figure_stats['hit_rate']:.1%}（命中 {figure_stats['hits']}，构建 {figure_stats['misses']}）")
+    st.write(f"图表缓存条目: {figure_stats['entries']}（{figure_stats['bytes'] / 1024 / 1024:.2f} MB）")
+    if figure_cache.build_times:
+        st.dataframe(pd.DataFrame({
+            '图表': list(figure_cache.build_times),
+            '最近构建耗时 (ms)': [round(seconds * 1000, 1) for seconds in figure_cache.build_times.values()]
+        }), hide_index=True)
+    st.write(f"时间序列增量更新: {time_series_engine.incremental_updates}，整体重算: {time_series_engine.full_rebuilds}")
+    st.write(f"渗透率增量更新: {penetration_engine.incremental_updates}，整体重算: {penetration_engine.full_rebuilds}")
+    dataset_stats = shared_datasets.stats()
+    st.write(f"共享数据集: {dataset_stats['datasets']} 份（{dataset_stats['bytes'] / 1024 / 1024:.2f} MB），"
+             f"使用中的会话句柄 {dataset_stats['sessions']}，复用 {dataset_stats['reused']} 次")
+
+    # 本次运行各阶段的耗时和内存，勾选跟踪内存分配后从下一次运行开始记录分配峰值
+    st.write(f"本会话第 {st.session_state.rerun_count} 次运行（进程内第 {process_rerun} 次），"
+             f"已耗时 {profiler.elapsed * 1000:.0f} ms")
+    st.checkbox("跟踪内存分配（tracemalloc）", key='trace_memory',
+                on_change=lambda: None if st.session_state.trace_memory else RerunProfiler.stop_tracing(),
+                help="记录各阶段Python分配内存的峰值，会使运行变慢，只在排查内存问题时开启")
+    st.dataframe(profiler.summary(), hide_index=True)
+    if profile_log_enabled:
+        st.caption(f"每次运行的剖析结果追加写入 {PROFILE_LOG_PATH}")
+
 # 底部注释
 st.markdown("""
 <div style="text-align: center; margin-top: 30px; color: #666;">
     <p>销售数据分析仪表盘 © 2025</p>
 </div>
 """, unsafe_allow_html=True)
+
+
+def cache_usage(stats, start):
+    """缓存的累计统计，附上本次运行的命中和未命中次数"""
+    hits, misses = stats['hits'] - start['hits'], stats['misses'] - start['misses']
+    return dict(stats, rerun_hits=hits, rerun_misses=misses,
+                rerun_hit_rate=hits / (hits + misses) if hits + misses else None)
+
+
+# 写入本次运行的剖析记录：各阶段耗时、运行次数和缓存命中率
+if profile_log_enabled:
+    profile_log.append(profiler.to_record(
+        type='rerun',
+        session=profile_session_id,
+        session_rerun=st.session_state.rerun_count,
+        process_rerun=process_rerun,
+        rows=len(df),
+        filtered_rows=filtered_row_count,
+        filters={col: len(values) for col, values in filter_key},
+        caches={
+            '聚合缓存': cache_usage(aggregate_cache.stats(), cache_stats_start['聚合缓存']),
+            '图表缓存': cache_usage(figure_cache.stats(), cache_stats_start['图表缓存'])
+        }
+    ), notify=st.sidebar.warning)
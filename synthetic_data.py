@@ -0,0 +1,146 @@
+"""生成与销售数据表结构相同的模拟数据，用于性能测试和演示。
+
+列与load_sample_data相同（客户简称、所属区域、发运月份、申请人、产品代码、产品名称、
+订单类型、单价（箱）、数量（箱）），基数按行数放大：产品数百到数千个，客户数万个，
+每个客户固定属于一个区域和一个申请人，产品和客户的销量按Zipf分布集中在头部。
+
+维度列直接由整数编码生成分类类型，5000万行也不需要逐行生成字符串。
+
+    python synthetic_data.py 100000 --output 模拟销售数据.xlsx
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+REGIONS = ['东', '南', '西', '北', '中']
+FLAVORS = ['酸小虫', '可乐瓶', '比萨', '午餐袋', '汉堡', '扭扭虫', '字节软糖', '西瓜', '七彩熊', '软糖',
+           '跳跳糖', '棉花糖', '果汁软糖', '薄荷糖', '奶糖', '巧克力豆', '果冻', '橡皮糖', '水果糖', '牛轧糖']
+# 规格与包装形式，与simplify_product_names要去掉的后缀一致
+PACKAGES = ['G分享装袋装', 'G盒装', 'G袋装', 'KG迷你包', 'KG随手包']
+PACKAGE_WEIGHTS = {'G分享装袋装': [150, 250, 300], 'G盒装': [45, 60, 90], 'G袋装': [68, 77, 108],
+                   'KG迷你包': [1, 2], 'KG随手包': [1, 3]}
+CITIES = ['广州', '深圳', '河南', '长沙', '武汉', '成都', '重庆', '西安', '杭州', '南京', '济南', '沈阳',
+          '昆明', '福州', '合肥', '南昌', '石家庄', '太原', '郑州', '贵阳']
+CUSTOMER_SUFFIXES = ['商贸', '食品', '贸易行', '副食', '超市', '批发部']
+ORDER_TYPES = ['订单-正常产品', '订单-促销产品', '订单-赠品']
+ORDER_TYPE_WEIGHTS = [0.9, 0.08, 0.02]
+# Excel单个工作表最多能容纳的数据行数（不含表头）
+EXCEL_MAX_ROWS = 1048575
+# 逐行随机数按批生成，临时数组的内存与总行数无关
+GENERATE_CHUNK_ROWS = 1000000
+
+
+def default_cardinalities(n_rows):
+    """按行数给出产品数、客户数和申请人数"""
+    n_products = int(np.clip(n_rows // 2000, 50, 3000))
+    n_customers = int(np.clip(n_rows // 40, 200, 200000))
+    n_applicants = int(np.clip(n_customers // 50, 5, 500))
+    return n_products, n_customers, n_applicants
+
+
+def zipf_weights(n_values, exponent=1.1):
+    """Zipf分布的抽样概率，编码越小越常见"""
+    weights = 1.0 / np.arange(1, n_values + 1) ** exponent
+    return weights / weights.sum()
+
+
+def make_products(rng, n_products):
+    """生成产品代码、产品名称和基础单价，约5%的产品名称不含品牌"""
+    codes = [f"F{i:04X}{chr(65 + i % 26)}" for i in range(n_products)]
+    names, prices = [], []
+    for i in range(n_products):
+        flavor = FLAVORS[rng.integers(len(FLAVORS))]
+        package = PACKAGES[rng.integers(len(PACKAGES))]
+        weight = PACKAGE_WEIGHTS[package][rng.integers(len(PACKAGE_WEIGHTS[package]))]
+        if rng.random() < 0.05:
+            names.append(f"其他{flavor}{weight}{package}")
+        else:
+            # 部分产品名称带有系列号，使简化名称有重复
+            series = "XXL" if rng.random() < 0.1 else ''
+            names.append(f"口力{flavor}{series}{weight}{package}-中国")
+        prices.append(round(float(rng.uniform(80, 250)), 2))
+    return codes, names, np.array(prices)
+
+
+def generate_sales_data(n_rows, seed=0, months=24, end_month='2025-03', n_products=None, n_customers=None,
+                        n_applicants=None):
+    """生成n_rows行模拟销售数据，维度列为分类类型，与数据加载前的原始列相同"""
+    rng = np.random.default_rng(seed)
+    default_products, default_customers, default_applicants = default_cardinalities(n_rows)
+    n_products = n_products or default_products
+    n_customers = n_customers or default_customers
+    n_applicants = n_applicants or default_applicants
+
+    product_codes, product_names, base_prices = make_products(rng, n_products)
+    # 不同产品代码可能同名，名称列单独编码
+    product_name_codes, unique_names = pd.factorize(np.asarray(product_names, dtype=object))
+    product_name_codes = product_name_codes.astype(np.int32)
+    customer_names = [f"{CITIES[i % len(CITIES)]}{CUSTOMER_SUFFIXES[i // len(CITIES) % len(CUSTOMER_SUFFIXES)]}{i:06d}"
+                      for i in range(n_customers)]
+    applicant_names = [f"申请人{i:03d}" for i in range(n_applicants)]
+    # 每个客户固定属于一个区域和一个申请人
+    customer_region = rng.integers(len(REGIONS), size=n_customers).astype(np.int8)
+    customer_applicant = rng.integers(n_applicants, size=n_customers).astype(np.int32)
+
+    month_values = pd.period_range(end=pd.Period(end_month, freq='M'), periods=months, freq='M').to_timestamp()
+    # 近期月份的数据略多
+    month_weights = np.linspace(0.7, 1.3, months)
+    month_weights /= month_weights.sum()
+    product_weights = zipf_weights(n_products)
+    customer_weights = zipf_weights(n_customers, exponent=0.8)
+
+    product = np.empty(n_rows, dtype=np.int32)
+    customer = np.empty(n_rows, dtype=np.int32)
+    month = np.empty(n_rows, dtype=np.int16)
+    order_type = np.empty(n_rows, dtype=np.int8)
+    price = np.empty(n_rows, dtype=np.float64)
+    quantity = np.empty(n_rows, dtype=np.float64)
+    for start in range(0, n_rows, GENERATE_CHUNK_ROWS):
+        part = slice(start, min(start + GENERATE_CHUNK_ROWS, n_rows))
+        size = part.stop - part.start
+        product[part] = rng.choice(n_products, size=size, p=product_weights)
+        customer[part] = rng.choice(n_customers, size=size, p=customer_weights)
+        month[part] = rng.choice(months, size=size, p=month_weights)
+        order_type[part] = rng.choice(len(ORDER_TYPES), size=size, p=ORDER_TYPE_WEIGHTS)
+        price[part] = np.round(base_prices[product[part]] * rng.uniform(0.95, 1.05, size=size), 2)
+        quantity[part] = np.maximum(np.round(rng.lognormal(2.5, 1.0, size=size)), 1)
+
+    return pd.DataFrame({
+        '客户简称': pd.Categorical.from_codes(customer, categories=customer_names),
+        '所属区域': pd.Categorical.from_codes(customer_region[customer], categories=REGIONS),
+        '发运月份': month_values[month],
+        '申请人': pd.Categorical.from_codes(customer_applicant[customer], categories=applicant_names),
+        '产品代码': pd.Categorical.from_codes(product, categories=product_codes),
+        '产品名称': pd.Categorical.from_codes(product_name_codes[product], categories=unique_names),
+        '订单类型': pd.Categorical.from_codes(order_type, categories=ORDER_TYPES),
+        '单价（箱）': price,
+        '数量（箱）': quantity
+    }, copy=False)
+
+
+def write_workbook(df, path):
+    """写出为Excel工作簿，发运月份写为 年-月 文本，与导出的原始数据一致"""
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f"Excel工作表最多 {EXCEL_MAX_ROWS:,} 行数据，当前 {len(df):,} 行")
+    df.assign(发运月份=df['发运月份'].dt.strftime('%Y-%m')).to_excel(path, index=False, engine='xlsxwriter')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成模拟销售数据")
+    parser.add_argument('rows', type=int, help="行数")
+    parser.add_argument('--output', required=True, help="输出文件，按扩展名写出.xlsx或.parquet")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--months', type=int, default=24, help="覆盖的月份数")
+    args = parser.parse_args(argv)
+
+    df = generate_sales_data(args.rows, seed=args.seed, months=args.months)
+    if args.output.lower().endswith('.parquet'):
+        df.to_parquet(args.output, index=False)
+    else:
+        write_workbook(df, args.output)
+    print(f"已写出 {len(df):,} 行到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sales_analytics  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """列式缓存和数据集登记表写到临时目录"""
+    monkeypatch.setattr(sales_analytics, 'CACHE_DIR', str(tmp_path / 'parquet_cache'))
+    monkeypatch.setattr(sales_analytics, 'REGISTRY_PATH', str(tmp_path / 'dataset_registry.json'))
+    return tmp_path
@@ -0,0 +1,46 @@
+"""目录数据集追加新文件时，缓存读回的数据与新导入的数据能够合并"""
+import pandas as pd
+import pytest
+
+import sales_analytics
+from sales_analytics import (PRODUCT_FACT_COLUMNS, DatasetStore, ProductDimension, SharedDatasetPool,
+                             build_sample_data, concat_frames)
+from synthetic_data import generate_sales_data, write_workbook
+
+pytestmark = pytest.mark.skipif(not sales_analytics.PARQUET_AVAILABLE, reason="列式缓存需要pyarrow")
+
+
+def test_append_file_to_cached_store(workspace):
+    data_dir = workspace / 'data'
+    data_dir.mkdir()
+    write_workbook(generate_sales_data(800, seed=1), str(data_dir / 'q1.xlsx'))
+    DatasetStore(str(data_dir)).refresh()
+
+    # 新的数据集从缓存读回q1，q2重新导入
+    write_workbook(generate_sales_data(600, seed=2), str(data_dir / 'q2.xlsx'))
+    store = DatasetStore(str(data_dir))
+    store.refresh()
+
+    assert store.rows == len(store.frame) == 1400
+    for col in PRODUCT_FACT_COLUMNS:
+        assert isinstance(store.frame[col].dtype, pd.CategoricalDtype)
+
+
+def test_concat_frames_mixed_category_dtypes():
+    frames = [pd.DataFrame({'规格': pd.Categorical(pd.Index(['10G', '20G'], dtype=object))}),
+              pd.DataFrame({'规格': pd.Categorical(['20G', '30G'])})]
+    merged = concat_frames(frames)
+    assert list(merged['规格']) == ['10G', '20G', '20G', '30G']
+
+
+def test_shared_pool_keeps_product_dimension():
+    df = build_sample_data()
+    products = ProductDimension.from_frame(df)
+    pool = SharedDatasetPool()
+    handle = pool.attach(df, products=products)
+    assert handle.products is products
+
+    # 没有随数据集传入时首次使用才建立，之后复用同一份
+    other = SharedDatasetPool().attach(df)
+    assert other.products is other.products
+    assert len(other.products) == len(products)
@@ -0,0 +1,30 @@
+"""批量生成的简化产品名称与逐行调用get_simplified_product_name的结果一致"""
+import numpy as np
+import pandas as pd
+
+from sales_analytics import build_sample_data, get_simplified_product_name, simplify_product_names
+
+
+def reference_names(product_codes, product_names):
+    return [get_simplified_product_name(code, name) for code, name in zip(product_codes, product_names)]
+
+
+def test_matches_reference_on_sample_data():
+    df = build_sample_data()
+    codes = df['产品代码'].astype(object)
+    names = df['产品名称'].astype(object)
+    expected = reference_names(codes, names)
+
+    assert simplify_product_names(codes, names).tolist() == expected
+    # 分类列输入与字符串列输入结果相同
+    assert simplify_product_names(df['产品代码'], df['产品名称']).tolist() == expected
+    # 加载时写入的列与参考实现一致
+    assert df['简化产品名称'].astype(object).tolist() == expected
+
+
+def test_matches_reference_on_edge_cases():
+    codes = pd.Series(['F0001A', 'F0002B', 'F0003C', 'F0003C', np.nan, 'F0005E'], dtype=object)
+    names = pd.Series(['其他橡皮糖2KG迷你包', np.nan, '口力比萨XXL45G盒装-中国', '口力比萨68G袋装-中国',
+                       '口力汉堡108G袋装-中国', '口力软糖新品A'], dtype=object)
+
+    assert simplify_product_names(codes, names).tolist() == reference_names(codes, names)
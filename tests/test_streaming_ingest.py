@@ -0,0 +1,70 @@
+"""流式加载逐块汇总的立方体与由整个数据集建立的立方体一致"""
+import functools
+
+import pandas as pd
+import pytest
+
+import sales_analytics
+from sales_analytics import DatasetStore, SalesCube, build_cube_from_cache, compute_file_hash, ingest_workbook
+from synthetic_data import generate_sales_data, write_workbook
+
+STREAMING = {'streaming_threshold_mb': 0}
+
+pytestmark = pytest.mark.skipif(not sales_analytics.PARQUET_AVAILABLE, reason="流式加载需要pyarrow")
+
+
+def assert_same_summaries(cube, expected):
+    for summary in ('region_summary', 'product_summary'):
+        pd.testing.assert_frame_equal(getattr(cube, summary)(None).reset_index(drop=True),
+                                      getattr(expected, summary)(None).reset_index(drop=True))
+    pd.testing.assert_frame_equal(cube.rollup(['包装类型']).reset_index(drop=True),
+                                  expected.rollup(['包装类型']).reset_index(drop=True))
+
+
+@pytest.fixture
+def small_chunks(workspace, monkeypatch):
+    # 数据块较小，使逐块汇总时发生中间合并
+    monkeypatch.setattr(sales_analytics, 'iter_excel_chunks',
+                        functools.partial(sales_analytics.iter_excel_chunks, chunk_rows=500))
+
+
+@pytest.fixture
+def workbook(workspace, small_chunks):
+    path = str(workspace / 'sales.xlsx')
+    write_workbook(generate_sales_data(6000, seed=1), path)
+    return path
+
+
+def test_streamed_cube_matches_frame_cube(workbook):
+    file_hash = compute_file_hash(workbook)
+    cube = ingest_workbook(workbook, file_hash, STREAMING, cube_only=True)
+    frame = ingest_workbook(workbook, file_hash, STREAMING)
+
+    assert cube.rows == len(frame) == 6000
+    assert_same_summaries(cube, SalesCube(frame))
+    assert_same_summaries(build_cube_from_cache(file_hash, chunk_rows=700), SalesCube(frame))
+
+
+def test_cube_only_dataset_store(workbook):
+    store = DatasetStore(workbook, keep_frame=False)
+    store.refresh(ingest=lambda path, file_hash: ingest_workbook(path, file_hash, STREAMING, cube_only=True))
+    assert store.frame is None
+    assert store.rows == 6000
+
+    # 第二次从列式缓存按批汇总
+    cached = DatasetStore(workbook, keep_frame=False)
+    cached.refresh(ingest=lambda path, file_hash: pytest.fail("不应重新解析已缓存的工作簿"))
+    assert_same_summaries(cached.cube, store.cube)
+
+
+def test_column_empty_in_first_chunk(workspace, small_chunks):
+    # 备注只在第一个数据块之后才有值，缓存结构不能取自第一个数据块推断的null类型
+    df = generate_sales_data(1200, seed=2)
+    df['备注'] = [None] * 500 + [f"备注{i}" for i in range(700)]
+    path = str(workspace / 'remarks.xlsx')
+    write_workbook(df, path)
+
+    frame = ingest_workbook(path, compute_file_hash(path), STREAMING)
+    assert len(frame) == 1200
+    assert frame['备注'].isna().sum() == 500
+    assert frame['备注'].iloc[-1] == '备注699'